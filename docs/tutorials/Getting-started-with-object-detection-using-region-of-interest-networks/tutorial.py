@@ -69,13 +69,10 @@ def main():
             (13, 13, 125))
 
         # Do some post-processing to extract the regions from the output of
-        # the model
-        regions = helpers.get_regions(
-            predictions, categories, CONFIDENCE_THRESHOLD, ANCHOR_BOXES)
-
-        # Get rid of any overlapping regions for the same object
-        regions = helpers.non_max_suppression(
-            regions, OVERLAP_THRESHOLD, categories)
+        # the model and get rid of any overlapping regions for the same object
+        regions = helpers.get_detected_regions(
+            predictions, categories, CONFIDENCE_THRESHOLD, ANCHOR_BOXES,
+            OVERLAP_THRESHOLD)
 
         # Draw the regions onto the image
         scale = (scale[0] * image.shape[1], scale[1] * image.shape[0])
@@ -17,7 +17,6 @@ import math
 import platform
 import cv2
 import numpy as np
-from itertools import product
 
 
 # helper function that will find the ELL package if we need it.
@@ -52,18 +51,15 @@ else:
 
 
 def sigmoid(x):
-    "Returns sigmoid activation applied to the input"
-    if x > 0:
-        return 1 / (1 + np.exp(-x))
-    else:
-        ex = np.exp(x)
-        return ex / (1 + ex)
+    "Returns sigmoid activation applied to the input number or array"
+    ex = np.exp(-np.abs(x))
+    return np.where(np.asarray(x) > 0, 1 / (1 + ex), ex / (1 + ex))[()]
 
 
-def softmax(x):
-    "Returns softmax activation applied to the input"
-    e_x = np.exp(x - np.max(x))
-    return e_x / e_x.sum(axis=0)
+def softmax(x, axis=0):
+    "Returns softmax activation applied to the input along the given axis"
+    e_x = np.exp(x - np.max(x, axis=axis, keepdims=True))
+    return e_x / e_x.sum(axis=axis, keepdims=True)
 
 
 def set_camera_resolution(camera, width, height):
@@ -73,7 +69,7 @@ def set_camera_resolution(camera, width, height):
 
 
 def prepare_image_for_model(
-        image, width, height, reorder_to_rgb=False, ravel=True):
+        image, width, height, reorder_to_rgb=False, ravel=True, out=None):
     """Prepare an image for use with a model. Typically, this involves:
         - Resize and center crop to the required width and height while
           preserving the image's aspect ratio.
@@ -81,34 +77,34 @@ def prepare_image_for_model(
           affect the model's ability to classify images.
         - OpenCV gives the image in BGR order, so we may need to re-order the
           channels to RGB.
-        - Optionally, convert the OpenCV result to a std::vector<float> for use
-          with the ELL model.
+        - Optionally, convert the OpenCV result to a flat float32 vector for
+          use with the ELL model. If out is given the values are written into
+          it instead of a new array, so a buffer can be reused across frames.
     """
-    if image.shape[0] > image.shape[1]:  # Tall (more rows than columns)
-        row_start = int((image.shape[0] - image.shape[1]) / 2)
-        row_end = row_start + image.shape[1]
-        col_start = 0
-        col_end = image.shape[1]
-    else:  # Wide (more columns than rows)
-        row_start = 0
-        row_end = image.shape[0]
-        col_start = int((image.shape[1] - image.shape[0]) / 2)
-        col_end = col_start + image.shape[0]
+    size = min(image.shape[0], image.shape[1])
+    row_start = int((image.shape[0] - size) / 2)
+    col_start = int((image.shape[1] - size) / 2)
 
     # Center crop the image maintaining aspect ratio
-    cropped = image[row_start:row_end, col_start:col_end]
+    cropped = image[row_start:row_start + size, col_start:col_start + size]
 
     # Resize to model's requirements
-    resized = cv2.resize(cropped, (height, width))
+    resized = cv2.resize(cropped, (width, height))
+
+    if ravel:
+        # Return as a vector of floats, re-ordering the color channels (if
+        # needed) in the same pass as the conversion
+        if reorder_to_rgb:
+            resized = resized[..., ::-1]
+        if out is None:
+            out = np.empty(resized.size, dtype=np.float32)
+        np.copyto(out.reshape(resized.shape), resized, casting="unsafe")
+        return out
 
     # Re-order color channels if needed
     if reorder_to_rgb:
         resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    if ravel:
-        # Return as a vector of floats
-        result = resized.astype(np.float).ravel()
-        return result
-    return resized, (col_start, row_start), (cropped.shape[1] / width, cropped.shape[0] / height)
+    return resized, (col_start, row_start), (size / width, size / height)
 
 
 def get_top_n(predictions, n=5, threshold=0.20):
@@ -345,6 +341,52 @@ class Region:
         return (x1, y1, x2 - x1, y2 - y1)
 
 
+def decode_regions(inference_output, num_categories, anchor_boxes):
+    """Decodes the whole output tensor of the network at once, returning a
+    tuple of arrays `(boxes, probabilities, category_indices)` with one entry
+    for every anchor box in every cell of the grid, in row, column, anchor box
+    order.
+
+    `boxes` has one `[x, y, w, h]` row per region, in the same normalized
+    coordinates as `Region.location`.
+
+    `num_categories` is the number of categories the network detects.
+
+    `anchor_boxes` is the list of anchor boxes that are used to augment the
+    bounding boxes.
+    """
+    rows, cols, channels = inference_output.shape
+    # four values for the bounding box coordinates plus one for the confidence
+    # the rest of the values are the probabilities for the individual
+    # categories.  The order for each region is `[x, y, w, h, c, category
+    # probabilities...]` and there are `num_boxes` regions for each cell.
+    box_size = 5 + num_categories
+    num_boxes = channels // box_size
+    output = np.reshape(inference_output[:, :, :num_boxes * box_size],
+                        (rows, cols, num_boxes, box_size))
+    anchors = np.reshape(anchor_boxes, (-1, 2))[:num_boxes]
+    i = np.arange(rows).reshape(rows, 1, 1)
+    j = np.arange(cols).reshape(1, cols, 1)
+
+    # The X and Y values need to have sigmoid activation applied, and the
+    # width and height need to be exponentiated
+    x = (j + sigmoid(output[..., 0])) / rows
+    y = (i + sigmoid(output[..., 1])) / cols
+    w = np.exp(output[..., 2]) * anchors[:, 0] / rows
+    h = np.exp(output[..., 3]) * anchors[:, 1] / cols
+    confidence = output[..., 4]
+
+    # The category scores have not had softmax applied to them, so apply
+    # softmax and find the index of the largest value in each region
+    category_scores = softmax(output[..., 5:], axis=-1)
+    category_indices = np.argmax(category_scores, axis=-1)
+    probabilities = confidence * np.max(category_scores, axis=-1)
+
+    boxes = np.stack((x - (w / 2), y - (h / 2), w, h), axis=-1)
+    return (boxes.reshape(-1, 4), probabilities.ravel(),
+            category_indices.ravel())
+
+
 def get_regions(inference_output, categories, threshold, anchor_boxes):
     """Returns an array of Region instances that represent detected objects
     and their locations.
@@ -362,54 +404,57 @@ def get_regions(inference_output, categories, threshold, anchor_boxes):
     `anchor_boxes` is the list of anchor boxes that are used to augment the
     bounding boxes.
     """
+    boxes, probabilities, category_indices = decode_regions(
+        inference_output, len(categories), anchor_boxes)
 
-    regions = []
-    shape = inference_output.shape
-    # four values for the bounding box coordinates plus one for the confidence
-    # the rest of the values are the probabilities for the individual
-    # categories
-    box_size = 5 + len(categories)
-    num_boxes = shape[2] // box_size
-    for i, j, c in product(range(shape[0]),
-                           range(shape[1]),
-                           range(num_boxes)):
-        # The coordinates and confidence values need to be "unpacked".
-        # The order for each region is `[x, y, w, h, c,
-        # category probabilities...]`. There are `num_boxes` regions for each
-        # `i, j` coordinate pair.
-        box_offset = c * box_size
-        # The X and Y values need to have sigmoid activation applied
-        predicted_x = sigmoid(inference_output[i, j, box_offset + 0])
-        predicted_y = sigmoid(inference_output[i, j, box_offset + 1])
-        # The width and height need to be exponentiated
-        predicted_width = np.exp(inference_output[i, j, box_offset + 2])
-        predicted_height = np.exp(inference_output[i, j, box_offset + 3])
-        predicted_confidence = inference_output[i, j, box_offset + 4]
-
-        # Get the final normalized values for the coordinates of the bounding
-        # box
-        x = (j + predicted_x) / shape[0]
-        y = (i + predicted_y) / shape[1]
-        w = predicted_width * anchor_boxes[2 * c + 0] / shape[0]
-        h = predicted_height * anchor_boxes[2 * c + 1] / shape[1]
-        confidence = predicted_confidence
-
-        # The `category_scores` have not had softmax applied to them, so just
-        # apply softmax and find the index of the largest value and get the
-        # corresponding category label.
-        category_scores = softmax(inference_output[i,
-                                                   j,
-                                                   box_offset + 5 :
-                                                   box_offset + box_size])
-        category_index = np.argmax(category_scores)
-        probability = confidence * category_scores[category_index]
-
-        # Only add to the list of returned regions if the probability is
-        # greater than the threshold
-        if probability > threshold:
-            regions.append(Region(categories[category_index], probability,
-                                  (x - (w/2), y - (h/2), w, h)))
-    return regions
+    # Only return the regions whose probability is greater than the threshold
+    keep = np.flatnonzero(probabilities > threshold)
+    return [Region(categories[category_indices[k]], probabilities[k],
+                   boxes[k]) for k in keep]
+
+
+def non_max_suppression_indices(boxes, probabilities, category_indices,
+                                overlap_threshold):
+    """Given arrays of `boxes`, `probabilities` and `category_indices` (as
+    returned by `decode_regions`), returns the indices of the boxes to keep
+    after removing overlapping boxes for the same object, in order of
+    decreasing probability.
+
+    Two boxes of the same category are considered the same object when their
+    intersection covers more than `overlap_threshold` of the area of each box.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    probabilities = np.asarray(probabilities)
+    category_indices = np.asarray(category_indices)
+
+    # We want the regions with the highest probability to be considered
+    # the "main" regions
+    order = np.argsort(probabilities, kind="stable")[::-1]
+    boxes = boxes[order]
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    # The intersection of every pair of boxes, if either the width or height
+    # is `<= 0` then there is no overlap
+    overlap_width = np.minimum(x2[:, None], x2) - np.maximum(x1[:, None], x1)
+    overlap_height = np.minimum(y2[:, None], y2) - np.maximum(y1[:, None], y1)
+    intersection = (np.maximum(overlap_width, 0) *
+                    np.maximum(overlap_height, 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        suppress = ((intersection / areas > overlap_threshold) &
+                    (intersection / areas[:, None] > overlap_threshold))
+    suppress &= category_indices[order][:, None] == category_indices[order]
+
+    # Greedily keep the most probable remaining box and remove all the boxes
+    # it overlaps with
+    removed = np.zeros(len(order), dtype=bool)
+    pick = []
+    for i in range(len(order)):
+        if not removed[i]:
+            pick.append(i)
+            removed |= suppress[i]
+    return order[pick]
 
 
 def non_max_suppression(regions, overlap_threshold, categories):
@@ -422,61 +467,40 @@ def non_max_suppression(regions, overlap_threshold, categories):
     `categories` is a list of categories that represent the type of objects to
     be detected.
     """
-
+    # Only look at regions of the given categories
+    regions = [region for region in regions if region.category in categories]
     if not regions:
         # If list of regions is empty, return an empty list
         return []
 
-    final_regions = []
-    for c in categories:
-        # Only look at regions that have found the same object
-        filtered_regions = [
-            region for region in regions if region.category == c]
-        if len(filtered_regions) < 2:
-            continue
-
-        # Get all the boxes that represent the object in question
-        boxes = np.array([region.location for region in filtered_regions])
-
-        # Calculate the areas once
-        areas = boxes[:, 2] * boxes[:, 3]
-
-        # `argsort` returns the indices in ascending order
-        # We want the regions with the highest probability to be considered
-        # the "main" regions
-        sorted_indices = np.argsort([r.probability for r in filtered_regions])
-        pick = []
-        while len(sorted_indices):
-            last = len(sorted_indices) - 1
-            i = sorted_indices[last]
-            pick.append(i)
-            suppress = [last]
-            for pos in range(last):
-                j = sorted_indices[pos]
-
-                intersection = filtered_regions[i].intersect(filtered_regions[j])
-
-                overlap_width = intersection[2]
-                overlap_height = intersection[3]
-
-                # If either `overlap_width` or `overlap_height` are `<= 0`
-                # then that means there's no overlap
-                if overlap_width > 0 and overlap_height > 0:
-                    overlap1 = overlap_width * overlap_height / areas[j]
-                    overlap2 = overlap_width * overlap_height / areas[i]
-
-                    # If there's enough overlap, we want to remove this box
-                    if overlap1 > overlap_threshold and overlap2 > overlap_threshold:
-                        suppress.append(pos)
-
-            # Remove all the values that are at the list of indices of
-            # `suppress` and return the resultant array
-            sorted_indices = np.delete(sorted_indices, suppress)
-
-        # Append to `final_regions` the main bounding boxes
-        final_regions += [filtered_regions[i] for i in pick]
-
-    return final_regions
+    boxes = np.array([region.location for region in regions])
+    probabilities = np.array([region.probability for region in regions])
+    category_indices = np.array(
+        [categories.index(region.category) for region in regions])
+    keep = non_max_suppression_indices(boxes, probabilities, category_indices,
+                                       overlap_threshold)
+    return [regions[k] for k in sorted(keep, key=lambda k: (
+        category_indices[k], -probabilities[k]))]
+
+
+def get_detected_regions(inference_output, categories, threshold,
+                         anchor_boxes, overlap_threshold):
+    """Returns the same regions, in the same order, as calling `get_regions`
+    followed by `non_max_suppression` with the same `categories`: grouped by
+    category in the order of `categories`, and by decreasing probability
+    within each category.  The thresholding and suppression are done on the
+    decoded arrays so `Region` instances are only created for the regions
+    that survive.
+    """
+    boxes, probabilities, category_indices = decode_regions(
+        inference_output, len(categories), anchor_boxes)
+    candidates = np.flatnonzero(probabilities > threshold)
+    keep = candidates[non_max_suppression_indices(
+        boxes[candidates], probabilities[candidates],
+        category_indices[candidates], overlap_threshold)]
+    keep = sorted(keep, key=lambda k: (category_indices[k], -probabilities[k]))
+    return [Region(categories[category_indices[k]], probabilities[k],
+                   boxes[k]) for k in keep]
 
 
 def draw_regions_on_image(image, regions, offset, scale):
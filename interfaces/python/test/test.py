@@ -21,6 +21,7 @@ try:
     import dataset_test
     import vector_test
     import compiled_model_test
+    import tutorial_helpers_test
 
     tests = [
         (functions_test.test,       "functions_test"),
@@ -36,6 +37,7 @@ try:
         (modelbuilder_test.test,    "modelbuilder_test"),
         (protonn_trainer_test.test, "protonn_trainer_test"),
         (compiled_model_test.test,  "compiled_model_test"), # must come after protonn_trainer_test because it depends on the model generated by that test.
+        (tutorial_helpers_test.test, "tutorial_helpers_test"),
     ]
 except ImportError as err:
     if "Could not find ell package" in str(err):
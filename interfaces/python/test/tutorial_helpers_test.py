@@ -0,0 +1,117 @@
+import numpy as np
+import ell_helper
+import ell
+from ell.util import tutorialHelpers as helpers
+from testing import Testing
+
+CATEGORIES = ["cat", "dog", "car", "bike", "person"]
+ANCHOR_BOXES = [1.08, 1.19, 3.42, 4.41, 6.63, 11.38, 9.42, 5.11, 16.62, 10.52]
+
+
+def original_get_regions(inference_output, categories, threshold, anchor_boxes):
+    """The original get_regions, which decoded one cell and anchor box at a time"""
+    regions = []
+    shape = inference_output.shape
+    box_size = 5 + len(categories)
+    num_boxes = shape[2] // box_size
+    for i in range(shape[0]):
+        for j in range(shape[1]):
+            for c in range(num_boxes):
+                box_offset = c * box_size
+                predicted_x = helpers.sigmoid(inference_output[i, j, box_offset + 0])
+                predicted_y = helpers.sigmoid(inference_output[i, j, box_offset + 1])
+                predicted_width = np.exp(inference_output[i, j, box_offset + 2])
+                predicted_height = np.exp(inference_output[i, j, box_offset + 3])
+                confidence = inference_output[i, j, box_offset + 4]
+                x = (j + predicted_x) / shape[0]
+                y = (i + predicted_y) / shape[1]
+                w = predicted_width * anchor_boxes[2 * c + 0] / shape[0]
+                h = predicted_height * anchor_boxes[2 * c + 1] / shape[1]
+                category_scores = helpers.softmax(inference_output[i, j, box_offset + 5:box_offset + box_size])
+                category_index = np.argmax(category_scores)
+                probability = confidence * category_scores[category_index]
+                if probability > threshold:
+                    regions.append(helpers.Region(categories[category_index], probability,
+                                                  (x - (w / 2), y - (h / 2), w, h)))
+    return regions
+
+
+def original_non_max_suppression(regions, overlap_threshold, categories):
+    """The original per category non_max_suppression loop, except that a category detected only once is kept
+    (the original skipped categories with fewer than 2 regions)"""
+    final_regions = []
+    for c in categories:
+        filtered_regions = [region for region in regions if region.category == c]
+        if not filtered_regions:
+            continue
+        boxes = np.array([region.location for region in filtered_regions])
+        areas = boxes[:, 2] * boxes[:, 3]
+        sorted_indices = np.argsort([r.probability for r in filtered_regions], kind="stable")
+        pick = []
+        while len(sorted_indices):
+            last = len(sorted_indices) - 1
+            i = sorted_indices[last]
+            pick.append(i)
+            suppress = [last]
+            for pos in range(last):
+                j = sorted_indices[pos]
+                intersection = filtered_regions[i].intersect(filtered_regions[j])
+                overlap_width = intersection[2]
+                overlap_height = intersection[3]
+                if overlap_width > 0 and overlap_height > 0:
+                    overlap1 = overlap_width * overlap_height / areas[j]
+                    overlap2 = overlap_width * overlap_height / areas[i]
+                    if overlap1 > overlap_threshold and overlap2 > overlap_threshold:
+                        suppress.append(pos)
+            sorted_indices = np.delete(sorted_indices, suppress)
+        final_regions += [filtered_regions[i] for i in pick]
+    return final_regions
+
+
+def make_output(seed):
+    """A random 13x13x50 network output with a few confident regions clustered together"""
+    rng = np.random.RandomState(seed)
+    output = rng.normal(0, 1, (13, 13, 5 * (5 + len(CATEGORIES))))
+    output[..., 4::10] = rng.uniform(0, 0.3, (13, 13, 5))
+    output[4:8, 4:8, 4::10] = rng.uniform(0.5, 1, (4, 4, 5))
+    output[4:8, 4:8, 5::10] += 4
+    return output
+
+
+def same_regions(expected, actual):
+    if len(expected) != len(actual):
+        return False
+    for e, a in zip(expected, actual):
+        if e.category != a.category or not np.isclose(e.probability, a.probability, rtol=1e-12) or \
+                not np.allclose(e.location, a.location, rtol=1e-12):
+            return False
+    return True
+
+
+def test_regions(testing):
+    for seed in range(5):
+        output = make_output(seed)
+        expected = original_get_regions(output, CATEGORIES, 0.2, ANCHOR_BOXES)
+        actual = helpers.get_regions(output, CATEGORIES, 0.2, ANCHOR_BOXES)
+        testing.ProcessTest("get_regions matches the original, seed {}".format(seed),
+                            len(expected) > 10 and same_regions(expected, actual))
+
+        expected = original_non_max_suppression(expected, 0.3, CATEGORIES)
+        testing.ProcessTest("non_max_suppression matches the original, seed {}".format(seed),
+                            same_regions(expected, helpers.non_max_suppression(actual, 0.3, CATEGORIES)))
+
+        detected = helpers.get_detected_regions(output, CATEGORIES, 0.2, ANCHOR_BOXES, 0.3)
+        testing.ProcessTest("get_detected_regions matches get_regions and non_max_suppression, seed {}".format(
+                            seed), same_regions(expected, detected))
+
+
+def test():
+    testing = Testing()
+    test_regions(testing)
+    if testing.DidTestFail():
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    test()
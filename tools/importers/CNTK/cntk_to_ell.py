@@ -221,7 +221,7 @@ def verify_ell_nodes_in_vision_model(ell_map, cntk_model, cntk_nodes, ordered_im
         ell_input_tensor = cntk_input_tensor
         if len(cntk_model.arguments[0].shape) == 1:
             ell_input_tensor = cntk_input_tensor.reshape((1,1,cntk_model.arguments[0].shape[0]))
-        ell_input_tensor = memory_shapes.get_tensor_in_ell_order(ell_input_tensor, "channel_row_column").ravel().astype(np.float32)
+        ell_input_tensor = memory_shapes.get_tensor_in_ell_order(ell_input_tensor, "channel_row_column", np.float32).ravel()
 
         # For convenient lookup, map from the cntk intermediate node to the
         # importer node
@@ -330,7 +330,7 @@ def verify_ell_output_in_vision_model(ell_map, cntk_model, testing_info):
     _logger.info("Verification of model output starting")
     try:
         cntk_input_tensor = np.random.random((cntk_model.arguments[0].shape)).astype(np.float32) * 255
-        ell_input_tensor = memory_shapes.get_tensor_in_ell_order(cntk_input_tensor, "channel_row_column").ravel().astype(np.float32)
+        ell_input_tensor = memory_shapes.get_tensor_in_ell_order(cntk_input_tensor, "channel_row_column", np.float32).ravel()
 
         # Get output from CNTK model
         cntk_output = get_output_from_cntk_model(cntk_model, cntk_input_tensor, testing_info)
@@ -371,7 +371,7 @@ def verify_ell_output_in_vision_model(ell_map, cntk_model, testing_info):
         _logger.info("Sending {} frames through model...".format(num_frames))
         for i in range(num_frames):
             cntk_input_tensor = np.random.random((cntk_model.arguments[0].shape)).astype(np.float32) * 255
-            ell_input_tensor = memory_shapes.get_tensor_in_ell_order(cntk_input_tensor, "channel_row_column").ravel().astype(np.float32)
+            ell_input_tensor = memory_shapes.get_tensor_in_ell_order(cntk_input_tensor, "channel_row_column", np.float32).ravel()
             start = time.time()
             result_from_compiled = np.array(compiled_ell_map.Compute(ell_input_tensor, dtype=np.float32))
             end = time.time()
@@ -396,7 +396,7 @@ def verify_compiled_ell_nodes_in_vision_model(modelFile, cntk_model, model_cntk_
     ell_input_tensor = cntk_input_tensor
     if len(cntk_model.arguments[0].shape) == 1:
         ell_input_tensor = cntk_input_tensor.reshape((1,1,cntk_model.arguments[0].shape[0]))
-    ell_input_tensor = memory_shapes.get_tensor_in_ell_order(ell_input_tensor, "channel_row_column").ravel().astype(np.float32)
+    ell_input_tensor = memory_shapes.get_tensor_in_ell_order(ell_input_tensor, "channel_row_column", np.float32).ravel()
 
     cntk_nodes = [cntk_nodes_map[ordered_importer_nodes[0].id]]
     for i in range(1, len(ordered_importer_nodes)):
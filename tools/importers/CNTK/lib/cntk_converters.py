@@ -28,10 +28,9 @@ from common.importer import *
 _logger = logging.getLogger(__name__)
 
 def get_vector_from_constant(constant, size):
-    # Workaround: For some reason, np.full is not returning a type that SWIG can parse. So just manually walk the array setting the scalar
-    array = np.zeros(size, dtype=np.float)
-    for i in range(array.size):
-        array[i] = constant
+    # Workaround: For some reason, np.full is not returning a type that SWIG can parse. So fill a float64 array of zeros instead
+    array = np.zeros(size, dtype=np.float64)
+    array[...] = constant
     return array
 
 
@@ -114,6 +114,9 @@ class LookupTable:
         # Stores output nodes When creating an ELL map from an ELL model,
         # map inputs must be identified.
         self.output_ell_nodes = []
+        # Stores mapping of (tensor id, dtype) to a tuple containing the
+        # tensor the array was created from, and the array in ELL order
+        self.ell_order_cache = {}
 
     def add_imported_ell_node(self, importer_node: ImporterNode, ell_node: ell.nodes.Node, set_group_id=True):
         """
@@ -177,37 +180,22 @@ class LookupTable:
                 node = self.ell_id_to_ell_nodes[id]
         return node
 
-    def get_tensor_in_ell_order(self, uid: str):
+    def get_tensor_in_ell_order(self, uid: str, dtype=None):
         """
-        Returns a numpy array in ELL order
+        Returns a numpy array in ELL order, converted to the given dtype, or
+        in the dtype of the original tensor if dtype is None. The reordered
+        array is cached, so converters asking for the same tensor again get
+        the same array back, which must therefore not be modified in place.
         """
         if not uid in self.tensors:
             raise Exception("Required tensor {} not found".format(uid))
         original_tensor, order = self.tensors[uid]
 
-        return memory_shapes.get_tensor_in_ell_order(original_tensor, order)
-        # original_shape = original_tensor.shape
-        # if order == "filter_channel_row_column":
-        #     ordered_weights = np.moveaxis(original_tensor, 1, -1)
-        #     ordered_weights = ordered_weights.ravel().astype(np.float).reshape(
-        #         original_shape[0] * original_shape[2], original_shape[3], original_shape[1])
-        # elif order == "row_column":
-        #     ordered_weights = np.moveaxis(original_tensor, 0, -1)
-        #     ordered_weights = ordered_weights.ravel().astype(
-        #         np.float).reshape(original_shape[1], original_shape[0], 1)
-        # elif order == "channel":
-        #     ordered_weights = original_tensor.ravel().astype(
-        #         np.float).reshape(1, 1, original_shape.size)
-        # elif order == "channel_row_column_filter":
-        #     ordered_weights = np.moveaxis(original_tensor, 0, -1)
-        #     ordered_weights = np.moveaxis(ordered_weights, 2, 0)
-        #     ordered_weights = ordered_weights.ravel().astype(np.float).reshape(
-        #     original_shape[3] * original_shape[1], original_shape[2], original_shape[0])
-        # else:
-        #     raise NotImplementedError(
-        #         "Unsupported tensor order {}, for {}".format(order, uid))
-
-        # return ordered_weights
+        def reorder():
+            if dtype is None:
+                return memory_shapes.reorder_tensor_to_ell(original_tensor, order)
+            return memory_shapes.get_tensor_in_ell_order(original_tensor, order, dtype)
+        return self.get_cached_array(uid, dtype, original_tensor, reorder)
 
     def get_vector_from_constant(self, uid: str, size: int):
         """
@@ -217,30 +205,61 @@ class LookupTable:
         """
         original_vector, order = self.tensors[uid]
         # Workaround: For some reason, np.full is not returning a type that SWIG can parse.
-        # So just manually walk the array setting the scalar
-        array = np.zeros(size, dtype=np.float)
-        for i in range(array.size):
-            array[i] = original_vector
+        # So fill a float64 array of zeros with the scalar instead.
+        array = np.zeros(size, dtype=np.float64)
+        array[...] = original_vector
         return array
 
-    def get_vector_in_ell_order(self, uid: str):
+    def get_vector_in_ell_order(self, uid: str, dtype=None):
         """
         Returns a single dimensional numpy array containing the tensor weights.
+        Like get_tensor_in_ell_order, the result is cached and keeps the
+        dtype of the original tensor if dtype is None.
         """
         original_vector, order = self.tensors[uid]
 
-        ordered_weights = np.zeros(original_vector.size, dtype=np.float)
-        i = 0
-        for value in original_vector:
-            ordered_weights[i] = value
-            i += 1
+        def flatten():
+            if dtype is None:
+                return np.ravel(original_vector)
+            return np.array(original_vector, dtype=dtype, order="C").ravel()
+        return self.get_cached_array(uid, dtype, original_vector, flatten)
 
-        return ordered_weights
+    def get_cached_array(self, uid: str, dtype, original_tensor, create):
+        """
+        Returns the array previously created from the given tensor with the
+        given dtype, or calls create to make it. The cache entry is replaced
+        if the tensor stored under uid has changed since.
+        """
+        key = (uid, None if dtype is None else np.dtype(dtype))
+        entry = self.ell_order_cache.get(key)
+        if entry is None or entry[0] is not original_tensor:
+            entry = (original_tensor, create())
+            self.ell_order_cache[key] = entry
+        return entry[1]
+
+    def release_tensor(self, uid: str):
+        """
+        Drops the cached arrays for the tensor, and releases it from the
+        tensor store if the store supports that (see TensorStore.release).
+        """
+        for key in [key for key in self.ell_order_cache if key[0] == uid]:
+            del self.ell_order_cache[key]
+        if hasattr(self.tensors, "release"):
+            self.tensors.release(uid)
+
+    def clear_cache(self):
+        """
+        Drops the cached tensors returned by get_tensor_in_ell_order and
+        get_vector_in_ell_order.
+        """
+        self.ell_order_cache = {}
 
     def get_tensor_info(self, uid: str):
         """
         Returns a tuple containing (shape, order) for the tensor.
         """
+        if hasattr(self.tensors, "get_info"):
+            return self.tensors.get_info(uid)
         value, order = self.tensors[uid]
         return (value.shape, order)
 
@@ -417,12 +436,12 @@ class ConvertBase:
         Returns a weight tensor as an ELL tensor
         """
         lookup_table = conversion_parameters["lookup_table"]
-        return ell.math.DoubleTensor(lookup_table.get_tensor_in_ell_order(uid))
+        return ell.math.DoubleTensor(lookup_table.get_tensor_in_ell_order(uid, np.float64))
 
     def get_vector(self, uid: str, conversion_parameters: typing.Mapping[str, typing.Any]):
         """
-        Returns a weight tensor as a 1 dimensional numpy array. If the
-        original tensor is a scalar, it will be expanded to a vector of size
+        Returns a weight tensor as a 1 dimensional float64 numpy array for
+        ELL. If the original tensor is a scalar, it will be expanded to a vector of size
         equal to the number of output channels.
         """
         lookup_table = conversion_parameters["lookup_table"]
@@ -433,7 +452,7 @@ class ConvertBase:
             ell_shape = self.get_ell_shape(shape_entry[0], shape_entry[1], 0)
             vector = lookup_table.get_vector_from_constant(uid, ell_shape.channels)
         else:
-            vector = lookup_table.get_vector_in_ell_order(uid)
+            vector = lookup_table.get_vector_in_ell_order(uid, np.float64)
 
         return vector
 
@@ -1731,12 +1750,13 @@ class ConvertReshape(ConvertBase):
 
 class ConvertConstant(ConvertBase):
     """
-    Converter for Constant nodes
+    Converter for Constant nodes. The value is either the 'tensor' attribute
+    or, for constants that refer to a tensor of the model, the 'tensor' weight.
     """
     def __init__(self, node: ImporterNode):
         super().__init__(node)
         self.required_weights = []
-        self.required_attributes = [ 'tensor' ]
+        self.required_attributes = []
 
     def convert(self, conversion_parameters: typing.Mapping[str, typing.Any]):
         """
@@ -1752,7 +1772,10 @@ class ConvertConstant(ConvertBase):
         model = conversion_parameters["model"]
         builder = conversion_parameters["builder"]
         lookup_table = conversion_parameters["lookup_table"]
-        tensor = self.importer_node.attributes["tensor"]
+        if "tensor" in self.importer_node.weights:
+            tensor, _ = lookup_table.tensors[self.importer_node.weights["tensor"][0]]
+        else:
+            tensor = self.importer_node.attributes["tensor"]
         port_type = ell.nodes.PortType.real
         if tensor.dtype == np.float32:
             port_type = ell.nodes.PortType.smallReal
@@ -8,6 +8,8 @@
 #
 ####################################################################################################
 
+import collections.abc
+import heapq
 import itertools
 import os
 import sys
@@ -84,6 +86,100 @@ operation_map = {
     "Cast": ConvertTypeCast,
     }
 
+class LazyTensor:
+    """
+    A tensor in a TensorStore that has not been loaded yet. The loader is a
+    function taking no arguments that returns the tensor value.
+    """
+    def __init__(self, loader: typing.Callable[[], typing.Any], shape: tuple, order: str):
+        self.loader = loader
+        self.shape = tuple(shape)
+        self.order = order
+
+class TensorStore(collections.abc.MutableMapping):
+    """
+    A mapping of tensor id to a (tensor value, tensor order) tuple. Tensors
+    can also be added as a LazyTensor, in which case the value is only loaded
+    the first time the tensor is looked up, and can be released again once it
+    is no longer needed.
+    """
+    def __init__(self):
+        # Stores mapping of tensor id to a (value, order) tuple or LazyTensor
+        self.entries = {}
+        # Stores mapping of lazy tensor id to its loaded (value, order) tuple
+        self.loaded = {}
+
+    def __getitem__(self, name: str):
+        entry = self.entries[name]
+        if not isinstance(entry, LazyTensor):
+            return entry
+        t = self.loaded.get(name)
+        if t is None:
+            t = (entry.loader(), entry.order)
+            self.loaded[name] = t
+        return t
+
+    def __setitem__(self, name: str, t: tuple):
+        self.loaded.pop(name, None)
+        self.entries[name] = t
+
+    def __delitem__(self, name: str):
+        del self.entries[name]
+        self.loaded.pop(name, None)
+
+    def __contains__(self, name):
+        # don't load the tensor the way Mapping.__contains__ would
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_lazy(self, name: str, loader: typing.Callable[[], typing.Any], shape: tuple, order: str):
+        """
+        Adds a tensor whose value is created by calling loader when it is
+        first looked up.
+        """
+        self[name] = LazyTensor(loader, shape, order)
+
+    def is_loaded(self, name: str):
+        """
+        Returns whether the tensor value is currently in memory.
+        """
+        return not isinstance(self.entries[name], LazyTensor) or name in self.loaded
+
+    def get_info(self, name: str):
+        """
+        Returns a tuple containing (shape, order) for the tensor without
+        loading it.
+        """
+        entry = self.entries[name]
+        if isinstance(entry, LazyTensor):
+            return (entry.shape, entry.order)
+        value, order = entry
+        return (value.shape, order)
+
+    def release(self, name: str):
+        """
+        Drops the loaded value of a lazy tensor, it is loaded again the next
+        time it is looked up. Other tensors can't be reloaded, so they are
+        kept.
+        """
+        self.loaded.pop(name, None)
+
+    def get_loader(self, name: str):
+        """
+        Returns a function that returns the value of the tensor without
+        keeping it loaded, so other lazy tensors can be derived from it.
+        """
+        entry = self.entries[name]
+        if isinstance(entry, LazyTensor):
+            return entry.loader
+        value = entry[0]
+        return lambda: value
+
 class ImporterModel:
     """
     Defines a class that holds the nodes and tensors to be imported.
@@ -92,16 +188,55 @@ class ImporterModel:
     """
     def __init__(self):
         self.nodes = {}
-        self.tensors = {}
+        self.tensors = TensorStore()
 
     def add_tensor(self, name: str, value: typing.Any, order: str) -> None:
         t = (value, order)
         self.tensors[name] = t
         return t
 
+    def add_lazy_tensor(self, name: str, loader: typing.Callable[[], typing.Any], shape: tuple, order: str) -> None:
+        """
+        Adds a tensor that is only loaded (by calling loader) when it is first
+        needed, see TensorStore.
+        """
+        self.tensors.add_lazy(name, loader, shape, order)
+
     def add_node(self, name: str, node: ImporterNode) -> None:
         self.nodes[name] = node
 
+class ImporterGraphIndex:
+    """
+    Producer and consumer maps over a mapping of ImporterNodes, built once so
+    that the graph queries in one ordering or padding pass don't have to scan
+    every node. The lists in each map keep the iteration order of the nodes
+    mapping. The index is a snapshot, it does not follow nodes being added,
+    replaced or having their inputs edited, so build a new one for each pass.
+    """
+    def __init__(self, nodes: typing.Mapping[str, ImporterNode]):
+        self.producers = {}
+        self.consumers = {}
+        self.nodes_by_type = {}
+        for node in nodes.values():
+            for output_id in node.outputs:
+                self.producers.setdefault(output_id, []).append(node)
+            # a node that uses the same input twice is only listed once
+            for input_id in dict.fromkeys(node.inputs):
+                self.consumers.setdefault(input_id, []).append(node)
+            self.nodes_by_type.setdefault(node.operation_type, []).append(node)
+
+    def find_nodes_with_input(self, node_id: str):
+        """
+        Returns the nodes containing node_id as an input.
+        """
+        return list(self.consumers.get(node_id, []))
+
+    def get_nodes_of_type(self, operation_type: str):
+        """
+        Returns nodes of matching importer operation_type.
+        """
+        return list(self.nodes_by_type.get(operation_type, []))
+
 class ImporterEngine:
     """
     The common class for doing an import to ELL. The ImporterEngine converts
@@ -155,9 +290,13 @@ class ImporterEngine:
         _logger.info("Converting intermediate importer nodes to ELL layers....")
         # For now, convert to ELL layers. Later, we will convert to ELL nodes.
         layers = []
+        weight_uses = self.get_weight_use_counts(ordered_nodes)
         for node_to_import in ordered_nodes:
             converted = self.convert_importer_node_to_ell_layers(node_to_import)
             layers += converted
+            self.release_weights(node_to_import, weight_uses)
+        # The ELL layers hold their own copies of the weights now
+        self.lookup_table.clear_cache()
         _logger.info("Done.")
 
         return layers
@@ -219,8 +358,12 @@ class ImporterEngine:
             _logger.info(ordered_node)
 
         _logger.info("Converting intermediate importer nodes to ELL nodes....")
+        weight_uses = self.get_weight_use_counts(ordered_nodes)
         for node_to_import in ordered_nodes:
             converted = self.convert_importer_node_to_ell_nodes(node_to_import)
+            self.release_weights(node_to_import, weight_uses)
+        # The ELL nodes hold their own copies of the weights now
+        self.lookup_table.clear_cache()
         _logger.info("Done.")
 
         # Quick workaround to create the map's output node. The last node in
@@ -328,36 +471,113 @@ class ImporterEngine:
 
         return
 
+    def get_weight_use_counts(self, nodes: typing.Sequence[ImporterNode]):
+        """
+        Returns a mapping of tensor id to the number of the given nodes that
+        use it as a weight.
+        """
+        uses = {}
+        for node in nodes:
+            for uid in set(weight[0] for weight in node.weights.values()):
+                uses[uid] = uses.get(uid, 0) + 1
+        return uses
+
+    def release_weights(self, node: ImporterNode, uses: typing.Mapping[str, int]):
+        """
+        Called once the node has been converted, releases the weight tensors
+        that no remaining node uses. The converted ELL nodes and layers hold
+        their own copies of the weights.
+        """
+        for uid in set(weight[0] for weight in node.weights.values()):
+            uses[uid] -= 1
+            if uses[uid] == 0:
+                self.lookup_table.release_tensor(uid)
+
     def get_nodes_in_import_order(self, nodes: typing.Mapping[str, typing.Any]):
         """
         Returns the nodes in an order that is suitable to import. That means
         each node is guaranteed to appear after the nodes it relies on.
+
+        The order is defined by repeated passes over the pending nodes (in
+        the order of the nodes mapping), where each pass imports every node
+        whose inputs are available when it is reached, except that the node
+        right after one that was just imported is left for the next pass.
+        Rather than rescanning every pending node on every pass, this keeps
+        a count of the unavailable inputs of each node, Kahn's algorithm
+        style, and only visits the nodes that became ready, so the cost is
+        O(n log n) instead of O(n^2) or worse.
         """
-        pending_nodes = list(nodes.values())
+        node_list = list(nodes.values())
+        count = len(node_list)
+        index = ImporterGraphIndex(nodes)
+
+        # pending nodes form a linked list in their original order.
+        next_pending = list(range(1, count + 1))
+        prev_pending = list(range(-1, count - 1))
+        position = {id(node): i for i, node in enumerate(node_list)}
+        missing = [len(set(node.inputs)) for node in node_list]
+        imported = [False] * count
+        outputs_available = set()
+        skipped_in_pass = [-1] * count
+
         ordered_nodes = []
-        node_processed = len(pending_nodes) > 0
-        outputs_available = {}
-        while node_processed:
+        ready = [i for i in range(count) if missing[i] == 0 and node_list[i].operation_type != "Skip"]
+        pass_number = 0
+        while ready:
+            # each pass visits the ready nodes in their original order
+            heapq.heapify(ready)
+            deferred = []
             node_processed = False
-            for current_node in pending_nodes:
-                # Find a node which already has all of its input nodes in the ordered list.
-                if current_node.operation_type != "Skip":
-                    if all((input_id in outputs_available) for input_id in current_node.inputs):
-                        pending_nodes.remove(current_node)
-                        ordered_nodes.append(current_node)
-                        node_processed = True
-                        for o in current_node.outputs:
-                            outputs_available[o] = True
-
-        pending_nodes = [n for n in pending_nodes if n.operation_type != "Skip"]
+            while ready:
+                i = heapq.heappop(ready)
+                if skipped_in_pass[i] == pass_number:
+                    deferred.append(i)
+                    continue
+                node = node_list[i]
+                imported[i] = True
+                ordered_nodes.append(node)
+                node_processed = True
+
+                # remove it from the pending list, the next pending node is
+                # skipped for the rest of this pass.
+                before, after = prev_pending[i], next_pending[i]
+                if before >= 0:
+                    next_pending[before] = after
+                if after < count:
+                    prev_pending[after] = before
+                    skipped_in_pass[after] = pass_number
+
+                for output_id in node.outputs:
+                    if output_id in outputs_available:
+                        continue
+                    outputs_available.add(output_id)
+                    for consumer in index.consumers.get(output_id, []):
+                        j = position[id(consumer)]
+                        missing[j] -= 1
+                        if missing[j] == 0 and not imported[j] and consumer.operation_type != "Skip":
+                            # nodes behind this one in the list wait for the next pass
+                            if j > i:
+                                heapq.heappush(ready, j)
+                            else:
+                                deferred.append(j)
+            if not node_processed:
+                break
+            ready = deferred
+            pass_number += 1
+
+        pending_nodes = [n for i, n in enumerate(node_list) if not imported[i] and n.operation_type != "Skip"]
         if len(pending_nodes) > 0:
             _logger.info("### ignoring the following nodes because their inputs are not satisfiable:")
             for node in pending_nodes:
                 _logger.info("    {}({})".format(node.operation_type, node.id))
 
+        used_inputs = set()
+        for node in ordered_nodes:
+            used_inputs.update(node.inputs)
+
         result = []
         for current_node in ordered_nodes:
-            if current_node.operation_type != "Input" or any(current_node.outputs[0] in node.inputs for node in ordered_nodes):
+            if current_node.operation_type != "Input" or current_node.outputs[0] in used_inputs:
                 result.append(current_node)
 
         return result
@@ -366,36 +586,33 @@ class ImporterEngine:
         """
         Returns nodes of matching importer operation_type.
         """
-        matching_nodes = []
-        for key in nodes.keys():
-            if operation_type == nodes[key].operation_type:
-                matching_nodes.append(nodes[key])
-        return matching_nodes
+        return [node for node in nodes.values() if node.operation_type == operation_type]
 
     def find_nodes_with_input(self, node_id: str, nodes: typing.Mapping[str, ImporterNode]):
         """
-        Returns first node containing node_id as an input.
+        Returns the nodes containing node_id as an input.
         """
-        nodes_with_input = []
-        for key in nodes.keys():
-            if node_id in nodes[key].inputs:
-                nodes_with_input.append(nodes[key])
-        return nodes_with_input
+        return [node for node in nodes.values() if node_id in node.inputs]
 
-    def get_padding_for_node(self, node: ImporterNode, nodes: typing.Mapping[str, typing.Any]):
+    def get_padding_for_node(self, node: ImporterNode, nodes: typing.Mapping[str, typing.Any],
+        index: ImporterGraphIndex = None):
         """
-        Returns padding for a node.
+        Returns padding for a node. The optional index must have been built
+        from the nodes as they are now, otherwise the nodes are scanned.
         """
         padding = None
         if node.outputs:
             # Find the node whose input is this node's output. A special case
             # exists if node is used to splice or concatenate output, since
             # the padding info needs to come from the next downstream node.
-            next_nodes = self.find_nodes_with_input(node.outputs[0], nodes)
+            if index is None:
+                next_nodes = self.find_nodes_with_input(node.outputs[0], nodes)
+            else:
+                next_nodes = index.find_nodes_with_input(node.outputs[0])
             if next_nodes:
                 if next_nodes[0]:
                     if next_nodes[0].operation_type in ("Splice", "Reorder", "Passthrough"):
-                        padding = self.get_padding_for_node(next_nodes[0], nodes)
+                        padding = self.get_padding_for_node(next_nodes[0], nodes, index)
                     else:
                         padding = next_nodes[0].padding
         return padding
@@ -405,10 +622,13 @@ class ImporterEngine:
         Sets the output padding for all nodes. Output padding is the required
         input padding of the subsequent node(s).
         """
+        # build the index once up front, the padding lookups below re-use it
+        # and setting output_padding does not change the graph
+        index = ImporterGraphIndex(nodes)
         for key in nodes.keys():
             # For now, just pick the first output node and use that as the
             # padding.
-            padding = self.get_padding_for_node(nodes[key], nodes)
+            padding = self.get_padding_for_node(nodes[key], nodes, index)
             if padding:
                 nodes[key].output_padding = padding
                 
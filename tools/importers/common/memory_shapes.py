@@ -62,39 +62,54 @@ def get_ell_port_memory_layout(shape: tuple, order: str, padding: int = 0):
     return ell.model.PortMemoryLayout([rows, columns, channels], [padding, padding, 0])
 
 
-def get_tensor_in_ell_order(tensor: np.array, order: str):
+def get_ell_order_view(tensor: np.array, order: str):
     """
-    Returns a numpy array in ELL order
-    """ 
-    original_tensor = tensor
+    Returns a (view, shape) tuple, where view is a view of the tensor with its
+    axes in ELL (row, column, channel) order, which becomes a 3D tensor of the
+    given shape once it is made contiguous.
+    """
+    original_tensor = np.asarray(tensor)
     original_shape = original_tensor.shape
     if order == "filter_channel_row_column":
         ordered_weights = np.moveaxis(original_tensor, 1, -1)
-        ordered_weights = ordered_weights.ravel().astype(np.float).reshape(
-            original_shape[0] * original_shape[2], original_shape[3], original_shape[1])
+        shape = (original_shape[0] * original_shape[2], original_shape[3], original_shape[1])
     elif order == "channel_row_column":
-        ordered_weights = np.moveaxis(original_tensor, 0, -1) 
-        ordered_weights = ordered_weights.ravel().astype(np.float).reshape(
-            original_shape[1], original_shape[2], original_shape[0])
+        ordered_weights = np.moveaxis(original_tensor, 0, -1)
+        shape = (original_shape[1], original_shape[2], original_shape[0])
     elif order == "column_row":
         ordered_weights = original_tensor.T
         # make it 3D tensor by adding 1 channel
-        ordered_weights = ordered_weights.ravel().astype(
-            np.float).reshape(original_shape[0], original_shape[1], 1)
+        shape = (original_shape[0], original_shape[1], 1)
     elif order == "row_column":
+        ordered_weights = original_tensor
         # make it 3D tensor by adding 1 channel
-        ordered_weights = original_tensor.ravel().astype(
-            np.float).reshape(original_shape[0], original_shape[1], 1)
+        shape = (original_shape[0], original_shape[1], 1)
     elif order == "channel":
-        ordered_weights = original_tensor.ravel().astype(
-            np.float).reshape(1, 1, original_tensor.size)
+        ordered_weights = original_tensor
+        shape = (1, 1, original_tensor.size)
     elif order == "channel_row_column_filter":
         ordered_weights = np.moveaxis(original_tensor, 0, -1)
         ordered_weights = np.moveaxis(ordered_weights, 2, 0)
-        ordered_weights = ordered_weights.ravel().astype(np.float).reshape(
-        original_shape[3] * original_shape[1], original_shape[2], original_shape[0])
+        shape = (original_shape[3] * original_shape[1], original_shape[2], original_shape[0])
     else:
-        raise NotImplementedError(
-            "Unsupported tensor order {}, for {}".format(order, uid))
+        raise NotImplementedError("Unsupported tensor order {}".format(order))
+    return (ordered_weights, shape)
+
+
+def reorder_tensor_to_ell(tensor: np.array, order: str):
+    """
+    Returns the tensor as a C contiguous 3D array in ELL order, keeping its
+    original dtype. Orders that need no transpose return a reshaped view of
+    the tensor (when it is already contiguous), the others make one copy.
+    """
+    ordered_weights, shape = get_ell_order_view(tensor, order)
+    return np.ascontiguousarray(ordered_weights).reshape(shape)
+
 
-    return ordered_weights
+def get_tensor_in_ell_order(tensor: np.array, order: str, dtype=np.float64):
+    """
+    Returns a new C contiguous numpy array of the given dtype in ELL order.
+    The reordering and the type conversion happen in a single copy.
+    """
+    ordered_weights, shape = get_ell_order_view(tensor, order)
+    return np.array(ordered_weights, dtype=dtype, order="C").reshape(shape)
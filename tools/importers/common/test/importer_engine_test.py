@@ -0,0 +1,268 @@
+###############################################################################
+#
+# Project:  Embedded Learning Library (ELL)
+# File:     importer_engine_test.py (importers)
+# Authors:  Byron Changuion
+#
+# Requires: Python 3.x
+#
+###############################################################################
+
+import os
+import random
+import sys
+import unittest
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, '..', '..', '..', 'utilities', 'pythonlibs'))
+sys.path.append(os.path.join(script_path, '..', '..'))
+
+import numpy as np
+
+import find_ell  # noqa: F401
+from common.importer import ImporterEngine, ImporterModel
+from common.converters import ConvertBase, ImporterNode, LookupTable
+
+
+def original_get_nodes_in_import_order(nodes):
+    """
+    The original ImporterEngine.get_nodes_in_import_order, which rescanned
+    every pending node on each pass, removing nodes from the list while
+    iterating over it.
+    """
+    pending_nodes = list(nodes.values())
+    ordered_nodes = []
+    node_processed = len(pending_nodes) > 0
+    outputs_available = {}
+    while node_processed:
+        node_processed = False
+        for current_node in pending_nodes:
+            # Find a node which already has all of its input nodes in the ordered list.
+            if current_node.operation_type != "Skip":
+                if all((input_id in outputs_available) for input_id in current_node.inputs):
+                    pending_nodes.remove(current_node)
+                    ordered_nodes.append(current_node)
+                    node_processed = True
+                    for o in current_node.outputs:
+                        outputs_available[o] = True
+
+    result = []
+    for current_node in ordered_nodes:
+        if current_node.operation_type != "Input" or any(current_node.outputs[0] in node.inputs for node in ordered_nodes):
+            result.append(current_node)
+    return result
+
+
+class RecordingConverter(ConvertBase):
+    """
+    A converter that reads its weights in ELL order and records the arrays it
+    got back and the tensors cached by the lookup table at the time.
+    """
+    calls = []
+
+    def __init__(self, node: ImporterNode):
+        super().__init__(node)
+        self.required_weights = ["weights"]
+
+    def convert(self, conversion_parameters):
+        lookup_table = conversion_parameters["lookup_table"]
+        arrays = [lookup_table.get_tensor_in_ell_order(uid) for uid, order in self.importer_node.weights.values()]
+        cached = set(key[0] for key in lookup_table.ell_order_cache)
+        RecordingConverter.calls.append((self.importer_node.id, arrays, cached))
+        return None
+
+
+class InputConverter(ConvertBase):
+    def convert(self, conversion_parameters):
+        return None
+
+
+def random_graph(count, rng):
+    """
+    Returns a mapping of count random nodes, with Input and Skip nodes,
+    repeated inputs, inputs that no node produces, nodes with a second output
+    and (usually) shuffled order.
+    """
+    nodes = []
+    for i in range(count):
+        operation_type = rng.choice(["Input", "Convolution", "Convolution", "Convolution", "Skip", "Splice"])
+        if i < 2 or operation_type == "Input":
+            operation_type = "Input"
+            inputs = ["missing"] if rng.random() < 0.05 else []
+        else:
+            inputs = ["output{}".format(rng.randrange(i)) for _ in range(rng.randint(1, 3))]
+            if rng.random() < 0.05:
+                inputs.append("missing")
+        outputs = ["output{}".format(i)]
+        if rng.random() < 0.05:
+            outputs.append("output{}".format(rng.randrange(count)))
+        nodes.append(ImporterNode("node{}".format(i), operation_type, inputs=inputs, outputs=outputs))
+    if rng.random() < 0.7:
+        rng.shuffle(nodes)
+    return {node.id: node for node in nodes}
+
+
+class ImporterEngineTest(unittest.TestCase):
+    def test_import_order_matches_original(self):
+        rng = random.Random(0)
+        engine = ImporterEngine()
+        for trial in range(1000):
+            nodes = random_graph(rng.randint(0, 40), rng)
+            expected = [node.id for node in original_get_nodes_in_import_order(nodes)]
+            actual = [node.id for node in engine.get_nodes_in_import_order(nodes)]
+            self.assertEqual(expected, actual, "graph {}".format(trial))
+
+    def test_import_order_of_reversed_chain(self):
+        nodes = {}
+        for i in reversed(range(500)):
+            inputs = ["output{}".format(i - 1)] if i else []
+            nodes["node{}".format(i)] = ImporterNode("node{}".format(i), "Convolution" if i else "Input",
+                                                     inputs=inputs, outputs=["output{}".format(i)])
+        ordered = ImporterEngine().get_nodes_in_import_order(nodes)
+        self.assertEqual([node.id for node in ordered], ["node{}".format(i) for i in range(500)])
+
+    def test_unsatisfiable_and_skip_nodes_are_ignored(self):
+        nodes = [ImporterNode("input", "Input", outputs=["input"]),
+                 ImporterNode("skip", "Skip", inputs=["input"], outputs=["skip"]),
+                 ImporterNode("after_skip", "ReLU", inputs=["skip"], outputs=["after_skip"]),
+                 ImporterNode("missing", "ReLU", inputs=["input", "nowhere"], outputs=["missing"]),
+                 ImporterNode("relu", "ReLU", inputs=["input"], outputs=["relu"]),
+                 ImporterNode("unused", "Input", outputs=["unused"])]
+        nodes = {node.id: node for node in nodes}
+        ordered = ImporterEngine().get_nodes_in_import_order(nodes)
+        self.assertEqual([node.id for node in ordered], ["input", "relu"])
+        self.assertEqual(ordered, original_get_nodes_in_import_order(nodes))
+
+    def test_graph_queries_match_scans(self):
+        rng = random.Random(1)
+        engine = ImporterEngine()
+        for trial in range(100):
+            nodes = random_graph(rng.randint(1, 40), rng)
+            for node in list(nodes.values())[:5]:
+                output_id = node.outputs[0]
+                self.assertEqual(engine.find_nodes_with_input(output_id, nodes),
+                                 [n for n in nodes.values() if output_id in n.inputs])
+                self.assertEqual(engine.get_nodes_of_type(node.operation_type, nodes),
+                                 [n for n in nodes.values() if n.operation_type == node.operation_type])
+            # the queries follow nodes being added
+            extra = ImporterNode("extra", "Extra", inputs=[nodes[next(iter(nodes))].outputs[0]], outputs=["extra"])
+            nodes["extra"] = extra
+            self.assertEqual(engine.get_nodes_of_type("Extra", nodes), [extra])
+            self.assertIn(extra, engine.find_nodes_with_input(extra.inputs[0], nodes))
+
+    def test_graph_edits_between_calls(self):
+        engine = ImporterEngine()
+        nodes = [ImporterNode("input", "Input", outputs=["input"]),
+                 ImporterNode("conv", "Convolution", inputs=["input", "weights"], outputs=["conv"]),
+                 ImporterNode("weights", "Input", outputs=["weights"]),
+                 ImporterNode("relu", "ReLU", inputs=["conv"], outputs=["relu"])]
+        nodes = {node.id: node for node in nodes}
+        nodes["conv"].padding = {"size": 1}
+        self.assertEqual([n.id for n in engine.get_nodes_in_import_order(nodes)],
+                         ["input", "weights", "conv", "relu"])
+
+        # removing an input in place, the way OnnxNodeConverter.remove_input_tensors does, leaves the
+        # weights input unused, so it is no longer imported
+        nodes["conv"].inputs.remove("weights")
+        self.assertEqual([n.id for n in engine.get_nodes_in_import_order(nodes)], ["input", "conv", "relu"])
+        self.assertEqual(engine.find_nodes_with_input("weights", nodes), [])
+
+        # replacing a node under the same id
+        nodes["relu"] = ImporterNode("relu", "Pooling", inputs=["input"], outputs=["relu"])
+        nodes["relu"].padding = {"size": 2}
+        self.assertEqual(engine.get_nodes_of_type("ReLU", nodes), [])
+        self.assertEqual([n.id for n in engine.get_nodes_in_import_order(nodes)], ["input", "conv", "relu"])
+        engine.set_output_padding_for_nodes(nodes)
+        self.assertEqual(nodes["input"].output_padding, {"size": 1})
+        self.assertEqual(nodes["conv"].output_padding["size"], 0)
+
+
+class WeightCacheTest(unittest.TestCase):
+    def test_weights_are_released_after_last_use(self):
+        model = ImporterModel()
+        model.add_node("input", ImporterNode("input", "Input", outputs=["input"]))
+        model.add_tensor("shared", np.arange(24, dtype=np.float32).reshape(2, 3, 4), "channel_row_column")
+        previous = "input"
+        for i in range(5):
+            uid = "weights{}".format(i)
+            model.add_tensor(uid, np.full((2, 3, 4), i, dtype=np.float32), "channel_row_column")
+            weights = {"weights": (uid, "channel_row_column")}
+            if i in (1, 3):
+                weights["bias"] = ("shared", "channel_row_column")
+            node_id = "node{}".format(i)
+            model.add_node(node_id, ImporterNode(node_id, "Recording", inputs=[previous], outputs=[node_id],
+                                                 weights=weights))
+            previous = node_id
+
+        RecordingConverter.calls = []
+        engine = ImporterEngine(operation_map={"Input": InputConverter, "Recording": RecordingConverter})
+        engine.convert(model)
+
+        calls = RecordingConverter.calls
+        self.assertEqual([call[0] for call in calls], ["node{}".format(i) for i in range(5)])
+        # each weight is released once its last node is converted, so only the shared tensor is kept
+        # between the nodes that use it
+        self.assertEqual([call[2] for call in calls], [{"weights0"}, {"weights1", "shared"},
+                                                       {"weights2", "shared"}, {"weights3", "shared"},
+                                                       {"weights4"}])
+        self.assertIs(calls[1][1][1], calls[3][1][1])
+        # the weights keep their source dtype until they are converted for ELL
+        self.assertEqual(calls[1][1][1].dtype, np.float32)
+        np.testing.assert_array_equal(calls[1][1][1], np.moveaxis(np.arange(24).reshape(2, 3, 4), 0, -1))
+        self.assertEqual(engine.lookup_table.ell_order_cache, {})
+
+    def test_tensors_in_ell_order(self):
+        model = ImporterModel()
+        weights = np.arange(24, dtype=np.float32).reshape(4, 6)
+        model.add_tensor("row_column", weights, "row_column")
+        model.add_tensor("column_row", weights, "column_row")
+        lookup_table = LookupTable(model.tensors)
+
+        # no transpose is needed, so the source array is reshaped rather than copied
+        tensor = lookup_table.get_tensor_in_ell_order("row_column")
+        self.assertEqual((tensor.shape, tensor.dtype), ((4, 6, 1), np.float32))
+        self.assertTrue(np.shares_memory(tensor, weights))
+        self.assertIs(lookup_table.get_tensor_in_ell_order("row_column"), tensor)
+
+        tensor = lookup_table.get_tensor_in_ell_order("column_row", np.float64)
+        self.assertEqual((tensor.shape, tensor.dtype), ((4, 6, 1), np.float64))
+        self.assertTrue(tensor.flags["C_CONTIGUOUS"])
+        np.testing.assert_array_equal(tensor.ravel(), weights.T.ravel())
+        self.assertIsNot(lookup_table.get_tensor_in_ell_order("column_row"), tensor)
+
+        vector = lookup_table.get_vector_in_ell_order("row_column")
+        self.assertEqual(vector.dtype, np.float32)
+        self.assertTrue(np.shares_memory(vector, weights))
+        self.assertEqual(lookup_table.get_vector_in_ell_order("row_column", np.float64).dtype, np.float64)
+
+    def test_lazy_tensors_are_loaded_on_demand_and_released(self):
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return np.ones((2, 3, 4), dtype=np.float32)
+
+        model = ImporterModel()
+        model.add_node("input", ImporterNode("input", "Input", outputs=["input"]))
+        model.add_lazy_tensor("lazy", loader, (2, 3, 4), "channel_row_column")
+        model.add_tensor("eager", np.ones((2, 3, 4), dtype=np.float32), "channel_row_column")
+        model.add_node("node", ImporterNode("node", "Recording", inputs=["input"], outputs=["node"],
+                                            weights={"weights": ("lazy", "channel_row_column"),
+                                                     "bias": ("eager", "channel_row_column")}))
+        self.assertIn("lazy", model.tensors)
+        self.assertEqual(model.tensors.get_info("lazy"), ((2, 3, 4), "channel_row_column"))
+        self.assertEqual(loads, [])
+
+        RecordingConverter.calls = []
+        ImporterEngine(operation_map={"Input": InputConverter, "Recording": RecordingConverter}).convert(model)
+        self.assertEqual(len(RecordingConverter.calls), 1)
+        self.assertEqual(loads, [1])
+        # the lazy tensor is released after its last use, and loaded again if it is needed later
+        self.assertFalse(model.tensors.is_loaded("lazy"))
+        self.assertTrue(model.tensors.is_loaded("eager"))
+        self.assertEqual(model.tensors["lazy"][1], "channel_row_column")
+        self.assertEqual(loads, [1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,7 +15,6 @@ from configparser import ConfigParser
 from collections import OrderedDict
 import logging
 import re
-import struct
 import getopt
 import numpy as np
 import find_ell
@@ -209,23 +208,42 @@ def create_layer_parameters(inputShape, inputPadding, inputPaddingScheme, output
     return ell.neural.LayerParameters(inputShape, inputPaddingParameters, outputShape, outputPaddingParameters, ell.nodes.PortType.smallReal)
 
 
+class WeightsReader:
+    """Reads consecutive float32 values out of a Darknet .weights file. The
+       whole file is loaded with one call to np.fromfile, and each read returns
+       a view of the next values, so no per-value Python objects are created"""
+    def __init__(self, weights_file, header_size=4 * 4):
+        weights_file.seek(header_size)
+        self.values = np.fromfile(weights_file, dtype=np.float32)
+        self.offset = 0
+
+    def read(self, count):
+        """Returns a float32 view of the next count values"""
+        count = int(count)
+        if self.offset + count > self.values.size:
+            raise Exception("Unexpected end of weights file, expecting {} more values but only {} remain".format(
+                count, self.values.size - self.offset))
+        values = self.values[self.offset:self.offset + count]
+        self.offset += count
+        return values
+
+
 def get_weights_tensor(weightsShape, values):
     """Returns an ELL tensor from Darknet weights. The weights are re-ordered
        to rows, columns, channels"""
-    weights = np.array(values, dtype=np.float).reshape(weightsShape)
+    weights = np.asarray(values).reshape(weightsShape)
     if (len(weights.shape) == 3):
         orderedWeights = np.rollaxis(weights, 0, 3)
     elif (len(weights.shape) == 4):
         orderedWeights = np.rollaxis(weights, 1, 4)
         orderedWeights = orderedWeights.reshape((orderedWeights.shape[0] * orderedWeights.shape[1], orderedWeights.shape[2], orderedWeights.shape[3]))
     elif (len(weights.shape) == 2):
-        orderedWeights = values
-        orderedWeights = orderedWeights.reshape((weightsShape.shape[0], 1, weightsShape.shape[1]))
+        orderedWeights = weights.reshape((weightsShape[0], 1, weightsShape[1]))
     else:
-        orderedWeights = weights
-        orderedWeights = orderedWeights.reshape((1, 1, weightsShape[0]))
+        orderedWeights = weights.reshape((1, 1, weightsShape[0]))
 
-    return ell.math.DoubleTensor(orderedWeights)
+    # Reorder and convert to double in a single copy
+    return ell.math.DoubleTensor(np.ascontiguousarray(orderedWeights, dtype=np.float64))
 
 
 def process_batch_normalization_layer(layer, apply_padding, mean_vals, variance_vals, scale_vals):
@@ -296,30 +314,19 @@ def process_convolutional_layer(layer, bin_data, convolution_order):
     layers = []
 
     # Read in binary values
-    bias_vals = []
-    for i in range(int(layer['filters'])):
-        bias_vals.append(struct.unpack('f', bin_data.read(4)))
-    bias_vals = np.array(bias_vals, dtype=np.float)
+    filters = int(layer['filters'])
+    bias_vals = bin_data.read(filters).astype(np.float64)
     # now we need to check if these weights have batch normalization data
-    scale_vals = []
-    mean_vals = []
-    variance_vals = []
+    scale_vals = np.zeros(0)
+    mean_vals = np.zeros(0)
+    variance_vals = np.zeros(0)
     if ('batch_normalize' in layer) and ('dontloadscales' not in layer):
-        for i in range(int(layer['filters'])):
-            scale_vals.append(struct.unpack('f', bin_data.read(4)))
-        for i in range(int(layer['filters'])):
-            mean_vals.append(struct.unpack('f', bin_data.read(4)))
-        for i in range(int(layer['filters'])):
-            variance_vals.append(struct.unpack('f', bin_data.read(4)))
-    scale_vals = np.array(scale_vals, dtype=np.float)
-    mean_vals = np.array(mean_vals, dtype=np.float)
-    variance_vals = np.array(variance_vals, dtype=np.float)
-    # now we can load the convolutional weights
-    weight_vals = []
-    num_weights = int(layer['size'])*int(layer['size'])*int(layer['c'])*int(layer['filters'])
-    for i in range(num_weights):
-        weight_vals.append(struct.unpack('f', bin_data.read(4)))
-    weight_vals = np.array(weight_vals, dtype=np.float)
+        scale_vals = bin_data.read(filters).astype(np.float64)
+        mean_vals = bin_data.read(filters).astype(np.float64)
+        variance_vals = bin_data.read(filters).astype(np.float64)
+    # now we can load the convolutional weights, these stay float32 until they are reordered
+    num_weights = int(layer['size'])*int(layer['size'])*int(layer['c'])*filters
+    weight_vals = bin_data.read(num_weights)
 
     layerParameters = create_layer_parameters(layer['inputShape'], layer['inputPadding'], layer['inputPaddingScheme'], layer['outputShapeMinusPadding'], 0, ell.neural.PaddingScheme.zeros)
     convolutionWeightsTensor = get_weights_tensor((int(layer['filters']), layer['c'], int(layer["size"]), int(layer["size"])), weight_vals)
@@ -405,22 +412,16 @@ def process_fully_connected_layer(layer, weightsData):
     else:
         layerParameters = create_layer_parameters(layer['outputShapeMinusPadding'], 0, ell.neural.PaddingScheme.zeros, layer['outputShape'], layer['outputPadding'], layer['outputPaddingScheme'])
 
-    bias_vals = []
-    for i in range(int(layer['output'])):
-        bias_vals.append(struct.unpack('f', weightsData.read(4)))
-    bias_vals = np.array(bias_vals, dtype=np.float)
+    bias_vals = weightsData.read(int(layer['output'])).astype(np.float64)
 
-    weight_vals = []
     num_weights = int(layer['output'])*int(layer['inputs'])
-    for i in range(num_weights):
-        weight_vals.append(struct.unpack('f', weightsData.read(4)))
-    weight_vals = np.array(weight_vals, dtype=np.float)
+    weight_vals = weightsData.read(num_weights)
 
     orderedWeights = weight_vals.reshape(layer['out_h'] * layer['out_w'] * layer['out_c'], layer['c'], layer['h'], layer['w'])
     orderedWeights = np.moveaxis(orderedWeights, 1, -1)
     orderedWeights = orderedWeights.reshape((layer['out_h'] * layer['out_w'] * layer['out_c'] * layer['h'], layer['w'], layer['c']))
 
-    weightsTensor = ell.math.DoubleTensor(orderedWeights)
+    weightsTensor = ell.math.DoubleTensor(np.ascontiguousarray(orderedWeights, dtype=np.float64))
 
     layers.append(ell.neural.FullyConnectedLayer(layerParameters, weightsTensor))
 
@@ -437,7 +438,7 @@ def process_fully_connected_layer(layer, weightsData):
 
 
 def get_first_scaling_layer(nextLayerParameters):
-    scaleValues = np.ones((nextLayerParameters.inputShape.channels), dtype=np.float) * [1/255]
+    scaleValues = np.ones((nextLayerParameters.inputShape.channels), dtype=np.float64) * [1/255]
 
     inputShape = ell.math.TensorShape(nextLayerParameters.inputShape.rows - (2 * nextLayerParameters.inputPaddingParameters.paddingSize),
                                     nextLayerParameters.inputShape.columns - (2 * nextLayerParameters.inputPaddingParameters.paddingSize),
@@ -494,10 +495,10 @@ def predictor_from_darknet_model(modelConfigFile, modelWeightsFile, convolutionO
     network = parse_cfg(modelConfigFile)
 
     with open(modelWeightsFile, "rb") as weights_file:
-        # discard the first 4 ints (4 bytes each)
-        weights_file.seek(4 * 4)
+        # discard the first 4 ints (4 bytes each) and read the rest in one go
+        weights = WeightsReader(weights_file, 4 * 4)
 
-        # Create the predictor given the structure of the network and the given weights
-        predictor = process_network(network, weights_file, convolutionOrder)
+    # Create the predictor given the structure of the network and the given weights
+    predictor = process_network(network, weights, convolutionOrder)
 
     return predictor
@@ -18,6 +18,7 @@ import struct
 import traceback
 import inspect
 import logging
+from unittest import mock
 
 import numpy as np
 _logger = logging.getLogger(__name__)
@@ -89,5 +90,61 @@ class DarknetModelTestCase(unittest.TestCase):
         return
 
 
+def original_read_values(weights_file, count):
+    """The original way the importer read weights, one struct.unpack call per value"""
+    values = []
+    for i in range(count):
+        values.append(struct.unpack('f', weights_file.read(4)))
+    return np.array(values, dtype=np.float64)
+
+
+def original_get_weights_tensor(weightsShape, values):
+    """The original reordering in get_weights_tensor, for 3 and 4 dimensional weights"""
+    weights = np.array(values, dtype=np.float64).reshape(weightsShape)
+    if (len(weights.shape) == 3):
+        orderedWeights = np.rollaxis(weights, 0, 3)
+    else:
+        orderedWeights = np.rollaxis(weights, 1, 4)
+        orderedWeights = orderedWeights.reshape((orderedWeights.shape[0] * orderedWeights.shape[1], orderedWeights.shape[2], orderedWeights.shape[3]))
+    return orderedWeights
+
+
+# Verify that the vectorized weights loading returns the same values as the
+# original per-value loop
+class DarknetWeightsTestCase(unittest.TestCase):
+    def test_weights_reader(self):
+        counts = [10, 1, 250, 37]
+        with open('unittest.weights', 'rb') as f:
+            f.seek(4 * 4)
+            expected = [original_read_values(f, count) for count in counts]
+            remaining = len(f.read()) // 4
+        with open('unittest.weights', 'rb') as f:
+            reader = darknet_to_ell.WeightsReader(f, 4 * 4)
+        for count, values in zip(counts, expected):
+            actual = reader.read(count)
+            self.assertEqual(actual.dtype, np.float32)
+            np.testing.assert_array_equal(actual.reshape(count, 1), values)
+        self.assertEqual(reader.read(remaining).size, remaining)
+        with self.assertRaises(Exception):
+            reader.read(1)
+
+    def test_weights_tensor(self):
+        rng = np.random.RandomState(0)
+        # capture the array the ELL tensor would be created from
+        with mock.patch.object(darknet_to_ell.ell.math, 'DoubleTensor', side_effect=lambda a: a):
+            for shape in [(4, 3, 5), (6, 3, 3, 2), (8, 1, 1, 1)]:
+                values = rng.rand(int(np.prod(shape))).astype(np.float32)
+                actual = darknet_to_ell.get_weights_tensor(shape, values)
+                self.assertEqual(actual.dtype, np.float64)
+                self.assertTrue(actual.flags['C_CONTIGUOUS'])
+                np.testing.assert_array_equal(actual, original_get_weights_tensor(shape, values))
+
+            values = rng.rand(12).astype(np.float32)
+            np.testing.assert_array_equal(darknet_to_ell.get_weights_tensor((3, 4), values),
+                                          values.astype(np.float64).reshape(3, 1, 4))
+            np.testing.assert_array_equal(darknet_to_ell.get_weights_tensor((12,), values),
+                                          values.astype(np.float64).reshape(1, 1, 12))
+
+
 if __name__ == '__main__':
     unittest.main()
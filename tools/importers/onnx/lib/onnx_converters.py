@@ -15,6 +15,7 @@ from __future__ import unicode_literals
 
 import os
 import argparse
+import mmap
 from typing import Text
 import sys
 import logging
@@ -37,6 +38,164 @@ import common.converters
 _logger = logging.getLogger(__name__) 
 AttributeValue = Any 
 
+# The tensor types whose raw_data (or external data) can be used directly as a numpy array
+RAW_DATA_TYPES = {
+    TensorProto.FLOAT: np.float32,
+    TensorProto.DOUBLE: np.float64,
+    TensorProto.FLOAT16: np.float16,
+    TensorProto.INT8: np.int8,
+    TensorProto.INT16: np.int16,
+    TensorProto.INT32: np.int32,
+    TensorProto.INT64: np.int64,
+    TensorProto.UINT8: np.uint8,
+    TensorProto.UINT16: np.uint16,
+    TensorProto.UINT32: np.uint32,
+    TensorProto.UINT64: np.uint64,
+    TensorProto.BOOL: np.bool_,
+}
+
+def read_varint(buffer, pos: int):
+    """ Returns the protobuf varint at pos in the buffer and the position after it """
+    result = 0
+    shift = 0
+    while True:
+        b = buffer[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+def iterate_fields(buffer, start: int, end: int):
+    """
+    Yields a (field number, wire type, start, value start, end) tuple for each
+    field of the protobuf message stored in buffer[start:end]. For length
+    delimited fields the value is buffer[value start:end].
+    """
+    pos = start
+    while pos < end:
+        field_start = pos
+        key, pos = read_varint(buffer, pos)
+        wire_type = key & 7
+        value_start = pos
+        if wire_type == 0:
+            _, pos = read_varint(buffer, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 2:
+            length, value_start = read_varint(buffer, pos)
+            pos = value_start + length
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ValueError("Unsupported protobuf wire type {}".format(wire_type))
+        yield key >> 3, wire_type, field_start, value_start, pos
+
+def encode_length_delimited(field: int, value):
+    """ Returns the protobuf encoding of a length delimited field """
+    result = bytearray()
+    for number in [(field << 3) | 2, len(value)]:
+        while number > 0x7f:
+            result.append((number & 0x7f) | 0x80)
+            number >>= 7
+        result.append(number)
+    return result + value
+
+# field numbers in ModelProto, GraphProto and TensorProto
+MODEL_GRAPH_FIELD = 7
+GRAPH_INITIALIZER_FIELD = 5
+TENSOR_DATA_TYPE_FIELD = 2
+TENSOR_NAME_FIELD = 8
+TENSOR_RAW_DATA_FIELD = 9
+
+def strip_initializer_raw_data(buffer):
+    """
+    Returns a copy of the serialized ModelProto in buffer without the
+    raw_data of its initializers, and a mapping of initializer name to the
+    (offset, length) of its raw_data in the buffer. This means the model can be
+    parsed without copying the weights, which can then be memory-mapped from
+    the model file when they are needed. Only the raw_data of the types in
+    RAW_DATA_TYPES is taken out.
+    """
+    model = bytearray()
+    raw_data = {}
+    for field, wire_type, start, value_start, end in iterate_fields(buffer, 0, len(buffer)):
+        if field != MODEL_GRAPH_FIELD or wire_type != 2:
+            model += buffer[start:end]
+            continue
+        graph = bytearray()
+        for g_field, g_wire_type, g_start, g_value_start, g_end in iterate_fields(buffer, value_start, end):
+            if g_field != GRAPH_INITIALIZER_FIELD or g_wire_type != 2:
+                graph += buffer[g_start:g_end]
+                continue
+            tensor = bytearray()
+            name = None
+            data_type = None
+            data = None
+            for t_field, t_wire_type, t_start, t_value_start, t_end in iterate_fields(buffer, g_value_start, g_end):
+                if t_field == TENSOR_RAW_DATA_FIELD and t_wire_type == 2:
+                    data = (t_value_start, t_end - t_value_start)
+                    continue
+                if t_field == TENSOR_NAME_FIELD and t_wire_type == 2:
+                    name = bytes(buffer[t_value_start:t_end]).decode("utf-8")
+                elif t_field == TENSOR_DATA_TYPE_FIELD and t_wire_type == 0:
+                    data_type, _ = read_varint(buffer, t_value_start)
+                tensor += buffer[t_start:t_end]
+            if data is not None and name is not None and data_type in RAW_DATA_TYPES:
+                raw_data[name] = data
+                graph += encode_length_delimited(GRAPH_INITIALIZER_FIELD, tensor)
+            else:
+                graph += buffer[g_start:g_end]
+        model += encode_length_delimited(MODEL_GRAPH_FIELD, graph)
+    return bytes(model), raw_data
+
+def get_tensor_loader(tensor: TensorProto, base_dir: str, model_file: str = None, raw_data: tuple = None):
+    """
+    Returns a function that loads the given ONNX initializer as a numpy array.
+    Tensors stored in external data files are memory-mapped, and so is
+    raw_data that was stripped out of the model file, given as the (offset,
+    length) of the data in model_file (see strip_initializer_raw_data). In
+    both cases the function doesn't hold on to the TensorProto. Tensors that
+    still have their raw_data are returned as a read only view of those bytes
+    in the TensorProto, which is not modified. Anything else goes through
+    numpy_helper.to_array.
+    """
+    shape = tuple(tensor.dims)
+    if tensor.data_type in RAW_DATA_TYPES:
+        # ONNX stores raw data in little endian order
+        dtype = np.dtype(RAW_DATA_TYPES[tensor.data_type]).newbyteorder("<")
+        if tensor.data_location == TensorProto.EXTERNAL:
+            info = dict((entry.key, entry.value) for entry in tensor.external_data)
+            filename = os.path.join(base_dir, info["location"])
+            offset = int(info.get("offset", 0))
+
+            def load_external():
+                return np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape)
+            return load_external
+        if raw_data is not None:
+            offset, length = raw_data
+
+            def load_stripped():
+                if length == 0:
+                    return np.zeros(shape, dtype=dtype)
+                data = np.memmap(model_file, dtype=dtype, mode="r", offset=offset, shape=(length // dtype.itemsize,))
+                return data.reshape(shape)
+            return load_stripped
+        if tensor.HasField("raw_data"):
+            def load_raw():
+                return np.frombuffer(tensor.raw_data, dtype=dtype).reshape(shape)
+            return load_raw
+
+    def load():
+        if tensor.data_location == TensorProto.EXTERNAL:
+            # load the external data into a copy, leaving the graph as it is
+            loaded = TensorProto()
+            loaded.CopyFrom(tensor)
+            onnx.external_data_helper.load_external_data_for_tensor(loaded, base_dir)
+            return numpy_helper.to_array(loaded)
+        return numpy_helper.to_array(tensor)
+    return load
+
 class Attributes(Dict[Text, Any]):
     @staticmethod
     def from_onnx(args):  # type: (Iterable[AttributeProto]) -> Attributes
@@ -85,7 +244,7 @@ class OnnxNodeConverter(object):
         Used for diagnostics
         """
         _logger.info("{}.{}, inputs {} -> outputs {}".format(self.node.op_type, self.node.name, self.node.inputs, self.node.outputs))
-        _logger.info("    weights: {}".format("".join(["({}: {}{},order='{}')".format(w, self.node.weights[w][0], self.node.weights[w][1].shape, self.node.weights[w][2]) for w in self.node.weights.keys()])))
+        _logger.info("    weights: {}".format("".join(["({}: {}{},order='{}')".format(w, self.node.weights[w][0], self.get_tensor_shape(self.node.weights[w][0]), self.node.weights[w][1]) for w in self.node.weights.keys()])))
         _logger.info("    attributes: {}".format(self.node.attribute))
         _logger.info("    padding: {}".format(self.node.padding))
         
@@ -148,6 +307,13 @@ class OnnxNodeConverter(object):
     def add_tensor(self, id: str, tensor, order=None):
         return self.converter.add_tensor(id, tensor, order)
 
+    def add_derived_tensor(self, id: str, source_id: str, transforms, shape, order=None):
+        return self.converter.add_derived_tensor(id, source_id, transforms, shape, order)
+
+    def get_tensor_shape(self, id: str):
+        """ return the shape of the tensor without loading it """
+        return self.converter.model.tensors.get_info(id)[0]
+
     def get_input_tensors(self):
         tensor_inputs = [x for x in list(self.node.inputs) if self.is_tensor(x)]
         tensors = []
@@ -157,6 +323,15 @@ class OnnxNodeConverter(object):
             tensors += [t]
         return tensors
 
+    def get_input_weights(self):
+        """
+        Returns a (tensor id, order) tuple for each tensor input, as used in node.weights.
+        Unlike get_input_tensors this doesn't load the tensors, they are only loaded when
+        the node is converted to ELL.
+        """
+        tensor_inputs = [x for x in list(self.node.inputs) if self.is_tensor(x)]
+        return [(tensor_id, self.converter.model.tensors.get_info(tensor_id)[1]) for tensor_id in tensor_inputs]
+
     def is_constant_input(self, node):
         return all(self.is_tensor(x) for x in node.inputs)
 
@@ -183,21 +358,20 @@ class OnnxNodeConverter(object):
         return self.converter.get_node(id)
 
     def add_passthrough_tensors(self):
-        tensors = self.get_input_tensors()
+        tensors = self.get_input_weights()
         if len(tensors) > 0:
             newname = self.node.id
             # if the input is constant tensor, then register the output as a tensor also, using the
             # new name of this node
-            name, tensor, shape = tensors[0]
-            self.converter.add_tensor(newname, tensor)
+            name, order = tensors[0]
+            self.add_derived_tensor(newname, name, [], self.get_tensor_shape(name))
 
-    def reshape_3d_into_2d_tensor(self, input_shape, weight, transpose):
+    def reshape_3d_into_2d_tensor(self, input_shape, tensor, transpose):
         # if the input shape is 3 dimensional as would be the case with the output of a convolutional layer
         # then we have a tensor in the order (channel,row,col) but this is the wrong order for ELL where the
         # input to the FullyConnected layer will be in (row,col,channel) order, so here we have to reorder the
         # weights to match, then reshape it into the 2 dimensional weights that FullyConnected expects where the
         # #rows=#outputs from the layer, and #cols=#inputs to the layer.                
-        tensor = weight[1]
         tensor_shape = tensor.shape
         if not transpose:
             real_shape = (input_shape[0],input_shape[1],input_shape[2],tensor_shape[1])
@@ -210,8 +384,6 @@ class OnnxNodeConverter(object):
             tensor = np.moveaxis(tensor,1,-1) # move channel so it is filter,row,col,channel
             tensor = tensor.reshape(tensor_shape) # ok, now back to the row-col shape.
             tensor = tensor.T
-        # and since we are modifying this tensor, we need to update the version in the master list
-        self.add_tensor(weight[0], tensor)
         return tensor
 
     def remove_input_tensors(self, node):
@@ -423,7 +595,8 @@ class OnnxBiasConverter(OnnxNodeConverter):
         super().init(converter, "Bias")
 
     def get_weights(self):
-        tensors = self.get_input_tensors()
+        weights = {}
+        tensors = self.get_input_weights()
         weights['bias'] = tensors[0]
         return weights
 
@@ -862,38 +1035,38 @@ class OnnxLSTMConverter(OnnxNodeConverter):
         node = self.node
         units = int(node.attributes['hidden_size'])
         
-        tensors = self.get_input_tensors()
+        tensors = self.get_input_weights()
         result = {}
 
         if len(tensors) < 3:
             raise Exception("Expecting 2 weight tensors and a bias tensor on LSTM node but found {}".format(len(tensors)))
 
-        # stacked set of (input, forget, cell, output) weights to be applied to the input
-        stacked_input_weights = self.reform_weights(tensors[0][1], axis=1)
-        # stacked set of (input, forget, cell, output) weights to be applied to the hidden state
-        stacked_hidden_weights = self.reform_weights(tensors[1][1], axis=1)
-        # the stacked bias comes in as one tensor which we have to then split
-        bias_weights = tensors[2][1].reshape((2, units*4))
-        # stacked set of (input, forget, cell, output) input biases
-        stacked_input_bias = self.reform_weights(bias_weights[0], axis=0)
-        # stacked set of (input, forget, cell, output) hidden biases
-        stacked_hidden_bias = self.reform_weights(bias_weights[1], axis=0)
+        # the tensors are reformed when they are loaded, see add_derived_tensor
+        def reform_rows(weights):
+            return self.reform_weights(weights, axis=1)
 
-        # we have to invent new unique id's for the tensors since we created more than we had in input_tensors.
-        unique_id = "{}_{}_".format(node.operation_type, node.id)
+        def split_bias(index):
+            return lambda bias: self.reform_weights(bias.reshape((2, units*4))[index], axis=0)
+
+        bias_shape = (units*4,)
         tensors = {
-            'input_weights': stacked_input_weights,
-            'hidden_weights': stacked_hidden_weights,
-            'input_bias': stacked_input_bias,
-            'hidden_bias': stacked_hidden_bias
+            # stacked set of (input, forget, cell, output) weights to be applied to the input
+            'input_weights': (tensors[0][0], [reform_rows], self.get_tensor_shape(tensors[0][0])),
+            # stacked set of (input, forget, cell, output) weights to be applied to the hidden state
+            'hidden_weights': (tensors[1][0], [reform_rows], self.get_tensor_shape(tensors[1][0])),
+            # the stacked bias comes in as one tensor which we have to then split into the
+            # stacked set of (input, forget, cell, output) input biases and hidden biases
+            'input_bias': (tensors[2][0], [split_bias(0)], bias_shape),
+            'hidden_bias': (tensors[2][0], [split_bias(1)], bias_shape)
         }
 
+        # we have to invent new unique id's for the tensors since we created more than we had in input_tensors.
+        unique_id = "{}_{}_".format(node.operation_type, node.id)
+
         # register these as global tensors so the importer can find them.
         for key in tensors:
-            t = tensors[key]
-            id = unique_id + key
-            self.add_tensor(id, t)
-            result[key] = (id, t, self.get_order(t))
+            source_id, transforms, shape = tensors[key]
+            result[key] = self.add_derived_tensor(unique_id + key, source_id, transforms, shape)
 
         # remove all the old inputs since we have reshaped them and created new tensors for them, the only input
         # that survives is the input buffer.
@@ -923,40 +1096,36 @@ class OnnxGRUConverter(OnnxNodeConverter):
         node = self.node
         units = int(node.attributes['hidden_size'])
         
-        tensors = self.get_input_tensors()
+        tensors = self.get_input_weights()
         result = {}
 
         if len(tensors) < 3:
             raise Exception("Expecting 3 weight tensors on GRU node but found {}".format(len(tensors)))
 
-        # stacked set of update, reset, hidden weights to be applied to the input
-        stacked_input_weights = tensors[0][1]
-        # stacked set of update, reset, hidden weights to be applied to the hidden state
-        stacked_hidden_weights = tensors[1][1]
-        # the stacked bias comes in as one tensor which we have to then split
-        bias_weights = tensors[2][1].reshape((2, units*3))
-        # stacked set of update, reset, hidden input biases
-        stacked_input_bias = bias_weights[0]
-        # stacked set of update, reset, hidden hidden biases
-        stacked_hidden_bias = bias_weights[1]
+        # the tensors are split when they are loaded, see add_derived_tensor
+        def split_bias(index):
+            return lambda bias: bias.reshape((2, units*3))[index]
 
+        bias_shape = (units*3,)
         # ONNX order is update, reset, hidden
+        tensors = {
+            # stacked set of update, reset, hidden weights to be applied to the input
+            'input_weights': (tensors[0][0], [], self.get_tensor_shape(tensors[0][0])),
+            # stacked set of update, reset, hidden weights to be applied to the hidden state
+            'hidden_weights': (tensors[1][0], [], self.get_tensor_shape(tensors[1][0])),
+            # the stacked bias comes in as one tensor which we have to then split into the
+            # stacked set of update, reset, hidden input biases and hidden biases
+            'input_bias': (tensors[2][0], [split_bias(0)], bias_shape),
+            'hidden_bias': (tensors[2][0], [split_bias(1)], bias_shape)
+        }
 
         # we have to invent new unique id's for the tensors since we created more than we had in input_tensors.
         unique_id = "{}_{}_".format(node.operation_type, node.id)
-        tensors = {
-            'input_weights': stacked_input_weights,
-            'hidden_weights': stacked_hidden_weights,
-            'input_bias': stacked_input_bias,
-            'hidden_bias': stacked_hidden_bias
-        }
 
         # register these as global tensors so the importer can find them.
         for key in tensors:
-            t = tensors[key]
-            id = unique_id + key
-            self.add_tensor(id, t)
-            result[key] = (id, t, self.get_order(t))
+            source_id, transforms, shape = tensors[key]
+            result[key] = self.add_derived_tensor(unique_id + key, source_id, transforms, shape)
 
         # remove all the old inputs since we have reshaped them and created new tensors for them, the only input
         # that survives is the input buffer.
@@ -972,7 +1141,7 @@ class OnnxBatchNormalizationConverter(OnnxNodeConverter):
     def get_weights(self):
         input_node = self.get_node(self.node.inputs[0])
         weights = {}
-        tensors = self.get_input_tensors()
+        tensors = self.get_input_weights()
         weights['scale'] = tensors[0]
         weights['bias'] = tensors[1]
         weights['mean'] = tensors[2]
@@ -1202,26 +1371,27 @@ class OnnxMatMulConverter(OnnxNodeConverter):
         else:
             input_shape = self.node.input_shapes[0][0]
 
-        tensor_inputs = self.get_input_tensors()
+        tensor_inputs = self.get_input_weights()
         
         result = {}
         if len(tensor_inputs) > 0:
             weights = tensor_inputs[0]
-            tensor = weights[1]
-            tensor_shape = tensor.shape
+            tensor_shape = self.get_tensor_shape(weights[0])
             tensor_len = len(tensor_shape)
             transpose = self.node.attributes["transpose"]
+            # the changes to the tensor are made when it is loaded, see add_derived_tensor
+            transforms = []
             if tensor_len == 2 :     
           
                 if len(input_shape) == 3:
-                    tensor = self.reshape_3d_into_2d_tensor()
-                    tensor_shape= tensor.shape
+                    transforms.append(lambda tensor, shape=input_shape: self.reshape_3d_into_2d_tensor(shape, tensor, transpose))
+                    if transpose:
+                        tensor_shape = tensor_shape[::-1]
 
                 elif "transpose" in self.node.attributes:
                     # then the weights need to be transposed.
-                    tensor = tensor.T
-                    tensor_shape = tensor.shape
-                    self.add_tensor(weights[0], tensor) # re-register the transposed tensor.
+                    transforms.append(np.transpose)
+                    tensor_shape = tensor_shape[::-1]
 
                 # Now, ELL flattens the input shape and the FullyConnectedLayerNode multiples in the opposite order 
                 # from what you'd expect doing "weight * input", not "input * weight" so we may need to transpose here 
@@ -1231,12 +1401,14 @@ class OnnxMatMulConverter(OnnxNodeConverter):
                     pass
                 elif tensor_shape[0] == input_shape[0]:
                     # then the weights need to be transposed.
-                    tensor = tensor.T
-                    self.add_tensor(weights[0], tensor) # re-register the transformed version.
+                    transforms.append(np.transpose)
+                    tensor_shape = tensor_shape[::-1]
                 else:
                     raise Exception("Cannot multiply matrices of incompatible shapes {} x {}".format(tensor_shape, input_shape))
                 
-                weights = (weights[0], tensor, self.get_order(tensor.shape))
+                if transforms:
+                    # re-register the transformed version.
+                    weights = self.add_derived_tensor(weights[0], weights[0], transforms, tensor_shape)
                 
             result['weights'] = weights
         else:
@@ -1315,22 +1487,26 @@ class OnnxGemmConverter(OnnxNodeConverter):
         else:
             input_shape = self.node.input_shapes[0][0]
 
-        tensor_inputs = self.get_input_tensors()
+        tensor_inputs = self.get_input_weights()
         
         result = {}
         if len(tensor_inputs) > 0:
             weights = tensor_inputs[0]
-            tensor = weights[1]
-            tensor_shape = tensor.shape
+            tensor_shape = self.get_tensor_shape(weights[0])
             tensor_len = len(tensor_shape)
             transpose = self.node.attributes["transB"]
+            # the changes to the tensor are made when it is loaded, see add_derived_tensor
+            transforms = []
+            register = False
             if tensor_len == 2 :                   
                 if len(input_shape) == 3:
-                    tensor = self.reshape_3d_into_2d_tensor(input_shape, weights, transpose)
-                    tensor_shape = tensor.shape
+                    transforms.append(lambda tensor, shape=input_shape: self.reshape_3d_into_2d_tensor(shape, tensor, transpose))
+                    register = True
+                    if transpose:
+                        tensor_shape = tensor_shape[::-1]
                 elif transpose:
-                    tensor = tensor.T
-                    tensor_shape = tensor.shape
+                    transforms.append(np.transpose)
+                    tensor_shape = tensor_shape[::-1]
 
                 # Now, ELL flattens the input shape and the FullyConnectedLayerNode multiples in the opposite order 
                 # from what you'd expect doing "weight * input", not "input * weight" so we may need to transpose here 
@@ -1340,12 +1516,15 @@ class OnnxGemmConverter(OnnxNodeConverter):
                     pass
                 elif tensor_shape[0] == input_shape[0]:
                     # then the weights need to be transposed.
-                    tensor = tensor.T
-                    self.add_tensor(weights[0], tensor) # re-register the transformed version.
+                    transforms.append(np.transpose)
+                    tensor_shape = tensor_shape[::-1]
+                    register = True
                 else:
                     raise Exception("Cannot multiply matrices of incompatible shapes {} x {}".format(tensor_shape, input_shape))
 
-                weights = (weights[0], tensor, self.get_order(tensor.shape))
+                if register:
+                    # re-register the transformed version.
+                    weights = self.add_derived_tensor(weights[0], weights[0], transforms, tensor_shape)
                 
             result['weights'] = weights
         else:
@@ -1458,15 +1637,15 @@ class OnnxConvolutionConverter(ReceptiveFieldConverter):
         """ 
         Get the weights of conv2d node and return a dict of weights in the format:
         { 
-          'weights' : (weight_index, tensor, 'filter_channel_row_column')
-          'bias': (weight_index, tensor, 'channel')
+          'weights' : (weight_index, 'filter_channel_row_column')
+          'bias': (weight_index, 'channel')
         }
         """
-        tensor_inputs = self.get_input_tensors()
+        tensor_inputs = self.get_input_weights()
         result = {}
 
         for i in range(len(tensor_inputs)):
-            if len(tensor_inputs[i][1].shape) == 4:
+            if len(self.get_tensor_shape(tensor_inputs[i][0])) == 4:
                 result['weights'] = tensor_inputs[i]
             else:
                 result['bias'] = tensor_inputs[i]
@@ -1546,17 +1725,21 @@ class OnnxConverter:
         self.output_shapes = {} # id of node to ouput_shape
 
     def _load_onnx(self, path):
-        _logger.info("loading the ONNX model from: " + path)
+        _logger.info("loading the ONNX model from: {}".format(
+            "ModelProto" if isinstance(path, onnx.ModelProto) else path))
         try:
             start = time.time()
+            raw_data = {}
             if isinstance(path, onnx.ModelProto): 
                 onnx_model = path
             else:
                 onnx_model = ModelProto()
-
-            with open(path, 'rb') as f:
-                content = f.read()
-                onnx_model.ParseFromString(content)
+                # parse the model without the raw data of its initializers, the weights are memory-mapped
+                # from the file when they are needed instead (see get_tensor_loader)
+                with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    with memoryview(m) as content:
+                        stripped, raw_data = strip_initializer_raw_data(content)
+                onnx_model.ParseFromString(stripped)
 
             end = time.time()
             seconds = end - start
@@ -1574,7 +1757,7 @@ class OnnxConverter:
         _logger.info("ONNX Graph producer: {} version {}".format(onnx_model.producer_name,
                                                       onnx_model.producer_version))
         _logger.info("ONNX Graph total len: {}".format(len(onnx_model.graph.input)))
-        return onnx_model.graph
+        return onnx_model.graph, raw_data
 
     def get_optype(self, name):        
         if not name in ONNX_OP_TYPE_TO_CONVERTER_MAP:
@@ -1585,21 +1768,30 @@ class OnnxConverter:
         if order is None:
             order = self.get_order(tensor.shape)
         return self.model.add_tensor(id, tensor, order)
+
+    def add_lazy_tensor(self, id, loader, shape, order=None):
+        if order is None:
+            order = self.get_order(shape)
+        self.model.add_lazy_tensor(id, loader, shape, order)
      
      
     def load_model(self, path):
         """ Return a list of ONNX nodes """
         self.model = common.importer.ImporterModel()
 
-        graph = self._load_onnx(path)
+        graph, raw_data = self._load_onnx(path)
         #self.nodes  = utils.ONNX(self.graph).parse_onnx_model()
 
-        input_tensors = {
-            t.name: numpy_helper.to_array(t) for t in graph.initializer
-        }
+        # external data files are relative to the model file
+        model_file = None if isinstance(path, onnx.ModelProto) else os.path.abspath(path)
+        base_dir = "" if model_file is None else os.path.dirname(model_file)
 
-        for id in input_tensors:
-            self.add_tensor(id, input_tensors[id])
+        # the initializers are only loaded when a converter needs them
+        input_tensors = set()
+        for t in graph.initializer:
+            loader = get_tensor_loader(t, base_dir, model_file, raw_data.get(t.name))
+            self.add_lazy_tensor(t.name, loader, tuple(t.dims))
+            input_tensors.add(t.name)
             
         # add input_node first
         for i in graph.input:
@@ -1639,22 +1831,42 @@ class OnnxConverter:
     def define_constant_inputs(self, node):
         for x in node.inputs:
             if self.is_tensor(x) and not x in self.model.nodes:
-                t = self.get_tensor(x)[0]
-                self.add_constant_node(x, t)
+                self.add_constant_node(x)
 
-    def add_constant_node(self, name, tensor):
+    def add_constant_node(self, name):
         node = common.converters.ImporterNode( id = name, 
                                 operation_type = "Constant",
                                 inputs = [],
                                 outputs = [name]
                                 ) 
 
-        # assuming onnx_node is of type: NodeProto, this performs some common conversion operations
-        node.attributes      = { 'tensor': tensor }
+        # the constant refers to the tensor rather than holding its value, so the tensor is only loaded
+        # when the node is converted, and can be released again afterwards.
+        shape = self.model.tensors.get_info(name)[0]
+        node.attributes      = {}
+        node.weights         = { 'tensor': (name, self.get_order(shape)) }
         node.input_shapes    = []
-        node.output_shapes   = [ (tensor.shape, self.get_order(tensor.shape))]
+        node.output_shapes   = [ (shape, self.get_order(shape))]
         self.add_node(node)
 
+    def add_derived_tensor(self, id, source_id, transforms, shape, order=None):
+        """
+        Adds a lazy tensor whose value is the value of the source tensor passed through each of
+        the transforms in turn. The source tensor is not kept loaded, and id can be the same as
+        source_id to replace the tensor with the transformed version.
+        """
+        if order is None:
+            order = self.get_order(shape)
+        load = self.model.tensors.get_loader(source_id)
+
+        def loader():
+            tensor = load()
+            for transform in transforms:
+                tensor = transform(tensor)
+            return tensor
+        self.model.add_lazy_tensor(id, loader, tuple(shape), order)
+        return (id, order)
+
     def get_node(self, id):
         if id in self.model.nodes:
             return self.model.nodes[id]
@@ -1674,8 +1886,7 @@ class OnnxConverter:
         if id in self.output_shapes:
             return self.output_shapes[id]
         if id in self.model.tensors:
-            tensor = self.model.tensors[id]
-            return (tensor[0].shape, tensor[1])
+            return self.model.tensors.get_info(id)
         raise Exception("Output shape for {} not found".format(id))
 
     def is_tensor(self, id):
@@ -0,0 +1,153 @@
+####################################################################################################
+#
+# Project:  Embedded Learning Library (ELL)
+# File:     onnx_importer_test.py (importers)
+# Authors:  Chris Lovett
+#
+# Requires: Python 3.x, onnx-v1.22
+#
+####################################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, "..", "..", "..", "utilities", "pythonlibs"))
+sys.path.append(os.path.join(script_path, "..", ".."))
+sys.path.append(os.path.join(script_path, "..", "lib"))
+
+import onnx
+from onnx import helper, numpy_helper, TensorProto
+
+import find_ell  # noqa: F401
+from common.importer import ImporterEngine
+from common.converters import ConvertBase
+import onnx_converters
+
+
+class RecordingConverter(ConvertBase):
+    """
+    A converter that records the weights of each node it converts, and
+    which of the model's tensors were loaded at the time.
+    """
+    calls = []
+
+    def convert(self, conversion_parameters):
+        lookup_table = conversion_parameters["lookup_table"]
+        weights = dict((key, np.array(lookup_table.tensors[uid][0]))
+                       for key, (uid, order) in self.importer_node.weights.items())
+        loaded = set(uid for uid in lookup_table.tensors if lookup_table.tensors.is_loaded(uid))
+        RecordingConverter.calls.append((self.importer_node.id, weights, loaded))
+        return None
+
+
+def make_conv_model(weights, bias):
+    """ A model with a convolution on a (2, 4, 4) input """
+    graph = helper.make_graph(
+        [helper.make_node("Conv", ["input", "W", "B"], ["conv"], name="conv", kernel_shape=[3, 3],
+                          strides=[1, 1], pads=[0, 0, 0, 0])],
+        "conv",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 2, 4, 4])],
+        [helper.make_tensor_value_info("conv", TensorProto.FLOAT, [1, 3, 2, 2])],
+        initializer=[numpy_helper.from_array(weights, "W"), numpy_helper.from_array(bias, "B")])
+    return helper.make_model(graph)
+
+
+def make_matmul_model(weights):
+    """ A model with a MatMul on a (1, 6) input """
+    graph = helper.make_graph(
+        [helper.make_node("MatMul", ["input", "M"], ["matmul"], name="matmul")],
+        "matmul",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, 6])],
+        [helper.make_tensor_value_info("matmul", TensorProto.FLOAT, [1, 4])],
+        initializer=[numpy_helper.from_array(weights, "M")])
+    return helper.make_model(graph)
+
+
+class OnnxImporterTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.conv_weights = rng.rand(3, 2, 3, 3).astype(np.float32)
+        self.conv_bias = rng.rand(3).astype(np.float32)
+        self.matmul_weights = rng.rand(6, 4).astype(np.float32)
+        self.temp_dir = tempfile.mkdtemp(prefix="onnx_importer_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def save(self, onnx_model, name):
+        filename = os.path.join(self.temp_dir, name)
+        onnx.save(onnx_model, filename)
+        return filename
+
+    def load_and_convert(self, source):
+        """
+        Loads the model with the OnnxConverter, checks none of its tensors are loaded, and
+        converts it. Returns the importer model and the weights and loaded tensors for
+        each converted node.
+        """
+        model = onnx_converters.OnnxConverter().load_model(source)
+        self.assertEqual([uid for uid in model.tensors if model.tensors.is_loaded(uid)], [])
+
+        RecordingConverter.calls = []
+        operation_map = dict((operation_type, RecordingConverter)
+                             for operation_type in ["Input", "Constant", "Convolution", "FullyConnected"])
+        ImporterEngine(operation_map=operation_map).convert(model)
+        # the weights are all released once the last node using them is converted
+        self.assertEqual([uid for uid in model.tensors if model.tensors.is_loaded(uid)], [])
+        return model, dict((call[0], call[1:]) for call in RecordingConverter.calls)
+
+    def test_strip_initializer_raw_data(self):
+        filename = self.save(make_conv_model(self.conv_weights, self.conv_bias), "conv.onnx")
+        with open(filename, "rb") as f:
+            content = f.read()
+        stripped, raw_data = onnx_converters.strip_initializer_raw_data(content)
+        self.assertEqual(sorted(raw_data.keys()), ["B", "W"])
+        self.assertLess(len(stripped), len(content) - self.conv_weights.nbytes)
+
+        expected = onnx.ModelProto()
+        expected.ParseFromString(content)
+        for t in expected.graph.initializer:
+            offset, length = raw_data[t.name]
+            self.assertEqual(content[offset:offset + length], t.raw_data)
+            t.ClearField("raw_data")
+        actual = onnx.ModelProto()
+        actual.ParseFromString(stripped)
+        self.assertEqual(actual, expected)
+
+    def test_conv_weights_are_loaded_on_demand(self):
+        onnx_model = make_conv_model(self.conv_weights, self.conv_bias)
+        for source in [self.save(onnx_model, "conv.onnx"), onnx_model]:
+            model, calls = self.load_and_convert(source)
+            # the nodes refer to the tensors rather than holding their values
+            self.assertEqual(model.nodes["conv"].weights, {"weights": ("W", "filter_channel_row_column"),
+                                                           "bias": ("B", "channel")})
+            self.assertEqual(model.nodes["W"].weights, {"tensor": ("W", "filter_channel_row_column")})
+            self.assertEqual(model.nodes["W"].output_shapes, [((3, 2, 3, 3), "filter_channel_row_column")])
+
+            weights, loaded = calls["conv"]
+            np.testing.assert_array_equal(weights["weights"], self.conv_weights)
+            np.testing.assert_array_equal(weights["bias"], self.conv_bias)
+            self.assertEqual(loaded, {"W", "B"})
+
+    def test_matmul_weights_are_transposed_on_demand(self):
+        onnx_model = make_matmul_model(self.matmul_weights)
+        for source in [self.save(onnx_model, "matmul.onnx"), onnx_model]:
+            model, calls = self.load_and_convert(source)
+            # the transposed weights replace the initializer, and are only transposed when they are loaded
+            self.assertEqual(model.nodes["matmul"].weights, {"weights": ("M", "row_column")})
+            self.assertEqual(model.nodes["matmul"].inputs, ["input"])
+            self.assertEqual(model.tensors.get_info("M"), ((4, 6), "row_column"))
+
+            weights, loaded = calls["matmul"]
+            np.testing.assert_array_equal(weights["weights"], self.matmul_weights.T)
+            self.assertEqual(loaded, {"M"})
+
+
+if __name__ == "__main__":
+    unittest.main()
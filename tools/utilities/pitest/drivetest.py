@@ -43,7 +43,7 @@ class DriveTest:
                  model=None, labels=None, target="pi3", target_dir="/home/pi/test",
                  username="pi", password="raspberry", iterations=1, expected=None,
                  blas=True, compile=COMPILE_INCREMENTAL, test=True, timeout=None, apikey=None,
-                 gitrepo=None, wrap_options=None):
+                 gitrepo=None, wrap_options=None, monitor=None, monitor_interval=1):
         self.ipaddress = ipaddress
         self.build_root = find_ell.find_ell_build()
         self.ell_root = os.path.dirname(self.build_root)
@@ -83,6 +83,9 @@ class DriveTest:
         if wrap_options and type(wrap_options) is not list:
             raise Exception("'wrap_options' should be a list")
         self.wrap_options = wrap_options
+        # optional file to stream the resource usage of the test process to, see procmon.py
+        self.monitor = monitor
+        self.monitor_interval = monitor_interval
 
         # initialize state from the args
         if not self.output_dir:
@@ -354,6 +357,8 @@ class DriveTest:
                 start_time = time.time()
 
                 if self.target != "host":
+                    if self.monitor:
+                        self.logger.warning("process monitoring is only supported for the host target")
                     # do not pass cluster to remote runner because we've already locked the machine.
                     runner = RemoteRunner(cluster=None,
                                           ipaddress=self.ipaddress,
@@ -380,12 +385,22 @@ class DriveTest:
                            "--nogui",
                            "--iterations", str(self.iterations)]
                     proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-                    while True:
-                        line = proc.stdout.readline()
-                        if line != b"":
-                            output.append(line.decode("utf-8").rstrip())
-                        else:
-                            break
+                    monitor = None
+                    if self.monitor:
+                        import procmon
+                        self.logger.info("Monitoring process {} to {}".format(proc.pid, self.monitor))
+                        monitor = procmon.ProcessMonitor(proc.pid, self.monitor, self.monitor_interval, stream=True,
+                                                         children=True).start_thread()
+                    try:
+                        while True:
+                            line = proc.stdout.readline()
+                            if line != b"":
+                                output.append(line.decode("utf-8").rstrip())
+                            else:
+                                break
+                    finally:
+                        if monitor:
+                            monitor.stop()
 
                 end_time = time.time()
                 total_time = end_time - start_time
@@ -447,6 +462,8 @@ used as the model name")
     arg_parser.add_argument("--blas", default="True",
                             help="enable or disable the use of Blas on the target device (default 'True')")
     arg_parser.add_argument("--timeout", help="set remote test run timeout in seconds (default '300')", default="300")
+    arg_parser.add_argument("--monitor", default=None,
+                            help="append the cpu and memory usage of the host test to this file (see procmon.py)")
 
     logger.add_logging_args(arg_parser)
     args = arg_parser.parse_args()
@@ -461,5 +478,6 @@ used as the model name")
     with DriveTest(args.ipaddress, args.cluster, args.outdir, args.profile,
                    args.model, args.labels, args.target, args.target_dir, args.username,
                    args.password, args.iterations, args.expected, str2bool(args.blas),
-                   str2bool(args.compile), str2bool(args.test), args.timeout) as tester:
+                   str2bool(args.compile), str2bool(args.test), args.timeout,
+                   monitor=args.monitor) as tester:
         tester.run_test()
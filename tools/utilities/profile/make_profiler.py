@@ -10,14 +10,16 @@
 ####################################################################################################
 
 import argparse
+import csv
 import datetime
 import glob
 import json
 import logging
 import os
+import re
 import sys
 
-import parse
+import numpy as np
 
 __script_path = os.path.dirname(os.path.abspath(__file__))
 sys.path += [os.path.join(__script_path, "..", "pitest")]
@@ -130,15 +132,32 @@ def options_to_profile(option):
     return profile
 
 
+# the lines printed by the profiling functions of a compiled model
+NODE_PATTERN = re.compile(r"(.+?):\ttype: (.+?)\ttime: ([-+]?\d*\.\d+) ms\tcount: (\d+)\tancestor: (.+)")
+MODEL_PATTERN = re.compile(r"Total time: ([-+]?\d*\.\d+) ms\tcount: (\d+)")
+
+# the columns of the flat per node records written by write_records
+RECORD_FIELDS = ["model", "profile", "run", "ancestor", "name", "type", "time_ms", "count"]
+
+# the type of the record holding the time of the whole model
+MODEL_RECORD_TYPE = "model"
+
+PERCENTILES = [50, 90, 99]
+
+
 def parse_performance_log(log):
     result = {}
     for line in log:
-        node = parse.parse("{}:\ttype: {}\ttime: {:f} ms\tcount: {:d}\tancestor: {}", line)
+        line = line.rstrip("\r\n")
+        node = NODE_PATTERN.fullmatch(line)
         if node:
+            name, node_type, time_ms, count, ancestor_name = node.groups()
+            time_ms = float(time_ms)
+            count = int(count)
             if "node" not in result.keys():
                 result["node"] = {}
 
-            id = "node[" + node[4] + "]"
+            id = "node[" + ancestor_name + "]"
             if id not in result["node"].keys():
                 ancestor = {"time_ms": 0, "count": 0}
                 result["node"][id] = ancestor
@@ -146,21 +165,183 @@ def parse_performance_log(log):
 
             if "descendents" not in ancestor:
                 ancestor["descendents"] = []
-                ancestor["count"] = node[3]
+                ancestor["count"] = count
 
-            if ancestor["count"] != node[3]:
+            if ancestor["count"] != count:
                 raise ValueError("number of count does not match.")
-            ancestor["descendents"].append({"name": node[0], "type": node[1], "time_ms": node[2], "count": node[3]})
-            ancestor["time_ms"] = ancestor["time_ms"] + node[2]
+            ancestor["descendents"].append({"name": name, "type": node_type, "time_ms": time_ms, "count": count})
+            ancestor["time_ms"] = ancestor["time_ms"] + time_ms
 
         else:
-            model = parse.parse("Total time: {:f} ms\tcount: {:d}", line)
+            model = MODEL_PATTERN.fullmatch(line)
             if model:
                 if "model" not in result.keys():
-                    result["model"] = {"time_ms": model[0], "count": model[1]}
+                    result["model"] = {"time_ms": float(model.group(1)), "count": int(model.group(2))}
+    return result
+
+
+def performance_to_records(performance, model="", profile=0, run=""):
+    """ Flatten the result of parse_performance_log into a list of per node records with the RECORD_FIELDS,
+    plus one record of type MODEL_RECORD_TYPE for the whole model """
+    records = []
+    if not performance:
+        return records
+    for ancestor, info in sorted(performance.get("node", {}).items()):
+        for n in info["descendents"]:
+            records.append({"model": model, "profile": profile, "run": run, "ancestor": ancestor, "name": n["name"],
+                            "type": n["type"], "time_ms": n["time_ms"], "count": n["count"]})
+    if "model" in performance:
+        records.append({"model": model, "profile": profile, "run": run, "ancestor": "", "name": "",
+                        "type": MODEL_RECORD_TYPE, "time_ms": performance["model"]["time_ms"],
+                        "count": performance["model"]["count"]})
+    return records
+
+
+def profile_to_records(profile):
+    """ Return the records of every run of every profile configuration in the given profile option file """
+    model = os.path.basename(profile["model"] or "")
+    records = []
+    for i, p in enumerate(profile["profile"]):
+        for run_name, performance in sorted(p.get("result", {}).items()):
+            records += performance_to_records(performance, model, i, run_name)
+    return records
+
+
+def write_records(records, filename):
+    """ Write the records to a .csv file, or a json file for any other extension """
+    if os.path.splitext(filename)[1].lower() == ".csv":
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(filename, "w", newline="\n") as f:
+            json.dump({"records": records}, f, indent=1)
+
+
+def read_records(filename):
+    """ Read the records from a file written by write_records, or from a profile option file with results """
+    if os.path.splitext(filename)[1].lower() == ".csv":
+        with open(filename, "r", newline="") as f:
+            records = list(csv.DictReader(f))
+        for r in records:
+            r["profile"] = int(r["profile"])
+            r["time_ms"] = float(r["time_ms"])
+            r["count"] = int(r["count"])
+        return records
+    with open(filename, "r") as f:
+        data = json.load(f)
+    if "records" in data:
+        return data["records"]
+    if "model" in data and "profile" in data:
+        return profile_to_records(data)
+    raise ValueError("file {} does not contain profile records or results".format(filename))
+
+
+def get_configurations(records):
+    """ Return the sorted list of the (model, profile) configurations that the records were measured with """
+    return sorted({(r["model"], r["profile"]) for r in records})
+
+
+def select_records(records, selector=None):
+    """ Return the records of one (model, profile) configuration.  The selector is "INDEX", "MODEL" or
+    "MODEL:INDEX", where MODEL is the model file name and INDEX is the index of the profile in its profile option
+    file.  It may be omitted when the records only contain one configuration """
+    configurations = get_configurations(records)
+    model, index = None, None
+    if selector is not None:
+        selector = str(selector)
+        if selector.isdigit():
+            index = int(selector)
+        elif ":" in selector:
+            model, index = selector.rsplit(":", 1)
+            index = int(index)
+        else:
+            model = selector
+    matches = [c for c in configurations if (model is None or c[0] == model) and (index is None or c[1] == index)]
+    if len(matches) != 1:
+        available = ", ".join("{}:{}".format(*c) for c in configurations)
+        raise ValueError("{} select one of the profiles {}".format(
+            "'{}' does not".format(selector) if selector is not None else "please", available))
+    return [r for r in records if (r["model"], r["profile"]) == matches[0]]
+
+
+def aggregate_records(records, key="type"):
+    """ Group the records by (model, profile) configuration and then by node "type" or "name", and return a
+    dictionary mapping each configuration to a dictionary mapping each group to the statistics of its time per
+    model evaluation across the recorded runs: the number of runs, mean, min, max and PERCENTILES.  The time of
+    each run is the total time of the group in that run divided by the number of evaluations, so the percentiles
+    are over runs and not over the individual iterations within a run """
+    runs = {}
+    for r in records:
+        group = r["type"] if key == "type" or r["type"] == MODEL_RECORD_TYPE else r["name"]
+        groups = runs.setdefault((r["model"], r["profile"]), {})
+        times = groups.setdefault(group, {})
+        times[r["run"]] = times.get(r["run"], 0) + r["time_ms"] / max(1, r["count"])
+
+    result = {}
+    for configuration, groups in runs.items():
+        result[configuration] = {}
+        for group, times in groups.items():
+            values = np.array(list(times.values()))
+            stats = {"runs": len(values), "mean": float(values.mean()), "min": float(values.min()),
+                     "max": float(values.max())}
+            for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                stats["p{}".format(p)] = float(v)
+            result[configuration][group] = stats
+    return result
+
+
+def diff_records(base, new, key="type", threshold=0.05, statistic="p50", base_selector=None, new_selector=None):
+    """ Compare the aggregated statistic of each group in one configuration of the base records with one
+    configuration of the new records (see select_records), returning a list of dictionaries sorted by the largest
+    increase in time.  A group is marked as regressed when its time grew by more than the threshold fraction of
+    the base time """
+    base_stats = list(aggregate_records(select_records(base, base_selector), key).values())[0]
+    new_stats = list(aggregate_records(select_records(new, new_selector), key).values())[0]
+    result = []
+    for group in set(base_stats.keys()) | set(new_stats.keys()):
+        before = base_stats[group][statistic] if group in base_stats else None
+        after = new_stats[group][statistic] if group in new_stats else None
+        delta = (after or 0) - (before or 0)
+        change = delta / before if before else None
+        result.append({"group": group, "base_ms": before, "new_ms": after, "delta_ms": delta, "change": change,
+                       "regressed": before is not None and after is not None and after > before * (1 + threshold)})
+    result.sort(key=lambda d: d["delta_ms"], reverse=True)
     return result
 
 
+def show_summary(records, key="type"):
+    columns = ["runs", "mean", "min"] + ["p{}".format(p) for p in PERCENTILES] + ["max"]
+    for (model, profile), stats in sorted(aggregate_records(records, key).items()):
+        log.info("\nModel: {}, profile {}".format(model, profile))
+        log.info("{}{}".format(key.ljust(60), "".join(c.rjust(12) for c in columns)))
+        log.info("-" * (60 + 12 * len(columns)))
+        for group in sorted(stats.keys(), key=lambda g: stats[g]["p50"], reverse=True):
+            s = stats[group]
+            log.info("{}{}{}".format(group.ljust(60), str(s["runs"]).rjust(12),
+                                     "".join(format(s[c], ".4f").rjust(12) for c in columns[1:])))
+
+
+def show_diff(diff, key="type"):
+    def format_ms(value):
+        return "-" if value is None else format(value, ".4f")
+
+    log.info("{}{}{}{}{}".format(key.ljust(60), "base_ms".rjust(12), "new_ms".rjust(12), "delta_ms".rjust(12),
+                                 "change".rjust(10)))
+    log.info("-" * 106)
+    for d in diff:
+        change = "new" if d["change"] is None else "{:+.1f}%".format(100 * d["change"])
+        log.info("{}{}{}{}{}{}".format(d["group"].ljust(60), format_ms(d["base_ms"]).rjust(12),
+                                       format_ms(d["new_ms"]).rjust(12), format(d["delta_ms"], "+.4f").rjust(12),
+                                       change.rjust(10), "  REGRESSED" if d["regressed"] else ""))
+    regressed = [d["group"] for d in diff if d["regressed"]]
+    if regressed:
+        log.warning("\n{} regressed: {}".format(key, ", ".join(regressed)))
+    else:
+        log.info("\nno regressions")
+
+
 def run(args, options):
 
     result = None
@@ -207,6 +388,7 @@ def run(args, options):
                    password=args.password,
                    target=target,
                    target_dir="/home/pi/" + target,
+                   monitor=args.monitor,
                    ) as driver:
         driver.run_test()
         log = driver.profile_log
@@ -241,6 +423,24 @@ Use --profile_options to review available options.""")
                         help="Generated profile option file from arguments only. Do not compile and profile.")
 
     parser.add_argument("--iteration", "-i", help="Number of iterations to run each model.", type=int, default=1)
+    parser.add_argument("--monitor", default=None, help="Append the cpu and memory usage of host runs to this file.")
+
+    # structured results
+    results = parser.add_argument_group("Result Options", "Summarize, export and compare the profile results.")
+    results.add_argument("--summary", action="store_true", default=False,
+                         help="Display the percentiles of the time per evaluation across the runs of each profile.")
+    results.add_argument("--export", "-e", default=None,
+                         help="Write the per node results of all the profiles to this .json or .csv file.")
+    results.add_argument("--diff", nargs=2, metavar=("BASE", "NEW"), default=None,
+                         help="Compare two exported result files or profile files and report the regressions.")
+    results.add_argument("--base_profile", default=None, metavar="[MODEL:]INDEX",
+                         help="The model file name and/or profile index to compare in the BASE file of --diff.")
+    results.add_argument("--new_profile", default=None, metavar="[MODEL:]INDEX",
+                         help="The model file name and/or profile index to compare in the NEW file of --diff.")
+    results.add_argument("--by", choices=["type", "name"], default="type",
+                         help="Group the summary and diff results by node type or node name.")
+    results.add_argument("--threshold", type=float, default=5,
+                         help="Percentage increase in time that counts as a regression.")
 
     # profile options
     source = parser.add_mutually_exclusive_group()
@@ -264,7 +464,13 @@ Multiple files are allowed, each seperated by space.")
     if args.log:
         log.setLogfile(args.log)
 
-    if args.profile_options:
+    if args.diff:
+        diff = diff_records(read_records(args.diff[0]), read_records(args.diff[1]), args.by, args.threshold / 100,
+                            base_selector=args.base_profile, new_selector=args.new_profile)
+        show_diff(diff, args.by)
+        if any(d["regressed"] for d in diff):
+            sys.exit(1)
+    elif args.profile_options:
         # just display wrap options
         print("!!! NOTE: Profile options must use full arguments to avoid argument collision !!!")
         builder = ModuleBuilder()
@@ -279,6 +485,7 @@ Multiple files are allowed, each seperated by space.")
                 path = os.path.join(path, "*.json")
             args.file = glob.glob(path)
 
+        all_records = []
         if args.file:
             # read option from file
             all_profile = []
@@ -314,6 +521,7 @@ Multiple files are allowed, each seperated by space.")
                             with open(file=file, mode='w', newline="\n") as f:
                                 log.info("Save profile to {}".format(file))
                                 json.dump(profile, f)
+                        all_records += profile_to_records(profile)
             if args.merge and len(all_profile) > 0:
                 # merge profile files
                 for i in range(len(all_profile)):
@@ -361,3 +569,10 @@ Multiple files are allowed, each seperated by space.")
             with open(file=out_file, mode='w', newline="\n") as f:
                 log.info("Save profile to {}".format(out_file))
                 json.dump(output, f)
+            all_records = profile_to_records(output)
+
+        if args.summary and all_records:
+            show_summary(all_records, args.by)
+        if args.export:
+            log.info("Save {} results to {}".format(len(all_records), args.export))
+            write_records(all_records, args.export)
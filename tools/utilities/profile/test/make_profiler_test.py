@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     make_profiler_test.py
+#  Authors:  Ying Guo
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import make_profiler  # noqa: E402
+
+# the output of a compiled profiler: two nodes under one ancestor, one under another, and the whole model
+PROFILE_LOG = [
+    "Performance counters:\n",
+    "conv1:\ttype: ConvolutionalLayerNode<float>\ttime: 3.0 ms\tcount: 3\tancestor: conv\n",
+    "relu1:\ttype: ActivationLayerNode<float>\ttime: 0.5 ms\tcount: 3\tancestor: conv\n",
+    "fc1:\ttype: FullyConnectedLayerNode<float>\ttime: 1.5 ms\tcount: 3\tancestor: fc\n",
+    "Total time: 6.0 ms\tcount: 3\n",
+    "Done\n",
+]
+
+
+def make_log(scale):
+    """ PROFILE_LOG with every time multiplied by the given scale """
+    result = []
+    for line in PROFILE_LOG:
+        for value in ["3.0", "0.5", "1.5", "6.0"]:
+            if "time: {} ms".format(value) in line:
+                line = line.replace("time: {} ms".format(value), "time: {} ms".format(float(value) * scale))
+                break
+        result.append(line)
+    return result
+
+
+def make_profile(scales):
+    """ A profile option file with one profile per list of run scales """
+    profiles = []
+    for i, runs in enumerate(scales):
+        result = {}
+        for j, scale in enumerate(runs):
+            result["run{}".format(j)] = make_profiler.parse_performance_log(make_log(scale))
+        profiles.append({"config": {}, "result": result})
+    return {"model": os.path.join("models", "model.ell"), "profile": profiles}
+
+
+class MakeProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="make_profiler_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_parse_performance_log(self):
+        performance = make_profiler.parse_performance_log(PROFILE_LOG)
+        self.assertEqual(performance["model"], {"time_ms": 6.0, "count": 3})
+        self.assertEqual(sorted(performance["node"].keys()), ["node[conv]", "node[fc]"])
+        conv = performance["node"]["node[conv]"]
+        self.assertEqual(conv["count"], 3)
+        self.assertAlmostEqual(conv["time_ms"], 3.5)
+        self.assertEqual([d["name"] for d in conv["descendents"]], ["conv1", "relu1"])
+        self.assertEqual(conv["descendents"][1], {"name": "relu1", "type": "ActivationLayerNode<float>",
+                                                  "time_ms": 0.5, "count": 3})
+        self.assertEqual(make_profiler.parse_performance_log(["nothing to see here\n"]), {})
+
+    def test_parse_performance_log_count_mismatch(self):
+        lines = PROFILE_LOG[:2] + ["relu1:\ttype: ActivationLayerNode<float>\ttime: 0.5 ms\tcount: 4\tancestor: conv"]
+        with self.assertRaises(ValueError):
+            make_profiler.parse_performance_log(lines)
+
+    def test_profile_to_records(self):
+        records = make_profiler.profile_to_records(make_profile([[1, 2], [3]]))
+        # 3 nodes and the model in each of the 3 runs
+        self.assertEqual(len(records), 12)
+        self.assertEqual({r["model"] for r in records}, {"model.ell"})
+        self.assertEqual(make_profiler.get_configurations(records), [("model.ell", 0), ("model.ell", 1)])
+        model = [r for r in records if r["type"] == make_profiler.MODEL_RECORD_TYPE]
+        self.assertEqual([(r["profile"], r["run"], r["time_ms"]) for r in model],
+                         [(0, "run0", 6.0), (0, "run1", 12.0), (1, "run0", 18.0)])
+        self.assertEqual(make_profiler.performance_to_records(None), [])
+
+    def test_write_and_read_records(self):
+        profile = make_profile([[1, 2], [3]])
+        records = make_profiler.profile_to_records(profile)
+        for name in ["records.csv", "records.json"]:
+            filename = os.path.join(self.temp_dir, name)
+            make_profiler.write_records(records, filename)
+            self.assertEqual(make_profiler.read_records(filename), records)
+
+        # profile option files with results can be read directly
+        filename = os.path.join(self.temp_dir, "profile.json")
+        with open(filename, "w") as f:
+            make_profiler.json.dump(profile, f)
+        self.assertEqual(make_profiler.read_records(filename), records)
+
+    def test_aggregate_records(self):
+        records = make_profiler.profile_to_records(make_profile([[1, 2, 3, 4], [10]]))
+        stats = make_profiler.aggregate_records(records)
+        # each profile is aggregated separately, with one value per run
+        self.assertEqual(sorted(stats.keys()), [("model.ell", 0), ("model.ell", 1)])
+        model = stats[("model.ell", 0)][make_profiler.MODEL_RECORD_TYPE]
+        self.assertEqual(model["runs"], 4)
+        self.assertAlmostEqual(model["mean"], 5.0)
+        self.assertAlmostEqual(model["min"], 2.0)
+        self.assertAlmostEqual(model["max"], 8.0)
+        self.assertAlmostEqual(model["p50"], 5.0)
+        self.assertAlmostEqual(stats[("model.ell", 1)][make_profiler.MODEL_RECORD_TYPE]["p50"], 20.0)
+
+        conv = stats[("model.ell", 0)]["ConvolutionalLayerNode<float>"]
+        self.assertAlmostEqual(conv["p50"], 2.5)
+
+        by_name = make_profiler.aggregate_records(records, "name")[("model.ell", 0)]
+        self.assertEqual(sorted(by_name.keys()), ["conv1", "fc1", "model", "relu1"])
+        self.assertAlmostEqual(by_name["relu1"]["max"], 4 * 0.5 / 3)
+
+    def test_select_records(self):
+        records = make_profiler.profile_to_records(make_profile([[1], [2]]))
+        other = make_profile([[3]])
+        other["model"] = "other.ell"
+        records += make_profiler.profile_to_records(other)
+
+        def configurations(selector):
+            return make_profiler.get_configurations(make_profiler.select_records(records, selector))
+
+        self.assertEqual(configurations("1"), [("model.ell", 1)])
+        self.assertEqual(configurations("model.ell:0"), [("model.ell", 0)])
+        self.assertEqual(configurations("other.ell"), [("other.ell", 0)])
+        for selector in [None, "0", "model.ell", "model.ell:2", "missing.ell"]:
+            with self.assertRaises(ValueError):
+                make_profiler.select_records(records, selector)
+
+    def test_diff_records(self):
+        base = make_profiler.profile_to_records(make_profile([[1, 1, 1], [2, 2, 2]]))
+        new = make_profiler.profile_to_records(make_profile([[1.02, 1.02, 1.02]]))
+
+        # the new file has a single profile, so only the base side needs selecting
+        with self.assertRaises(ValueError):
+            make_profiler.diff_records(base, new)
+        diff = make_profiler.diff_records(base, new, base_selector="0")
+        self.assertEqual(len(diff), 4)
+        self.assertEqual(diff[0]["group"], make_profiler.MODEL_RECORD_TYPE)
+        self.assertAlmostEqual(diff[0]["base_ms"], 2.0)
+        self.assertAlmostEqual(diff[0]["new_ms"], 2.04)
+        self.assertAlmostEqual(diff[0]["change"], 0.02)
+        self.assertFalse(any(d["regressed"] for d in diff))
+        diff = make_profiler.diff_records(base, new, threshold=0.01, base_selector="0")
+        self.assertTrue(all(d["regressed"] for d in diff))
+
+        # comparing the two profiles of the same file
+        diff = make_profiler.diff_records(base, base, base_selector="0", new_selector="1")
+        self.assertTrue(all(d["regressed"] for d in diff))
+        diff = make_profiler.diff_records(base, base, base_selector="1", new_selector="0")
+        self.assertFalse(any(d["regressed"] for d in diff))
+        self.assertTrue(all(d["delta_ms"] < 0 for d in diff))
+
+        # groups that only exist on one side
+        new = [r for r in new if r["type"] != "ActivationLayerNode<float>"]
+        new.append(dict(new[0], name="pool1", type="PoolingLayerNode<float>"))
+        diff = {d["group"]: d for d in make_profiler.diff_records(base, new, base_selector="0")}
+        self.assertIsNone(diff["ActivationLayerNode<float>"]["new_ms"])
+        self.assertIsNone(diff["PoolingLayerNode<float>"]["base_ms"])
+        self.assertIsNone(diff["PoolingLayerNode<float>"]["change"])
+
+
+if __name__ == "__main__":
+    unittest.main()
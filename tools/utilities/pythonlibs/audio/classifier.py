@@ -13,6 +13,122 @@ import time
 import numpy as np
 
 
+class PredictionSmoother:
+    """
+    Averages classifier outputs over a sliding window using a fixed size circular buffer of the recent outputs
+    and a running sum, so each frame costs O(classes) no matter how long the window is.  By default the window
+    is the last window_size frames, so the result only depends on the frame index and offline replays match live
+    audio.  In wall clock mode (when a delay in seconds is given) the window is instead the outputs received in
+    the last delay seconds, and like the original AudioClassifier smoothing it starts over whenever more than one
+    second has passed since the window was started.
+    """
+    def __init__(self, window_size, delay=None):
+        """
+        window_size - number of frames to average over (the initial capacity of the buffer in wall clock mode)
+        delay - optional window length in seconds, which selects wall clock mode
+        """
+        self.window_size = max(1, int(window_size))
+        self.delay = delay
+        self.buffer = None
+        self.times = None
+        self.reset()
+
+    def reset(self):
+        """ Forget all previous outputs """
+        self.head = 0  # index of the oldest output in the buffer
+        self.count = 0
+        self.sum = None if self.buffer is None else np.zeros(self.buffer.shape[1])
+        self.start_time = None
+
+    def _allocate(self, size, classes):
+        self.buffer = np.zeros((size, classes))
+        self.times = np.zeros(size)
+        self.sum = np.zeros(classes)
+
+    def _drop_oldest(self):
+        self.sum -= self.buffer[self.head]
+        self.head = (self.head + 1) % len(self.buffer)
+        self.count -= 1
+
+    def _order(self):
+        """ Return the buffer indexes of the buffered outputs from oldest to newest """
+        return np.arange(self.head, self.head + self.count) % len(self.buffer)
+
+    def _grow(self):
+        order = self._order()
+        buffer, times = self.buffer[order], self.times[order]
+        self._allocate(2 * len(buffer), buffer.shape[1])
+        self.buffer[:self.count] = buffer
+        self.times[:self.count] = times
+        self.sum = buffer.sum(axis=0)
+        self.head = 0
+
+    def smooth(self, output, now=None):
+        """ Add the given output vector to the window and return the average of the window """
+        output = np.ravel(output)
+        if self.buffer is None or self.buffer.shape[1] != len(output):
+            self._allocate(self.window_size, len(output))
+            self.reset()
+
+        if self.delay is not None:
+            now = time.time() if now is None else now
+            if self.start_time is None or now > self.start_time + 1:
+                self.reset()  # more than 1 second since the window was started, so start over
+                self.start_time = now
+            while self.count and self.times[self.head] + self.delay < now:
+                self._drop_oldest()
+            if self.count == len(self.buffer):
+                self._grow()  # more outputs arrived within the delay than we have room for
+        elif self.count == len(self.buffer):
+            self._drop_oldest()
+
+        size = len(self.buffer)
+        tail = (self.head + self.count) % size
+        self.buffer[tail] = output
+        self.times[tail] = now or 0
+        self.sum += output
+        self.count += 1
+        if tail == size - 1:
+            # recompute the running sum once per trip around the buffer so rounding errors can't accumulate
+            self.sum = self.buffer[self._order()].sum(axis=0)
+        return self.sum / self.count
+
+    def smooth_batch(self, outputs):
+        """ Smooth the given 2D array of outputs, one row per frame, continuing from the current window, and return
+        the smoothed rows.  In frame mode this is computed with one cumulative sum over all the rows """
+        outputs = np.asarray(outputs, dtype=np.float64)
+        if self.delay is not None:
+            return np.array([self.smooth(output) for output in outputs]).reshape(outputs.shape)
+        if len(outputs) == 0:
+            return outputs
+        if self.buffer is None or self.buffer.shape[1] != outputs.shape[1]:
+            self._allocate(self.window_size, outputs.shape[1])
+            self.reset()
+        history = self.buffer[self._order()]
+        rows = np.concatenate((history, outputs)) if len(history) else outputs
+        result = smooth_sequence(rows, self.window_size)[len(history):]
+
+        # keep the last window_size rows for the next call
+        keep = min(self.window_size, len(rows))
+        self.buffer[:keep] = rows[len(rows) - keep:]
+        self.head = 0
+        self.count = keep
+        self.sum = self.buffer[:keep].sum(axis=0)
+        return result
+
+
+def smooth_sequence(outputs, window_size):
+    """ Return the average of each row of the given 2D array of outputs and up to window_size - 1 rows before it,
+    which is what PredictionSmoother.smooth returns in frame mode when given the rows one at a time """
+    outputs = np.asarray(outputs, dtype=np.float64)
+    totals = np.zeros((len(outputs) + 1,) + outputs.shape[1:])
+    np.cumsum(outputs, axis=0, out=totals[1:])
+    end = np.arange(1, len(outputs) + 1)
+    start = np.maximum(0, end - max(1, int(window_size)))
+    counts = (end - start).reshape((-1,) + (1,) * (outputs.ndim - 1))
+    return (totals[end] - totals[start]) / counts
+
+
 class AudioClassifier:
     """
     This class wraps an ELL audio classifier model and adds some nice features, like mapping the
@@ -21,15 +137,18 @@ class AudioClassifier:
     tend to be rather noisy. It also supports a threshold value so any prediction less than this
     probability is ignored.
     """
-    def __init__(self, model_path, categories_file, threshold=0, smoothing_delay=0):
+    def __init__(self, model_path, categories_file, threshold=0, smoothing_delay=0, frame_duration=None):
         """
         Initialize the new AudioClassifier.
         model - the path to the ELL model module to load.
         categories_file - the path to a text file containing strings labels for each prediction
         threshold - threshold for predictions, (default 0).
-        smoothing_delay - controls the size of this window (defaults to 0).
+        smoothing_delay - controls the size of this window in seconds (defaults to 0).
+        frame_duration - the seconds of audio per prediction.  When given the smoothing window is the last
+        smoothing_delay / frame_duration frames, otherwise it is based on the wall clock time of each prediction.
         """
         self.smoothing_delay = smoothing_delay
+        self.frame_duration = frame_duration
         self.threshold = threshold
         self.categories = None
         self.ignore_list = []
@@ -54,8 +173,7 @@ class AudioClassifier:
         self.output_shape = (ts.rows, ts.columns, ts.channels)
         self.input_size = int(self.model.input_shape.Size())
         self.output_size = int(self.model.output_shape.Size())
-        self.items = []
-        self.start_time = None
+        self.smoother = self.create_smoother()
         self.total_time = 0
         self.count = 0
 
@@ -77,9 +195,65 @@ class AudioClassifier:
         if self.logfile:
             self.logfile.write("{}\n".format(",".join([str(x) for x in output])))
 
-        if self.smoothing_delay:
-            output = self._smooth(output)
+        return self._process_output(output)
+
+    def set_frame_duration(self, frame_duration):
+        """ Set the seconds of audio per prediction, which is usually the featurizer input size divided by the
+        sample rate, so the smoothing window is counted in frames and offline replays match live audio """
+        self.frame_duration = frame_duration
+        self.smoother = self.create_smoother()
+
+    def create_smoother(self):
+        """ Create a new PredictionSmoother for this classifier's smoothing settings, or None if smoothing is off.
+        Each audio stream needs its own smoother """
+        if not self.smoothing_delay:
+            return None
+        if self.frame_duration:
+            return PredictionSmoother(round(self.smoothing_delay / self.frame_duration))
+        return PredictionSmoother(64, self.smoothing_delay)
+
+    def smooth_sequence(self, outputs):
+        """ Return the frame mode smoothing of the given 2D array of model outputs for offline scoring, without
+        changing the state of this classifier """
+        if not self.smoothing_delay:
+            return np.asarray(outputs)
+        if not self.frame_duration:
+            raise Exception("smooth_sequence needs the frame_duration")
+        return smooth_sequence(outputs, round(self.smoothing_delay / self.frame_duration))
+
+    def predict_batch(self, feature_rows, state=None, smoother=None):
+        """ process each row of the given 2D array of feature_data using the classifier model in one batch,
+        returning a list containing a (prediction, probability, label) tuple for each row.  The optional
+        state is a ModelState from model.create_state() holding the hidden state of one audio stream, and
+        the optional smoother is a PredictionSmoother from create_smoother() for that stream, so one compiled
+        classifier can serve many streams """
+
+        start_time = time.time()
+        if state is None:
+            outputs = self.model.transform_batch(feature_rows)
+        else:
+            outputs = self.model.transform_batch(feature_rows, state=state)
+        now = time.time()
+        self.total_time += now - start_time
+        self.count += len(outputs)
+
+        if self.logfile:
+            for output in outputs:
+                self.logfile.write("{}\n".format(",".join([str(x) for x in output])))
 
+        smoother = smoother or self.smoother
+        if smoother:
+            outputs = smoother.smooth_batch(outputs)
+        return [self._get_result(output) for output in outputs]
+
+    def _process_output(self, output):
+        """ smooth the given model output and map it to a (prediction, probability, label) tuple """
+        if self.smoother:
+            output = self.smoother.smooth(output)
+        return self._get_result(output)
+
+    def _get_result(self, output):
+        """ map the given model output to a (prediction, probability, label) tuple """
         prediction = self._get_prediction(output)
         if prediction is not None:
             label = ""
@@ -92,6 +266,8 @@ class AudioClassifier:
 
     def reset(self):
         self.model.reset()
+        if self.smoother:
+            self.smoother.reset()
 
     def _get_prediction(self, output):
         """ handles scalar and vector predictions """
@@ -108,23 +284,6 @@ class AudioClassifier:
                 return prediction
         return None
 
-    def _smooth(self, predictions):
-        """ smooth the predictions over a time delay window """
-        now = time.time()
-        # if we get more than 1 second delay then reset our state
-        if self.start_time is None or now > self.start_time + 1:
-            self.start_time = now
-            self.items = []
-
-        # trim to our delay window
-        new_items = [x for x in self.items if x[0] + self.smoothing_delay >= now]
-        new_items += [(now, predictions)]  # add our new item
-        self.items = new_items
-
-        # compute summed probabilities over this new sliding window
-        sum = np.sum([p[1] for p in new_items], axis=0)
-        return sum / len(new_items)
-
     def avg_time(self):
         """ get the average prediction time """
         if self.count == 0:
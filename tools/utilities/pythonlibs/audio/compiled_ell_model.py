@@ -6,13 +6,32 @@ import sys
 import numpy as np
 
 
+class ModelState:
+    """
+    The hidden state of one audio stream for a CompiledModel that exposes its hidden state.  The state is
+    double buffered, predict reads the hidden buffer and writes the new buffer and then the two are swapped,
+    so the new state never needs to be copied back.  Each state also has its own output buffer, so streams
+    never share a buffer the model writes to.
+    """
+    def __init__(self, module, state_size, output_size):
+        self.hidden = module.FloatVector(state_size)
+        self.new = module.FloatVector(state_size)
+        self.output = module.FloatVector(output_size)
+
+    def swap(self):
+        """ Make the new state the current hidden state """
+        self.hidden, self.new = self.new, self.hidden
+
+
 class CompiledModel:
     """
     This is a wrapper on a compiled ELL model that can also handle the FastGRNN models.
     The predict function on FastGRNN models takes 2 inputs and produces 2 outputs since the hidden
-    state is exposed. This wrapper hides this hidden state as a member, and copies the new_state to
-    the hidden state after each call to predict.  It also provides a reset() function which can
-    clean the hidden state.
+    state is exposed. This wrapper hides this hidden state in a ModelState member, and swaps the new_state
+    with the hidden state after each call to predict.  It also provides a reset() function which can
+    clean the hidden state.  One loaded model can serve many independent audio streams by creating a
+    ModelState for each stream with create_state() and passing it to transform, or by selecting it with
+    select_state().
     """
     def __init__(self, model_path):
         self.module = None
@@ -39,9 +58,18 @@ class CompiledModel:
         self.output_shape = self.wrapper.GetOutputShape(0)
         self.output = self.module.FloatVector(self.output_size)
         self.state_size = self.wrapper.GetInputSize(1)
+        self.state = None
         if self.state_size:
-            self.hidden_state = self.module.FloatVector(self.state_size)
-            self.new_state = self.module.FloatVector(self.state_size)
+            self.zero_state = np.zeros((self.state_size), dtype=np.float32)
+            self.state = self.create_state()
+
+    @property
+    def hidden_state(self):
+        return self.state.hidden
+
+    @property
+    def new_state(self):
+        return self.state.new
 
     def __del__(self):
         del self.module
@@ -55,15 +83,84 @@ class CompiledModel:
     def predict(self, input):
         return self.transform(input)
 
-    def transform(self, input):
+    def create_state(self):
+        """ Create a new zeroed ModelState, for example, for a new audio stream """
+        if not self.state_size:
+            raise Exception("### This model does not expose its hidden state")
+        return ModelState(self.module, self.state_size, self.output_size)
+
+    def select_state(self, state):
+        """ Make the given ModelState the one used when no state is passed to transform, and return the
+        previously selected state """
+        previous = self.state
+        self.state = state
+        return previous
+
+    def get_state(self, state=None):
+        """ Return a numpy snapshot of the given (or currently selected) hidden state """
+        state = state or self.state
+        return np.array(state.hidden)
+
+    def set_state(self, snapshot, state=None):
+        """ Restore the given (or currently selected) hidden state from a snapshot returned by get_state """
+        state = state or self.state
+        state.hidden.copy_from(np.array(snapshot, dtype=np.float32).ravel())
+
+    def transform(self, input, state=None):
         if self.state_size:
-            self.wrapper.Predict(self.get_vector(input), self.hidden_state, self.output, self.new_state)
-            self.hidden_state = self.module.FloatVector(self.new_state)  # copy new state back to hidden state
-        else:
-            self.output = self.wrapper.Predict(self.get_vector(input))
+            state = state or self.state
+            self.wrapper.Predict(self.get_vector(input), state.hidden, state.output, state.new)
+            state.swap()
+            return np.array(state.output)
 
+        self.output = self.wrapper.Predict(self.get_vector(input))
         return np.array(self.output)
 
-    def reset(self):
-        self.hidden_state = self.module.FloatVector(self.state_size)
-        self.wrapper.Reset()
+    def transform_batch(self, frames, output=None, state=None):
+        """
+        Transform each row of the given 2D float32 array of frames, returning a 2D float32 array of outputs, one
+        row per frame.  The optional output array must be a C contiguous float32 array of shape
+        (len(frames), output_size) and is filled in place.  Unlike transform this reuses one input vector and
+        copies the rows in and out of the model through the buffer protocol, so no per-frame numpy or SWIG
+        vectors are allocated.  Stateful models carry their hidden state from one frame to the next in the given
+        (or currently selected) ModelState.
+        """
+        frames = np.ascontiguousarray(frames, dtype=np.float32)
+        if not frames.flags.writeable:
+            frames = frames.copy()  # the buffer protocol copy below needs a writable buffer
+        if frames.ndim != 2 or frames.shape[1] != self.input_size:
+            raise Exception("Expecting frames of shape (n, {}), but got {}".format(self.input_size, frames.shape))
+        if output is None:
+            output = np.zeros((len(frames), self.output_size), dtype=np.float32)
+        elif output.dtype != np.float32 or output.shape != (len(frames), self.output_size) or \
+                not output.flags.c_contiguous:
+            raise Exception("Expecting contiguous float32 output of shape ({}, {})".format(
+                len(frames), self.output_size))
+        if np.any(np.isnan(frames)):
+            frames = np.nan_to_num(frames)
+
+        state = state or self.state
+        input_vector = self.module.FloatVector(self.input_size)
+        for i in range(len(frames)):
+            input_vector.copy_from(frames[i])
+            if self.state_size:
+                self.wrapper.Predict(input_vector, state.hidden, state.output, state.new)
+                state.swap()
+                result = state.output
+            else:
+                result = self.wrapper.Predict(input_vector)
+            self.module.copy_to_buffer_float(result, output[i])
+
+        return output
+
+    def reset(self, state=None):
+        """
+        Zero the given (or currently selected) hidden state.  This leaves the other states alone, so it does
+        not call the wrapper's Reset, which would reset state shared by every stream.  Models that don't expose
+        their hidden state only have the one stream, so they are reset with the wrapper's Reset.
+        """
+        if self.state_size:
+            state = state or self.state
+            state.hidden.copy_from(self.zero_state)
+        else:
+            self.wrapper.Reset()
@@ -42,6 +42,16 @@ class ComputeModel:
         # Send the input to the predict function and return the prediction result
         return np.array(self.map.Compute(in_vec, dtype=np.float32))
 
+    def transform_batch(self, frames, output=None):
+        """ call the ell model on each row of the 2D array 'frames', returning a 2D float32 array of outputs.
+        The optional 'output' array of shape (len(frames), output_size) is filled in place """
+        frames = np.ascontiguousarray(frames, dtype=np.float32)
+        if output is None:
+            output = np.zeros((len(frames), int(self.output_shape.Size())), dtype=np.float32)
+        for i in range(len(frames)):
+            output[i] = self.map.Compute(frames[i], dtype=np.float32)
+        return output
+
     def reset(self):
         """ reset all model state """
         self.map.Reset()
@@ -81,6 +81,17 @@ class AudioTransform:
         self.total_time += diff
         return result
 
+    def transform_batch(self, frames, output=None):
+        """ Transform all rows of the given 2D array of audio frames at once, returning a 2D float32 array
+        with one row of features per frame, written to the optional output array if provided """
+        if len(frames) == 0:
+            return np.zeros((0, self.output_size), dtype=np.float32)
+        start_time = time.time()
+        result = self.model.transform_batch(frames, output)
+        self.total_time += time.time() - start_time
+        self.frame_count += len(frames)
+        return result
+
     def close(self):
         self.audio_source.close()
 
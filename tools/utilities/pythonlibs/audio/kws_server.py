@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     kws_server.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+"""
+A keyword spotting server that runs the featurizer and classifier from run_classifier.py over many
+concurrent audio streams in one process.
+
+Each client connects over a TCP or UNIX socket and sends raw 16 bit little endian mono PCM audio at the
+sample rate the featurizer expects, then shuts down its side of the connection when it is done.  The
+server sends back one json line per detection, for example:
+
+    {"stream": 3, "time": 1.25, "wall_time": 1571234567.8, "prediction": 2, "probability": 0.91, "label": "yes"}
+
+where time is the offset in seconds of the end of the detected frame from the start of the stream.
+
+The streams are multiplexed over worker threads.  Each worker wraps the loaded featurizer and classifier
+modules once and every stream gets its own classifier ModelState, so adding a stream only costs the size of
+the hidden state and not another copy of the models.  A compiled module is loaded once per process though,
+so every worker calls into the same models, and those calls are serialized by one lock.  More than one
+worker only overlaps the model calls with the rest of the work on the audio, which is why the server
+defaults to a single worker.
+
+The compiled featurizer keeps its sliding window buffer inside the module, so it cannot be given a separate
+state per stream.  The internal state of the models carries over from one chunk of a stream to the next as
+long as no other stream runs in between, and each worker processes all the chunks waiting for a stream in
+one go.  When the models last ran another stream, the server restores this stream's state instead: it
+measures how many previous frames the featurizer output depends on, keeps that many recent frames for each
+stream, and replays them through the featurizer before the stream's new frames, so each stream sees exactly
+the buffer it would see on its own.  Classifiers that do not expose their hidden state are handled the same
+way, and a model whose memory is longer than MAX_HISTORY frames is refused.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+import classifier
+import featurizer
+import wav_reader
+from run_classifier import THRESHOLD, SAMPLE_RATE, CHANNELS, SMOOTHING
+
+CHUNK_SIZE = 4096  # number of bytes read from a client socket at a time
+QUEUE_SIZE = 16  # number of pending audio chunks per worker before the readers are blocked
+MAX_HISTORY = 32  # the most previous frames a shared featurizer or classifier may depend on
+
+
+def measure_history(model, max_frames=MAX_HISTORY, seed=0):
+    """
+    Return the number of previous frames that the output of the given compiled model depends on through the
+    state it keeps internally, for example 1 for a featurizer that buffers 2 frames.  The same test frames are
+    transformed after two different random prefixes and the outputs match once the prefix has been flushed
+    out.  Returns None if the outputs still differ after max_frames frames.
+    """
+    rng = np.random.RandomState(seed)
+    size = model.input_size
+    test = rng.uniform(-1, 1, (max_frames + 1, size)).astype(np.float32)
+    outputs = []
+    for i in range(2):
+        prefix = rng.uniform(-1, 1, (max_frames, size)).astype(np.float32)
+        outputs += [model.transform_batch(np.concatenate((prefix, test)))[max_frames:]]
+    differs = np.flatnonzero(np.any(outputs[0] != outputs[1], axis=1))
+    if len(differs) == 0:
+        return 0
+    if differs[-1] == max_frames:
+        return None
+    return int(differs[-1]) + 1
+
+
+def parse_address(address):
+    """ Parse a server address which is either "unix:path", "host:port" or just a port number on localhost """
+    if address.startswith("unix:"):
+        return address[5:]
+    host, _, port = address.rpartition(":")
+    return (host or "localhost", int(port))
+
+
+class AudioStream:
+    """ The state of one client audio stream: the unprocessed samples, its hidden model state, its prediction
+    smoother and the connection the detection events are written to """
+    def __init__(self, stream_id, frame_size, sample_rate, auto_scale, model_state, smoother, output,
+                 frame_history=None, feature_history=None):
+        self.id = stream_id
+        self.frame_size = frame_size
+        self.sample_rate = sample_rate
+        self.scale = 1 / 32768 if auto_scale else 1
+        self.model_state = model_state
+        self.smoother = smoother
+        self.output = output
+        self.frame_count = 0
+        self.detections = 0
+        self.pending = b""
+        self.tail = np.zeros(0, dtype=np.float32)
+        # the recent input frames and features that are replayed through the shared models before new frames,
+        # starting as silence which matches a freshly reset featurizer
+        self.frame_history = frame_history
+        self.feature_history = feature_history
+        self.closed = False
+        self.done = threading.Event()
+
+    def add_bytes(self, data):
+        """ Add the given PCM bytes to the stream and return a 2D array of the complete frames now available """
+        data = self.pending + data
+        end = len(data) - len(data) % 2
+        self.pending = data[end:]
+        samples = np.frombuffer(data[:end], dtype="<i2").astype(np.float32) * self.scale
+        if len(self.tail):
+            samples = np.concatenate((self.tail, samples))
+        count = len(samples) // self.frame_size
+        self.tail = samples[count * self.frame_size:]
+        return samples[:count * self.frame_size].reshape(count, self.frame_size)
+
+    def flush(self):
+        """ Return the final partial frame padded with zeros, the same way WavReader pads the end of a file """
+        frames = np.zeros((1 if len(self.tail) else 0, self.frame_size), dtype=np.float32)
+        if len(self.tail):
+            frames[0, :len(self.tail)] = self.tail
+            self.tail = self.tail[:0]
+        return frames
+
+    def detected(self, frame, prediction, probability, label):
+        """ Send a detection event for the given frame index back to the client """
+        self.detections += 1
+        if self.closed:
+            return
+        event = {
+            "stream": self.id,
+            "time": (frame + 1) * self.frame_size / self.sample_rate,
+            "wall_time": time.time(),
+            "prediction": int(prediction),
+            "probability": float(probability),
+            "label": label
+        }
+        try:
+            self.output.write((json.dumps(event) + "\n").encode("utf-8"))
+            self.output.flush()
+        except OSError:
+            self.closed = True  # client went away, keep processing so the worker queue drains normally
+
+
+class SharedModels:
+    """ The lock held while the compiled modules shared by all the workers run, and the stream whose internal
+    state the models currently hold, or None if it is not the state of any stream """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stream = None
+
+
+class StreamWorker(threading.Thread):
+    """ A worker thread with its own wrappers on the featurizer and classifier modules that processes the
+    audio chunks of all the streams assigned to it, in order.  The compiled modules are shared by every
+    worker, see SharedModels """
+    def __init__(self, featurizer_model, classifier_model, categories, threshold, smoothing, sample_rate,
+                 queue_size=QUEUE_SIZE, shared=None):
+        super().__init__(daemon=True)
+        self.predictor = classifier.AudioClassifier(classifier_model, categories, threshold, 0)
+        self.transform = featurizer.AudioTransform(featurizer_model, self.predictor.input_size)
+        if self.transform.using_map or self.predictor.using_map:
+            raise Exception("the server needs compiled models so each stream can have its own hidden state")
+        self.smoothing_frames = round(smoothing * sample_rate / self.transform.input_size)
+        self.jobs = queue.Queue(queue_size)
+        self.stream_count = 0
+        self.shared = shared or SharedModels()
+        self.featurizer_history = 0
+        self.classifier_history = 0
+
+    def measure_history(self):
+        """ Measure how many previous frames the featurizer and classifier outputs depend on through their
+        internal state, raising an exception if either remembers more than MAX_HISTORY frames """
+        with self.shared.lock:
+            self.shared.stream = None
+            self.featurizer_history = measure_history(self.transform.model)
+            if self.featurizer_history is None:
+                raise Exception("the featurizer remembers more than {} frames, so it cannot be shared by many "
+                                "streams".format(MAX_HISTORY))
+            self.classifier_history = 0
+            if not self.predictor.model.state_size:
+                self.classifier_history = measure_history(self.predictor.model)
+                if self.classifier_history is None:
+                    raise Exception("the classifier has hidden state that it does not expose, so it cannot be "
+                                    "shared by many streams")
+
+    def create_history(self):
+        """ Create the frame and feature history for a new stream """
+        return (np.zeros((self.featurizer_history, self.transform.input_size), dtype=np.float32),
+                np.zeros((self.classifier_history, self.predictor.input_size), dtype=np.float32))
+
+    def create_state(self):
+        """ Create the hidden state for a new stream, or None if the classifier is stateless """
+        if self.predictor.model.state_size:
+            return self.predictor.model.create_state()
+        return None
+
+    def create_smoother(self):
+        """ Create the prediction smoother for a new stream, or None if smoothing is off.  The smoothing window
+        is counted in frames so the detections do not depend on how fast the audio arrives """
+        if self.smoothing_frames:
+            return classifier.PredictionSmoother(self.smoothing_frames)
+        return None
+
+    def get_jobs(self):
+        """ Wait for the next job and return it along with any others already queued, with the chunks of each
+        stream joined together, in order, so that a stream's chunks run through the models in one go.  Returns
+        a list of (stream, frames, last) jobs, and whether the worker was asked to stop """
+        jobs = [self.jobs.get()]
+        while jobs[-1] is not None:
+            try:
+                jobs.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        stop = jobs[-1] is None
+        streams = {}
+        for job in jobs[:-1] if stop else jobs:
+            stream, frames, last = job
+            if stream in streams:
+                previous, _ = streams[stream]
+                streams[stream] = (previous + [frames], last)
+            else:
+                streams[stream] = ([frames], last)
+        jobs = [(stream, np.concatenate(frames) if len(frames) > 1 else frames[0], last)
+                for stream, (frames, last) in streams.items()]
+        return jobs, stop
+
+    def run(self):
+        stop = False
+        while not stop:
+            jobs, stop = self.get_jobs()
+            for stream, frames, last in jobs:
+                try:
+                    if len(frames):
+                        results = self.process(stream, frames)
+                        for i, (prediction, probability, label) in enumerate(results):
+                            if probability is not None:
+                                stream.detected(stream.frame_count + i, prediction, probability, label)
+                        stream.frame_count += len(frames)
+                except Exception as e:
+                    print("### Error processing stream {}: {}".format(stream.id, e))
+                    stream.closed = True
+                if last:
+                    stream.done.set()
+
+    def process(self, stream, frames):
+        """ Featurize and classify the given frames of the given stream.  If the shared models last ran another
+        stream, the stream's recent frames are replayed through them first, so their internal state is the state
+        this stream left them in """
+        with self.shared.lock:
+            if self.shared.stream is not stream:
+                self.shared.stream = stream
+                if len(stream.frame_history):
+                    # the features are dropped, this only restores the featurizer's internal state
+                    self.transform.transform_batch(stream.frame_history)
+                if len(stream.feature_history):
+                    # the results are dropped, this only restores the classifier's internal state
+                    self.predictor.predict_batch(stream.feature_history)
+            features = self.transform.transform_batch(frames)
+            results = self.predictor.predict_batch(features, stream.model_state, stream.smoother)
+        stream.frame_history = np.concatenate((stream.frame_history, frames))[len(frames):]
+        stream.feature_history = np.concatenate((stream.feature_history, features))[len(features):]
+        return results
+
+
+class _StreamHandler(socketserver.StreamRequestHandler):
+    """ Reads the PCM audio from one client connection and hands it to the stream's worker """
+    def handle(self):
+        spotter = self.server.spotter
+        stream, worker = spotter.open_stream(self.wfile)
+        try:
+            while not stream.closed:
+                data = self.request.recv(CHUNK_SIZE)
+                if not data:
+                    break
+                frames = stream.add_bytes(data)
+                if len(frames):
+                    worker.jobs.put((stream, frames, False))
+        except OSError:
+            stream.closed = True
+        finally:
+            spotter.close_stream(stream, worker)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class KeywordSpotterServer:
+    """
+    Serves keyword spotting over any number of concurrent PCM audio streams.  Each new stream is assigned to
+    the worker with the fewest streams and stays there, so its frames are always processed in order.
+    """
+    def __init__(self, featurizer_model, classifier_model, categories, threshold=THRESHOLD,
+                 sample_rate=SAMPLE_RATE, num_workers=1, auto_scale=False, queue_size=QUEUE_SIZE,
+                 smoothing=SMOOTHING):
+        """
+        Load the models once per worker thread.
+        featurizer_model - path to the compiled featurizer model (compiled_folder/model_name)
+        classifier_model - path to the compiled classifier model (compiled_folder/model_name)
+        categories - path to the categories file
+        threshold - only report predictions with a probability greater than this
+        sample_rate - the sample rate of the incoming audio, which must match the featurizer
+        num_workers - number of worker threads (default 1), the model calls are serialized however many there are,
+            see SharedModels
+        auto_scale - whether to scale the 16 bit audio to the range [-1, 1]
+        queue_size - number of pending audio chunks per worker before reading from the clients is blocked
+        smoothing - the seconds of audio to average the classifier output over, separately for each stream
+        """
+        self.sample_rate = sample_rate
+        self.auto_scale = auto_scale
+        shared = SharedModels()
+        self.workers = [StreamWorker(featurizer_model, classifier_model, categories, threshold, smoothing, sample_rate,
+                                     queue_size, shared)
+                        for i in range(num_workers or 1)]
+        self.workers[0].measure_history()
+        for worker in self.workers[1:]:
+            worker.featurizer_history = self.workers[0].featurizer_history
+            worker.classifier_history = self.workers[0].classifier_history
+        self.frame_size = self.workers[0].transform.input_size
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.server = None
+        self.server_thread = None
+        for worker in self.workers:
+            worker.start()
+
+    def open_stream(self, output):
+        """ Create a new AudioStream that writes its detections to the given output, and return the stream
+        and the worker it is assigned to """
+        with self.lock:
+            worker = min(self.workers, key=lambda w: w.stream_count)
+            worker.stream_count += 1
+            self.next_id += 1
+            stream_id = self.next_id
+        stream = AudioStream(stream_id, self.frame_size, self.sample_rate, self.auto_scale, worker.create_state(),
+                             worker.create_smoother(), output, *worker.create_history())
+        return stream, worker
+
+    def close_stream(self, stream, worker):
+        """ Process the end of the given stream and wait until all its detections have been sent """
+        worker.jobs.put((stream, stream.flush(), True))
+        stream.done.wait()
+        with self.lock:
+            worker.stream_count -= 1
+
+    def start(self, address):
+        """ Start serving on the given address (see parse_address) in a background thread and return the
+        address actually bound, which is useful when asking for port 0 """
+        address = parse_address(address) if isinstance(address, str) else address
+        if isinstance(address, tuple):
+            self.server = _TCPServer(address, _StreamHandler)
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = _UnixServer(address, _StreamHandler)
+        self.server.spotter = self
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        return self.server.server_address
+
+    def serve_forever(self, address):
+        """ Serve on the given address until interrupted """
+        bound = self.start(address)
+        print("Listening on {} with {} workers, press CTRL+C to stop...".format(bound, len(self.workers)))
+        try:
+            while self.server_thread.is_alive():
+                self.server_thread.join(1)
+        except KeyboardInterrupt:
+            pass
+        self.shutdown()
+
+    def shutdown(self):
+        """ Stop the server and the worker threads """
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.server.server_address, str) and os.path.exists(self.server.server_address):
+                os.remove(self.server.server_address)
+            self.server = None
+        for worker in self.workers:
+            worker.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def send_audio(address, samples, sample_rate=SAMPLE_RATE, chunk_samples=512, realtime=False):
+    """
+    A simple client that streams the given float audio samples in the range [-1, 1] to the server as 16 bit
+    PCM and returns the list of detection events the server sent back.  If realtime is True the audio is sent
+    at the speed it would be recorded, otherwise as fast as the server reads it.
+    """
+    address = parse_address(address) if isinstance(address, str) else address
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    pcm = (np.clip(np.asarray(samples), -1, 1 - 1 / 32768) * 32768).astype("<i2").tobytes()
+    events = []
+    with socket.socket(family, socket.SOCK_STREAM) as s:
+        s.connect(address)
+        reader = threading.Thread(target=lambda: events.extend(
+            json.loads(line) for line in s.makefile("rb") if line.strip()))
+        reader.start()
+        step = 2 * chunk_samples
+        for i in range(0, len(pcm), step):
+            s.sendall(pcm[i:i + step])
+            if realtime:
+                time.sleep(chunk_samples / sample_rate)
+        s.shutdown(socket.SHUT_WR)
+        reader.join()
+    return events
+
+
+def send_wav(address, wav_file, sample_rate=SAMPLE_RATE, chunk_samples=512, realtime=False):
+    """ Stream the given wav file to the server using send_audio, converting it to the given sample rate """
+    reader = wav_reader.WavReader(sample_rate, CHANNELS, True)
+    reader.open(wav_file, chunk_samples)
+    samples = reader.read_all()
+    reader.close()
+    return send_audio(address, samples, sample_rate, chunk_samples, realtime)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Serve keyword spotting over many concurrent PCM audio streams, or run a "
+                                     "test client that streams wav files to the server")
+    parser.add_argument("address", help="Address to listen on or connect to: unix:path, host:port, or port")
+    parser.add_argument("--featurizer", "-f", help="specify path to compiled featurizer model "
+                        "(compiled_folder/model_name)")
+    parser.add_argument("--classifier", "-c", help="specify path to compiled classifier model "
+                        "(compiled_folder/model_name)")
+    parser.add_argument("--categories", "-cat", help="specify path to categories file")
+    parser.add_argument("--sample_rate", "-s", default=SAMPLE_RATE, type=int,
+                        help="Audio sample rate expected by classifier")
+    parser.add_argument("--threshold", "-t", help="Classifier threshold (default 0.6)", default=THRESHOLD, type=float)
+    parser.add_argument("--smoothing", type=float, default=SMOOTHING,
+                        help="Seconds of audio to smooth the classifier output over (default 0)")
+    parser.add_argument("--workers", "-j", type=int, default=1,
+                        help="Number of worker threads (default 1).  The workers share the models, so the model "
+                        "calls are serialized")
+    parser.add_argument("--auto_scale", help="Whether to auto-scale audio input to range [-1, 1] (default false).",
+                        action='store_true')
+    parser.add_argument("--wav_files", nargs="+", default=None,
+                        help="Run as a client, streaming each of these wav files to the server on its own "
+                        "connection at the same time")
+    parser.add_argument("--realtime", help="Client sends audio at the recording speed", action="store_true")
+
+    args = parser.parse_args()
+    if args.wav_files:
+        threads = []
+        for wav_file in args.wav_files:
+            def run(wav_file=wav_file):
+                for event in send_wav(args.address, wav_file, args.sample_rate, realtime=args.realtime):
+                    print("{}: {}".format(wav_file, event))
+            threads += [threading.Thread(target=run)]
+            threads[-1].start()
+        for t in threads:
+            t.join()
+    else:
+        if not args.featurizer or not args.classifier or not args.categories:
+            parser.error("--featurizer, --classifier and --categories are required when running the server")
+        server = KeywordSpotterServer(args.featurizer, args.classifier, args.categories, args.threshold,
+                                      args.sample_rate, args.workers, args.auto_scale, smoothing=args.smoothing)
+        server.serve_forever(args.address)
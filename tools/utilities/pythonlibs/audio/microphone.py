@@ -11,7 +11,7 @@
 import audioop
 import math
 import sys
-from threading import Thread, Lock, Condition
+from threading import Event, Thread
 
 import numpy as np
 import pyaudio
@@ -26,17 +26,69 @@ def list_devices():
             print("  {}. {}".format(i, info["name"]))
 
 
+class RingBuffer:
+    """
+    A preallocated ring buffer of int16 samples for one producer thread (the audio callback) and one consumer
+    thread (the reader).  The producer only advances write_index and the consumer only advances read_index,
+    both are ever increasing sample counts, so neither side needs a lock and no memory is allocated after
+    construction.  If the consumer falls behind and the buffer fills up the new samples are dropped and counted
+    in overruns.
+    """
+    def __init__(self, capacity):
+        size = 1
+        while size < capacity:
+            size *= 2  # power of 2 so indexes wrap with a mask
+        self.buffer = np.zeros(size, dtype=np.int16)
+        self.mask = size - 1
+        self.write_index = 0
+        self.read_index = 0
+        self.overruns = 0  # number of samples dropped because the buffer was full
+        self.underruns = 0  # number of reads that had to wait for more samples
+
+    def __len__(self):
+        """ Return the number of samples available to read """
+        return self.write_index - self.read_index
+
+    def write(self, samples):
+        """ Copy the given samples into the buffer, returning the number written """
+        size = len(self.buffer)
+        count = len(samples)
+        free = size - (self.write_index - self.read_index)
+        if count > free:
+            self.overruns += count - free
+            count = free
+        start = self.write_index & self.mask
+        first = min(count, size - start)
+        self.buffer[start:start + first] = samples[:first]
+        self.buffer[:count - first] = samples[first:count]
+        self.write_index += count  # publish the samples only after they are copied
+        return count
+
+    def read_into(self, out, count=None):
+        """ Copy up to count (default len(out)) samples into the given array, converting them to its dtype,
+        and return the number of samples copied """
+        size = len(self.buffer)
+        count = min(len(out) if count is None else count, self.write_index - self.read_index)
+        start = self.read_index & self.mask
+        first = min(count, size - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:count] = self.buffer[:count - first]
+        self.read_index += count  # free the space only after the samples are copied out
+        return count
+
+
 class Microphone:
     """ This class wraps the pyaudio library and it's input stream callback providing a simple to
-    use Microphone class that you can simply read from """
+    use Microphone class that you can simply read from.  The callback copies the audio into a
+    preallocated RingBuffer and read_into converts it to floating point in the caller's buffer, so a reader
+    that reuses its buffer allocates nothing per chunk.  read returns a new array for each chunk """
     def __init__(self, auto_scale=True, console=True):
         """ Create Microphone object.
         console - specifies whether you are running from console app, if so this will listen for
         stdin "x" so user can tell you app to close the microphone """
         self.audio = pyaudio.PyAudio()
-        self.read_buffer = []
-        self.lock = Lock()
-        self.cv = Condition(self.lock)
+        self.ring = None
+        self.data_ready = Event()
         self.closed = False
         self.num_channels = 1
         self.console = console
@@ -44,9 +96,8 @@ class Microphone:
         self.input_stream = None
         self.auto_scale = auto_scale
         self.audio_scale_factor = 1
-        self.tail = None
 
-    def open(self, sample_size, sample_rate, num_channels, input_device=None):
+    def open(self, sample_size, sample_rate, num_channels, input_device=None, ring_size=None):
         """ Open the microphone so it returns chunks of audio samples of the given sample_size
         where audio is converted to the expected sample_rate and num_channels
         and then scaled to floating point numbers between -1 and 1.
@@ -56,6 +107,7 @@ class Microphone:
         sample_rate - the expected sample rate (e.g. 16000)
         num_channels - the number of audio channels to return
         input_device - input device index if you don't want to use the default
+        ring_size - number of samples the ring buffer can hold before new audio is dropped (default 2 seconds)
         """
         self.sample_rate = sample_rate
         self.sample_size = sample_size
@@ -68,6 +120,11 @@ class Microphone:
             info = self.audio.get_default_input_device_info()
         self.mic_rate = int(info['defaultSampleRate'])
         buffer_size = int(math.ceil(sample_size * self.mic_rate / sample_rate))
+        self.ring = RingBuffer(max(ring_size or 2 * sample_rate * num_channels, 4 * (sample_size + buffer_size)))
+        self.data_ready.clear()
+        if self.auto_scale:
+            self.audio_scale_factor = 1 / 32768  # since we are using pyaudio.paInt16.
+        self.closed = False
         self.input_stream = self.audio.open(format=pyaudio.paInt16,
                                             channels=num_channels,
                                             rate=self.mic_rate,
@@ -75,9 +132,6 @@ class Microphone:
                                             frames_per_buffer=buffer_size,
                                             stream_callback=self._on_recording_callback,
                                             input_device_index=input_device)
-        if self.auto_scale:
-            self.audio_scale_factor = 1 / 32768  # since we are using pyaudio.paInt16.
-        self.closed = False
         if self.console:
             # since our read call blocks the UI we use a separate thread to monitor user input
             self.stdin_thread = Thread(target=self.monitor_input, args=(sys.stdin,))
@@ -92,68 +146,51 @@ class Microphone:
         else:
             result = data
 
-        # protect access to the shared state
-        self.cv.acquire()
-        try:
-            self.read_buffer += [result]
-            if len(self.read_buffer) == 1:
-                self.cv.notify()
-        except:
-            pass
-        self.cv.release()
+        self.ring.write(np.frombuffer(result, dtype=np.int16))
+        self.data_ready.set()
         return (data, pyaudio.paContinue)
 
+    @property
+    def overruns(self):
+        """ The number of samples dropped because the reader fell too far behind """
+        return self.ring.overruns if self.ring else 0
+
+    @property
+    def underruns(self):
+        """ The number of reads that had to wait for the microphone """
+        return self.ring.underruns if self.ring else 0
+
+    def read_into(self, out):
+        """ Fill the given float array with the next len(out) audio samples, blocking until they are available.
+        Returns the number of samples read, which is less than len(out) only at the end of the stream, in which
+        case the rest of out is padded with zeros, and 0 once the microphone is closed and all audio is read """
+        count = len(out)
+        if len(self.ring) < count:
+            self.ring.underruns += 1
+            while len(self.ring) < count and not self.closed:
+                self.data_ready.clear()
+                if len(self.ring) < count:
+                    self.data_ready.wait(0.1)
+
+        available = self.ring.read_into(out, count)
+        if available < count:
+            out[available:] = 0
+        if self.audio_scale_factor != 1:
+            out *= self.audio_scale_factor
+        return available
+
     def read(self):
-        """ Read the next audio chunk. This method blocks until the audio is available """
-        while not self.closed:
-            result = None
-
-            # deal with any accumulation of tails, if the tail grows to a full
-            # buffer then return it!
-            if self.tail is not None and len(self.tail) >= self.sample_size:
-                data = self.tail[0:self.sample_size]
-                self.tail = self.tail[self.sample_size:]
-                return data
-
-            # block until microphone data is ready...
-            self.cv.acquire()
-            try:
-                while len(self.read_buffer) == 0:
-                    if self.closed:
-                        return None
-                    self.cv.wait(0.1)
-                result = self.read_buffer.pop(0)
-            except:
-                pass
-            self.cv.release()
-
-            if result is not None:
-                # convert int16 data to scaled floats
-                data = np.frombuffer(result, dtype=np.int16)
-                data = data.astype(float)
-
-                if self.tail is not None:
-                    # we have a tail from previous frame, so prepend it
-                    data = np.concatenate((self.tail, data))
-
-                # now the caller needs us to stick to our sample_size contract, but when
-                # rate conversion happens we can't be sure that 'data' is exactly that size.
-                if len(data) > self.sample_size:
-                    # usually one byte extra so add this to our accumulating tail
-                    self.tail = data[self.sample_size:]
-                    data = data[0:self.sample_size]
-
-                if len(data) < self.sample_size:
-                    # might have reached the end of the stream.
-                    zeros = np.zeros(self.sample_size - len(data))
-                    data = np.concatenate((data, zeros))
-
-                return data * self.audio_scale_factor
-        return None
+        """ Read the next audio chunk of sample_size samples as a new float32 array. This method blocks until the
+        audio is available.  Use read_into with a reusable buffer to avoid the allocation """
+        output = np.empty(self.sample_size, dtype=np.float32)
+        if self.read_into(output) == 0:
+            return None
+        return output
 
     def close(self):
         """ Close the microphone """
         self.closed = True
+        self.data_ready.set()
         if self.input_stream:
             self.input_stream.close()
 
@@ -10,6 +10,7 @@
 ###################################################################################################
 import argparse
 import os
+import sys
 
 # helper classes
 import featurizer
@@ -58,6 +59,7 @@ def test_keyword_spotter(featurizer_model, classifier_model, categories, wav_fil
 
     predictor = classifier.AudioClassifier(classifier_model, categories, threshold, SMOOTHING)
     transform = featurizer.AudioTransform(featurizer_model, predictor.input_size)
+    predictor.set_frame_duration(transform.input_size / sample_rate)
 
     if transform.using_map != predictor.using_map:
         raise Exception("cannot mix .ell and compiled models")
@@ -106,9 +108,20 @@ if __name__ == "__main__":
                         action='store_true')
     parser.add_argument("--reset", help="Whether to reset model between tests (default false).",
                         action='store_true')
+    parser.add_argument("--serve", help="Serve keyword spotting over many PCM audio streams on this address "
+                        "(unix:path, host:port or port) instead, see kws_server.py", default=None)
+    parser.add_argument("--workers", "-j", type=int, default=1,
+                        help="Number of worker threads for --serve (default 1)")
 
     args = parser.parse_args()
 
+    if args.serve:
+        import kws_server
+        server = kws_server.KeywordSpotterServer(args.featurizer, args.classifier, args.categories, args.threshold,
+                                                 args.sample_rate, args.workers, args.auto_scale)
+        server.serve_forever(args.serve)
+        sys.exit(0)
+
     results = test_keyword_spotter(args.featurizer, args.classifier, args.categories, args.wav_files, args.threshold,
                                    args.sample_rate, args.speaker, args.auto_scale, args.reset)
 
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     sliding_window.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+"""
+Sliding window helpers that turn a stream of audio or feature frames into overlapping windows of
+window_size rows, shifted by shift_amount rows, without allocating a new array for every frame.
+"""
+import argparse
+import time
+
+import numpy as np
+
+
+class SlidingWindow:
+    """
+    The SlidingWindow class buffers incoming samples in a fixed capacity buffer and returns each window as
+    a view into that buffer.  The buffer is only compacted (moving the live rows back to the front) when the
+    write position reaches the end, so the cost of that copy is amortized over many frames.  Note that the
+    returned windows are only valid until the next call to append, so copy them if you need to keep them.
+    """
+    def __init__(self, window_size, shift_amount, capacity=None):
+        """
+        Create a new SlidingWindow.
+        window_size - the number of rows in each window
+        shift_amount - the number of rows the window moves by each time
+        capacity - the number of rows to buffer (default 4 * window_size), the larger this is the less
+        often the buffer needs to be compacted.
+        """
+        self.window_size = int(window_size)
+        self.shift_amount = int(shift_amount)
+        if self.window_size <= 0 or self.shift_amount <= 0:
+            raise Exception("window_size and shift_amount must be positive")
+        self.capacity = max(int(capacity or 4 * self.window_size), self.window_size)
+        self.buffer = None
+        self.reset()
+
+    def reset(self):
+        """ Drop any buffered samples """
+        self.start = 0
+        self.end = 0
+        self.count = 0
+        self.compactions = 0
+
+    def __len__(self):
+        """ Return the number of rows currently buffered """
+        return self.end - self.start
+
+    def _allocate(self, samples, rows):
+        self.buffer = np.zeros((rows,) + samples.shape[1:], dtype=samples.dtype)
+
+    def append(self, samples):
+        """ Add new samples (a scalar, a vector of samples or a 2D array of rows) to the window """
+        samples = np.asarray(samples)
+        if samples.ndim == 0:
+            samples = samples.reshape(1)
+        size = len(samples)
+        if self.buffer is None:
+            self._allocate(samples, max(self.capacity, self.window_size + size))
+        elif self.buffer.shape[1:] != samples.shape[1:]:
+            raise Exception("Expecting samples of shape {}, but got {}".format(
+                self.buffer.shape[1:], samples.shape[1:]))
+
+        if self.end + size > len(self.buffer):
+            live = self.end - self.start
+            if live + size > len(self.buffer):
+                # the caller is appending more than we can hold, so grow the buffer.
+                old = self.buffer
+                self._allocate(samples, 2 * (live + size))
+                self.buffer[:live] = old[self.start:self.end]
+            else:
+                self.buffer[:live] = self.buffer[self.start:self.end]
+            self.start = 0
+            self.end = live
+            self.compactions += 1
+
+        self.buffer[self.end:self.end + size] = samples
+        self.end += size
+
+    def windows(self):
+        """ Return a generator over the full windows that are now available, as views into the buffer """
+        while self.end - self.start >= self.window_size:
+            self.count += 1
+            yield self.buffer[self.start:self.start + self.window_size]
+            self.start = min(self.start + self.shift_amount, self.end)
+
+    def remainder(self):
+        """
+        Return the final partial window padded with zeros, or None.  A partial window is only returned if it
+        is more than 1/4 full, or if no full window was ever returned, so we at least return 1 full frame.
+        """
+        if self.buffer is None:
+            return None
+        live = self.end - self.start
+        if live < self.window_size and (live > self.window_size / 4 or self.count == 0):
+            if self.start + self.window_size > len(self.buffer):
+                self.buffer[:live] = self.buffer[self.start:self.end]
+                self.start = 0
+                self.end = live
+            self.buffer[self.end:self.start + self.window_size] = 0
+            self.end = self.start + self.window_size
+            self.count += 1
+            return self.buffer[self.start:self.end]
+        return None
+
+    def process(self, source):
+        """ Return a generator of windows over the given source, which is a container or generator of samples """
+        self.reset()
+        self.buffer = None
+        for new_samples in source:
+            self.append(new_samples)
+            yield from self.windows()
+
+        last = self.remainder()
+        if last is not None:
+            yield last
+
+
+def sliding_windows(frames, window_size, shift_amount):
+    """
+    Batch version of SlidingWindow.process which returns all the windows over the given 1D or 2D array of
+    frames as one strided array of shape (num_windows, window_size, ...).  No copy of the frames is made unless
+    a zero padded final window is needed, in which case the frames are copied once into a padded array.
+    The result is read only and matches SlidingWindow.process given the frames one row at a time, which means
+    a shift_amount larger than window_size behaves like a shift of window_size.
+    """
+    shift_amount = min(shift_amount, window_size)
+    frames = np.asarray(frames)
+    if frames.ndim == 0:
+        frames = frames.reshape(1)
+    length = len(frames)
+    full = 0 if length < window_size else 1 + (length - window_size) // shift_amount
+    leftover = length - min(full * shift_amount, length)
+    if leftover < window_size and (leftover > window_size / 4 or full == 0):
+        padded = np.zeros((full * shift_amount + window_size,) + frames.shape[1:], dtype=frames.dtype)
+        padded[:length] = frames
+        frames = padded
+        full += 1
+    row_stride = frames.strides[0]
+    return np.lib.stride_tricks.as_strided(frames, shape=(full, window_size) + frames.shape[1:],
+                                           strides=(shift_amount * row_stride,) + frames.strides,
+                                           writeable=False)
+
+
+def _concatenating_window_frame(source, window_size, shift_amount):
+    """ The old concatenating implementation of sliding_window_frame, kept for benchmarking """
+    buffer = None
+    count = 0
+    for new_samples in source:
+        if buffer is None:
+            buffer = new_samples
+        else:
+            buffer = np.concatenate((buffer, new_samples))
+        while len(buffer) >= window_size:
+            count += 1
+            yield buffer[:window_size]
+            buffer = buffer[shift_amount:]
+
+
+def _count_buffers(windows):
+    """ Count the distinct memory buffers the given windows were carved from """
+    roots = []
+    seen = set()
+    total = 0
+    for w in windows:
+        root = w
+        while isinstance(root.base, np.ndarray):
+            root = root.base
+        if id(root) not in seen:
+            seen.add(id(root))
+            roots += [root]  # keep it alive so the id is not reused
+        total += 1
+    return total, len(seen)
+
+
+def benchmark(num_frames, frame_size, window_size, shift_amount):
+    """ Compare the allocations and time of the concatenating window against the SlidingWindow """
+    frames = np.random.rand(num_frames, frame_size).astype(np.float32)
+    source = [frames[i:i + 1] for i in range(num_frames)]
+    for name, func in [("concatenate", lambda: _concatenating_window_frame(source, window_size, shift_amount)),
+                       ("SlidingWindow", lambda: SlidingWindow(window_size, shift_amount).process(source)),
+                       ("sliding_windows", lambda: sliding_windows(frames, window_size, shift_amount))]:
+        start = time.time()
+        total, buffers = _count_buffers(func())
+        elapsed = time.time() - start
+        print("{:>16}: {} windows from {} allocated buffers in {:.3f} seconds".format(name, total, buffers, elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Benchmark the sliding window implementations")
+    parser.add_argument("--frames", type=int, default=10000, help="Number of frames to window (default 10000)")
+    parser.add_argument("--frame_size", type=int, default=40, help="Size of each frame (default 40)")
+    parser.add_argument("--window_size", "-ws", type=int, default=80, help="Window size (default 80)")
+    parser.add_argument("--shift", "-s", type=int, default=10, help="Window shift amount (default 10)")
+    args = parser.parse_args()
+    benchmark(args.frames, args.frame_size, args.window_size, args.shift)
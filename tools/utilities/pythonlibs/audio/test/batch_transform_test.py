@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     batch_transform_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import classifier  # noqa: E402
+import compute_ell_model  # noqa: E402
+import featurizer  # noqa: E402
+
+# Python stand-ins for compiled modules with the same wrapper interface.  The featurizer keeps a sliding
+# window in a module global like a real compiled featurizer, and the classifier exposes its hidden state.
+FEATURIZER_MODULE = '''
+import numpy as np
+
+_buffer = np.zeros(18, dtype=np.float32)
+_weights = np.cos(np.arange(72, dtype=np.float32)).reshape(4, 18)
+
+
+class FloatVector(np.ndarray):
+    def __new__(cls, size_or_values):
+        if np.isscalar(size_or_values):
+            return np.zeros(size_or_values, dtype=np.float32).view(cls)
+        return np.array(size_or_values, dtype=np.float32).view(cls)
+
+    def copy_from(self, x):
+        self[:] = x
+
+
+def copy_to_buffer_float(vector, output):
+    output[:] = vector
+
+
+class Shape:
+    def __init__(self, size):
+        self.rows, self.columns, self.channels = 1, 1, size
+
+    def Size(self):
+        return self.channels
+
+
+class BatchfeaturizerWrapper:
+    def GetInputSize(self, index):
+        return 6 if index == 0 else 0
+
+    def GetInputShape(self, index):
+        return Shape(6)
+
+    def GetOutputSize(self, index):
+        return 4
+
+    def GetOutputShape(self, index):
+        return Shape(4)
+
+    def Predict(self, input):
+        global _buffer
+        _buffer = np.concatenate((_buffer[6:], input))
+        return FloatVector(_weights.dot(_buffer))
+
+    def Reset(self):
+        _buffer[:] = 0
+'''
+
+CLASSIFIER_MODULE = '''
+import numpy as np
+
+from batchfeaturizer import FloatVector, copy_to_buffer_float, Shape
+
+_weights = np.sin(np.arange(16, dtype=np.float32)).reshape(4, 4)
+
+
+class BatchclassifierWrapper:
+    def GetInputSize(self, index):
+        return 4
+
+    def GetInputShape(self, index):
+        return Shape(4)
+
+    def GetOutputSize(self, index):
+        return 4
+
+    def GetOutputShape(self, index):
+        return Shape(4)
+
+    def Predict(self, input, hidden, output, new):
+        new[:] = np.tanh(0.5 * hidden + _weights.dot(input) / 4)
+        e = np.exp(3 * new - 3 * new.max())
+        output[:] = e / e.sum()
+
+    def Reset(self):
+        pass
+'''
+
+
+class FakeMap:
+    """ Stands in for ell.model.Map, with state that depends on every frame computed so far """
+    def __init__(self, model_path):
+        self.weights = np.cos(np.arange(18, dtype=np.float32)).reshape(3, 6)
+        self.total = np.float32(0)
+
+    def GetInputShape(self):
+        return types.SimpleNamespace(rows=1, columns=1, channels=6, Size=lambda: 6)
+
+    def GetOutputShape(self):
+        return types.SimpleNamespace(rows=1, columns=1, channels=3, Size=lambda: 3)
+
+    def Compute(self, x, dtype):
+        self.total += np.sum(x, dtype=np.float32)
+        return self.weights.dot(x).astype(dtype) + self.total
+
+    def Reset(self):
+        self.total = np.float32(0)
+
+
+class FrameSource:
+    """ An audio source that returns the rows of the given frames """
+    def __init__(self, frames):
+        self.frames = frames
+        self.pos = 0
+
+    def read(self):
+        if self.pos == len(self.frames):
+            return None
+        self.pos += 1
+        return self.frames[self.pos - 1]
+
+    def close(self):
+        pass
+
+
+class BatchTransformTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp(prefix="batch_transform_test")
+        with open(os.path.join(cls.temp_dir, "batchfeaturizer.py"), "w") as f:
+            f.write(FEATURIZER_MODULE)
+        with open(os.path.join(cls.temp_dir, "batchclassifier.py"), "w") as f:
+            f.write(CLASSIFIER_MODULE)
+        cls.categories = os.path.join(cls.temp_dir, "categories.txt")
+        with open(cls.categories, "w") as f:
+            f.write("_background\none\ntwo\nthree\n")
+        cls.featurizer = os.path.join(cls.temp_dir, "batchfeaturizer")
+        cls.classifier = os.path.join(cls.temp_dir, "batchclassifier")
+        rng = np.random.RandomState(0)
+        cls.frames = rng.uniform(-1, 1, (50, 6)).astype(np.float32)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def read_all(self, transform, frames):
+        """ Featurize the frames one at a time through AudioTransform.read """
+        transform.open(FrameSource(frames))
+        result = []
+        while True:
+            features = transform.read()
+            if features is None:
+                break
+            result += [features]
+        return np.array(result)
+
+    def assert_same_results(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertEqual((e[0], e[2]), (a[0], a[2]))
+            if e[1] is not None:
+                self.assertAlmostEqual(e[1], a[1], places=5)
+
+    def test_compiled_featurizer(self):
+        transform = featurizer.AudioTransform(self.featurizer, 0)
+        transform.model.reset()
+        expected = self.read_all(transform, self.frames)
+        self.assertEqual(transform.frame_count, 50)
+
+        transform.model.reset()
+        transform.reset()
+        output = np.zeros((50, 4), dtype=np.float32)
+        # carrying the featurizer window from one batch to the next
+        self.assertIs(transform.transform_batch(self.frames[:20], output[:20]).base, output)
+        transform.transform_batch(self.frames[20:], output[20:])
+        np.testing.assert_allclose(output, expected, rtol=1e-5)
+        self.assertEqual(transform.frame_count, 50)
+        self.assertEqual(transform.transform_batch(self.frames[:0]).shape, (0, 4))
+
+    def test_compute_featurizer(self):
+        with mock.patch.object(compute_ell_model, "ell", types.SimpleNamespace(
+                model=types.SimpleNamespace(Map=FakeMap))):
+            transform = featurizer.AudioTransform(os.path.join(self.temp_dir, "featurizer.ell"), 0)
+        self.assertTrue(transform.using_map)
+        expected = self.read_all(transform, self.frames)
+        transform.model.reset()
+        actual = np.concatenate([transform.transform_batch(self.frames[:7]),
+                                 transform.transform_batch(self.frames[7:])])
+        self.assertEqual(actual.dtype, np.float32)
+        np.testing.assert_allclose(actual, expected, rtol=1e-5)
+
+    def test_classifier(self):
+        features = featurizer.AudioTransform(self.featurizer, 0).transform_batch(self.frames) / 4
+        for smoothing_delay in [0, 0.05]:
+            predictor = classifier.AudioClassifier(self.classifier, self.categories, 0.3, smoothing_delay, 0.01)
+            expected = [predictor.predict(row) for row in features]
+            self.assertIn((None, None, None), expected)
+            self.assertTrue(any(e[0] is not None for e in expected))
+
+            predictor.reset()
+            actual = predictor.predict_batch(features[:13]) + predictor.predict_batch(features[13:])
+            self.assert_same_results(expected, actual)
+
+            # one ModelState and smoother per stream gives the same results
+            actual = predictor.predict_batch(features, predictor.model.create_state(), predictor.create_smoother())
+            self.assert_same_results(expected, actual)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     classifier_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import classifier  # noqa: E402
+
+
+class WallClockSmoother:
+    """ The original AudioClassifier._smooth, which kept a list of (time, prediction) tuples, with the time passed
+    in rather than read from the clock """
+    def __init__(self, delay):
+        self.delay = delay
+        self.items = []
+        self.start_time = None
+
+    def smooth(self, predictions, now):
+        if self.start_time is None or now > self.start_time + 1:
+            self.start_time = now
+            self.items = []
+        new_items = [x for x in self.items if x[0] + self.delay >= now]
+        new_items += [(now, predictions)]
+        self.items = new_items
+        total = np.sum([p[1] for p in new_items], axis=0)
+        return total / len(new_items)
+
+
+def frame_window_average(outputs, window_size):
+    """ Average each row with up to window_size - 1 rows before it, one row at a time """
+    return np.array([np.mean(outputs[max(0, i - window_size + 1):i + 1], axis=0) for i in range(len(outputs))])
+
+
+class PredictionSmootherTest(unittest.TestCase):
+
+    def make_outputs(self, count, classes=4, seed=0):
+        rng = np.random.RandomState(seed)
+        outputs = rng.rand(count, classes)
+        return outputs / outputs.sum(axis=1, keepdims=True)
+
+    def test_frame_mode(self):
+        outputs = self.make_outputs(500)
+        for window_size in [1, 3, 16, 600]:
+            smoother = classifier.PredictionSmoother(window_size)
+            actual = np.array([smoother.smooth(output) for output in outputs])
+            np.testing.assert_allclose(actual, frame_window_average(outputs, window_size), rtol=1e-10)
+
+    def test_smooth_batch_matches_smooth(self):
+        outputs = self.make_outputs(300, seed=1)
+        for window_size in [1, 5, 32]:
+            smoother = classifier.PredictionSmoother(window_size)
+            expected = np.array([smoother.smooth(output) for output in outputs])
+            smoother = classifier.PredictionSmoother(window_size)
+            # continuing from one batch to the next, and mixing single frames with batches
+            actual = [smoother.smooth_batch(outputs[:7]), smoother.smooth_batch(outputs[7:8]),
+                      [smoother.smooth(outputs[8])], smoother.smooth_batch(outputs[9:9]),
+                      smoother.smooth_batch(outputs[9:])]
+            np.testing.assert_allclose(np.concatenate(actual), expected, rtol=1e-10)
+            np.testing.assert_allclose(classifier.smooth_sequence(outputs, window_size), expected, rtol=1e-10)
+
+    def test_wall_clock_mode_matches_original(self):
+        outputs = self.make_outputs(400, seed=2)
+        rng = np.random.RandomState(3)
+        # frames about 10ms apart with two gaps longer than a second
+        times = np.cumsum(rng.uniform(0.005, 0.015, len(outputs)))
+        times[150:] += 1.5
+        times[300:] += 2
+        for delay in [0.05, 0.2]:
+            original = WallClockSmoother(delay)
+            expected = np.array([original.smooth(output, now) for output, now in zip(outputs, times)])
+            smoother = classifier.PredictionSmoother(4, delay)
+            actual = np.array([smoother.smooth(output, now) for output, now in zip(outputs, times)])
+            np.testing.assert_allclose(actual, expected, rtol=1e-10)
+
+    def test_wall_clock_mode_starts_over_every_second(self):
+        # steady frames with no gaps still start a new window once a second has passed since the window started
+        outputs = self.make_outputs(25, seed=5)
+        times = np.arange(len(outputs)) * 0.1
+        smoother = classifier.PredictionSmoother(4, 5)
+        actual = np.array([smoother.smooth(output, now) for output, now in zip(outputs, times)])
+        np.testing.assert_allclose(actual[10], outputs[:11].mean(axis=0), rtol=1e-10)
+        np.testing.assert_allclose(actual[11], outputs[11], rtol=1e-10)
+        np.testing.assert_allclose(actual[22], outputs[22], rtol=1e-10)
+        np.testing.assert_allclose(actual[24], outputs[22:25].mean(axis=0), rtol=1e-10)
+
+    def test_frame_mode_matches_wall_clock_with_steady_frames(self):
+        # with frames exactly frame_duration apart both modes average the same window within the first second,
+        # which is what AudioClassifier.set_frame_duration relies on
+        outputs = self.make_outputs(100, seed=4)
+        frame_duration = 0.01
+        delay = 0.095
+        original = WallClockSmoother(delay)
+        expected = np.array([original.smooth(output, i * frame_duration) for i, output in enumerate(outputs)])
+        smoother = classifier.PredictionSmoother(round(delay / frame_duration))
+        np.testing.assert_allclose(smoother.smooth_batch(outputs), expected, rtol=1e-10)
+
+
+if __name__ == "__main__":
+    unittest.main()
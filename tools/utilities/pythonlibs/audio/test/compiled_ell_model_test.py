@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     compiled_ell_model_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import compiled_ell_model  # noqa: E402
+
+# A Python stand-in for a compiled model that exposes its hidden state, with the same wrapper interface.
+# Reset counts the calls, since it would reset state shared by every stream.
+MODEL_MODULE = '''
+import numpy as np
+
+_weights = np.sin(np.arange(15, dtype=np.float32)).reshape(3, 5)
+reset_count = 0
+
+
+class FloatVector(np.ndarray):
+    def __new__(cls, size_or_values):
+        if np.isscalar(size_or_values):
+            return np.zeros(size_or_values, dtype=np.float32).view(cls)
+        return np.array(size_or_values, dtype=np.float32).view(cls)
+
+    def copy_from(self, x):
+        self[:] = x
+
+
+def copy_to_buffer_float(vector, output):
+    output[:] = vector
+
+
+class Shape:
+    def __init__(self, size):
+        self.rows, self.columns, self.channels = 1, 1, size
+
+    def Size(self):
+        return self.channels
+
+
+class StatefulmodelWrapper:
+    def GetInputSize(self, index):
+        return 5 if index == 0 else 3
+
+    def GetInputShape(self, index):
+        return Shape(5)
+
+    def GetOutputSize(self, index):
+        return 3
+
+    def GetOutputShape(self, index):
+        return Shape(3)
+
+    def Predict(self, input, hidden, output, new):
+        new[:] = np.tanh(0.5 * hidden + _weights.dot(input))
+        output[:] = 2 * new + 1
+
+    def Reset(self):
+        global reset_count
+        reset_count += 1
+'''
+
+
+class CompiledModelTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp(prefix="compiled_ell_model_test")
+        with open(os.path.join(cls.temp_dir, "statefulmodel.py"), "w") as f:
+            f.write(MODEL_MODULE)
+        cls.model = compiled_ell_model.CompiledModel(os.path.join(cls.temp_dir, "statefulmodel"))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def run_alone(self, frames):
+        """ Run the frames through a fresh state on their own, one at a time """
+        state = self.model.create_state()
+        return np.array([self.model.transform(frame, state) for frame in frames])
+
+    def test_interleaved_states_match_separate_streams(self):
+        rng = np.random.RandomState(0)
+        streams = [rng.rand(20, 5).astype(np.float32) for i in range(2)]
+        expected = [self.run_alone(frames) for frames in streams]
+
+        states = [self.model.create_state() for frames in streams]
+        self.assertIsNot(states[0].output, states[1].output)
+        outputs = [[], []]
+        for i in range(20):
+            for j in range(2):
+                outputs[j] += [self.model.transform(streams[j][i], states[j])]
+        for e, a in zip(expected, outputs):
+            np.testing.assert_allclose(a, e, rtol=1e-6)
+
+        # and the same with batches of frames from each stream in turn
+        states = [self.model.create_state() for frames in streams]
+        outputs = [[], []]
+        for i in range(0, 20, 7):
+            for j in range(2):
+                outputs[j] += [self.model.transform_batch(streams[j][i:i + 7], state=states[j])]
+        for e, a in zip(expected, outputs):
+            np.testing.assert_allclose(np.concatenate(a), e, rtol=1e-6)
+
+    def test_reset_only_resets_the_given_state(self):
+        rng = np.random.RandomState(1)
+        frames = rng.rand(10, 5).astype(np.float32)
+        expected = self.run_alone(frames)
+        first, second = self.model.create_state(), self.model.create_state()
+        reset_count = self.model.module.reset_count
+
+        self.model.transform_batch(frames[:5], state=first)
+        self.model.transform_batch(frames[:5], state=second)
+        self.model.reset(first)
+        np.testing.assert_array_equal(self.model.get_state(first), 0)
+        self.assertTrue(np.any(self.model.get_state(second) != 0))
+        # the shared model state is left alone
+        self.assertEqual(self.model.module.reset_count, reset_count)
+
+        # the reset state starts over, and the other one carries on where it was
+        np.testing.assert_allclose(self.model.transform_batch(frames[:5], state=first), expected[:5], rtol=1e-6)
+        np.testing.assert_allclose(self.model.transform_batch(frames[5:], state=second), expected[5:], rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
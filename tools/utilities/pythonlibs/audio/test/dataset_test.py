@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     dataset_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, "..", "training"))
+
+import dataset  # noqa: E402
+
+CATEGORIES = ["background", "one", "two", "three"]
+
+
+def make_rows(num_rows, row_size, seed=0):
+    """ Random rows with a few non-finite ones, like the start of a featurized file """
+    rng = np.random.RandomState(seed)
+    features = (rng.rand(num_rows, row_size) * 10 - 3).astype(np.float32)
+    features[::17, 2] = np.nan
+    features[5, 0] = np.inf
+    features[:, 3] = 1  # a constant column has zero std
+    label_names = np.array([CATEGORIES[i] for i in rng.randint(1, len(CATEGORIES), num_rows)])
+    return features, label_names
+
+
+class DatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="dataset_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assert_matches_original(self, ds, features, label_names):
+        """ Compare with the original constructor, which dropped non-finite rows and then took the mean and
+        std over all the remaining rows """
+        good_rows = np.isfinite(features).all(axis=1)
+        expected = features[good_rows]
+        std = np.std(expected, axis=0)
+        std[np.equal(std, 0)] = 1e-5
+        np.testing.assert_array_equal(ds.features, expected)
+        np.testing.assert_array_equal(ds.label_names, label_names[good_rows])
+        np.testing.assert_allclose(ds.mean, np.mean(expected, axis=0), rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(ds.std, std, rtol=1e-5, atol=1e-6)
+        self.assertEqual(ds.mean.dtype, features.dtype)
+        expected_labels = np.array([CATEGORIES.index(x) for x in label_names[good_rows]])
+        np.testing.assert_array_equal(ds.raw_labels, expected_labels)
+
+    def test_statistics_in_chunks(self):
+        features, _ = make_rows(1000, 8)
+        for chunk_size in [1, 7, 100, 65536]:
+            good_rows, mean, std = dataset.compute_statistics(features, chunk_size)
+            expected = features[np.isfinite(features).all(axis=1)]
+            np.testing.assert_array_equal(good_rows, np.isfinite(features).all(axis=1))
+            np.testing.assert_allclose(mean, np.mean(expected.astype(np.float64), axis=0), rtol=1e-10)
+            np.testing.assert_allclose(std, np.std(expected.astype(np.float64), axis=0), rtol=1e-8, atol=1e-12)
+        good_rows, _, _ = dataset.compute_statistics(np.ones((10, 3)))
+        self.assertIsNone(good_rows)
+
+    def test_constructor(self):
+        features, label_names = make_rows(500, 6)
+        ds = dataset.Dataset(features, label_names, CATEGORIES, [16000, 512])
+        self.assert_matches_original(ds, features, label_names)
+
+    def test_memmap_round_trip(self):
+        features, label_names = make_rows(1000, 6, seed=1)
+        ds = dataset.Dataset(features, label_names, CATEGORIES, [16000, 512])
+        filename = os.path.join(self.temp_dir, "data.json")
+        ds.save(filename)
+        loaded = dataset.Dataset.load(filename)
+        # the features stay memory mapped and the labels stay indices into the label table
+        self.assertIsInstance(loaded.features, np.memmap)
+        self.assertEqual(loaded.label_index.dtype, np.int32)
+        self.assert_matches_original(loaded, features, label_names)
+
+    def test_write_memmap_drops_bad_rows(self):
+        features, label_names = make_rows(300, 5, seed=2)
+        label_table, label_index = np.unique(label_names, return_inverse=True)
+        filename = os.path.join(self.temp_dir, "raw.json")
+        dataset.write_memmap(filename, features, label_index, label_table, CATEGORIES, [16000], chunk_size=32)
+        loaded = dataset.Dataset.load(filename)
+        self.assertIsInstance(loaded.features, np.memmap)
+        self.assert_matches_original(loaded, features, label_names)
+
+    def test_unsupported_version(self):
+        features, label_names = make_rows(200, 4, seed=3)
+        ds = dataset.Dataset(features, label_names, CATEGORIES, [16000])
+        filename = os.path.join(self.temp_dir, "new.json")
+        ds.save(filename)
+        with open(filename) as f:
+            header = json.load(f)
+        self.assertEqual(header["version"], 1)
+        header["version"] = 2
+        with open(filename, "w") as f:
+            json.dump(header, f)
+        with self.assertRaises(Exception):
+            dataset.Dataset.load(filename)
+
+    def test_npz_round_trip(self):
+        features, label_names = make_rows(200, 4, seed=4)
+        ds = dataset.Dataset(features, label_names, CATEGORIES, [16000])
+        filename = os.path.join(self.temp_dir, "data.npz")
+        ds.save(filename)
+        self.assert_matches_original(dataset.Dataset.load(filename), features, label_names)
+
+    def test_missing_category(self):
+        features, label_names = make_rows(50, 4, seed=5)
+        label_names[10] = "four"
+        with self.assertRaises(Exception):
+            dataset.Dataset(features, label_names, CATEGORIES, [16000])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     kws_server_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import classifier  # noqa: E402
+import featurizer  # noqa: E402
+import kws_server  # noqa: E402
+
+# Python stand-ins for compiled modules, with the same wrapper interface.  Like a real compiled featurizer,
+# the featurizer keeps its sliding window buffer in a module global that every wrapper shares.
+FEATURIZER_MODULE = '''
+import numpy as np
+
+FRAME_SIZE = 8
+WINDOW_SIZE = 3 * FRAME_SIZE
+_buffer = np.zeros(WINDOW_SIZE, dtype=np.float32)
+_weights = np.arange(WINDOW_SIZE, dtype=np.float32) / WINDOW_SIZE
+
+
+class FloatVector(np.ndarray):
+    def __new__(cls, size):
+        return np.zeros(size, dtype=np.float32).view(cls)
+
+    def copy_from(self, x):
+        self[:] = x
+
+
+def copy_to_buffer_float(vector, output):
+    output[:] = vector
+
+
+class Shape:
+    def __init__(self, size):
+        self.rows, self.columns, self.channels = 1, 1, size
+
+    def Size(self):
+        return self.channels
+
+
+class {name}Wrapper:
+    def GetInputSize(self, index):
+        return FRAME_SIZE if index == 0 else 0
+
+    def GetInputShape(self, index):
+        return Shape(FRAME_SIZE)
+
+    def GetOutputSize(self, index):
+        return 4
+
+    def GetOutputShape(self, index):
+        return Shape(4)
+
+    def Predict(self, input):
+        global _buffer
+        _buffer = np.concatenate((_buffer[FRAME_SIZE:], input))
+        result = FloatVector(4)
+        result[:] = [_buffer.sum(), (_buffer * _weights).sum(), _buffer[:FRAME_SIZE].max(), _buffer[-1]]
+        return result
+
+    def Reset(self):
+        _buffer[:] = 0
+'''
+
+# a classifier that exposes its hidden state, so each stream gets its own ModelState
+CLASSIFIER_MODULE = '''
+import numpy as np
+
+from {featurizer} import FloatVector, copy_to_buffer_float, Shape
+
+_weights = np.sin(np.arange(12, dtype=np.float32)).reshape(3, 4)
+
+
+class {name}Wrapper:
+    def GetInputSize(self, index):
+        return 4 if index == 0 else 3
+
+    def GetInputShape(self, index):
+        return Shape(4)
+
+    def GetOutputSize(self, index):
+        return 3
+
+    def GetOutputShape(self, index):
+        return Shape(3)
+
+    def Predict(self, input, hidden, output, new):
+        new[:] = np.tanh(0.5 * hidden + _weights.dot(input) / 10)
+        e = np.exp(new - new.max())
+        output[:] = e / e.sum()
+
+    def Reset(self):
+        pass
+'''
+
+
+class Output:
+    """ Collects the detection events a stream writes """
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines += [data]
+
+    def flush(self):
+        pass
+
+    def get_events(self):
+        events = [json.loads(line) for line in b"".join(self.lines).splitlines()]
+        for e in events:
+            del e["stream"]
+            del e["wall_time"]
+        return events
+
+
+class KeywordSpotterServerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp(prefix="kws_server_test")
+        with open(os.path.join(cls.temp_dir, "kwsfeaturizer.py"), "w") as f:
+            f.write(FEATURIZER_MODULE.replace("{name}", "Kwsfeaturizer"))
+        with open(os.path.join(cls.temp_dir, "kwsclassifier.py"), "w") as f:
+            f.write(CLASSIFIER_MODULE.replace("{name}", "Kwsclassifier").replace("{featurizer}", "kwsfeaturizer"))
+        cls.categories = os.path.join(cls.temp_dir, "categories.txt")
+        with open(cls.categories, "w") as f:
+            f.write("one\ntwo\nthree\n")
+        cls.featurizer = os.path.join(cls.temp_dir, "kwsfeaturizer")
+        cls.classifier = os.path.join(cls.temp_dir, "kwsclassifier")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def create_server(self, num_workers):
+        return kws_server.KeywordSpotterServer(self.featurizer, self.classifier, self.categories, 0,
+                                               num_workers=num_workers, auto_scale=True)
+
+    def process_alone(self, signal):
+        """ Featurize and classify the given signal on its own with freshly reset models, returning the
+        events the server should send for it """
+        transform = featurizer.AudioTransform(self.featurizer, 0)
+        transform.model.reset()
+        predictor = classifier.AudioClassifier(self.classifier, self.categories, 0)
+        samples = np.clip(signal, -1, 1 - 1 / 32768)
+        samples = (samples * 32768).astype(np.int16).astype(np.float32) / 32768
+        size = transform.input_size
+        frames = np.zeros((len(samples) + size - 1) // size * size, dtype=np.float32)
+        frames[:len(samples)] = samples
+        features = transform.transform_batch(frames.reshape(-1, size))
+        results = predictor.predict_batch(features, predictor.model.create_state())
+        return [{"time": (i + 1) * size / kws_server.SAMPLE_RATE, "prediction": int(prediction),
+                 "probability": float(probability), "label": label}
+                for i, (prediction, probability, label) in enumerate(results)]
+
+    def run_streams(self, server, signals, chunk_bytes):
+        """ Feed the given signals to the server, interleaving chunks of each one, and return the events
+        of each stream """
+        pcm = [(np.clip(x, -1, 1 - 1 / 32768) * 32768).astype("<i2").tobytes() for x in signals]
+        streams = [server.open_stream(Output()) for x in signals]
+        for pos in range(0, max(len(x) for x in pcm), chunk_bytes):
+            for data, (stream, worker) in zip(pcm, streams):
+                frames = stream.add_bytes(data[pos:pos + chunk_bytes])
+                if len(frames):
+                    worker.jobs.put((stream, frames, False))
+        for stream, worker in streams:
+            server.close_stream(stream, worker)
+        return [stream.output.get_events() for stream, worker in streams]
+
+    def test_measure_history(self):
+        server = self.create_server(1)
+        try:
+            # the featurizer buffers 3 frames, so it depends on the 2 frames before the current one
+            self.assertEqual(server.workers[0].featurizer_history, 2)
+            self.assertEqual(server.workers[0].classifier_history, 0)
+        finally:
+            server.shutdown()
+
+    def test_single_stream_is_not_replayed(self):
+        rng = np.random.RandomState(1)
+        signal = rng.uniform(-0.5, 0.5, 1000)
+        expected = self.process_alone(signal)
+        server = self.create_server(1)
+        try:
+            worker = server.workers[0]
+            featurized = []
+            transform_batch = worker.transform.transform_batch
+
+            def counting_transform_batch(frames):
+                featurized.append(len(frames))
+                return transform_batch(frames)
+            worker.transform.transform_batch = counting_transform_batch
+            actual = self.run_streams(server, [signal], 50)
+        finally:
+            server.shutdown()
+        self.assertEqual(expected, actual[0])
+        # the silent history is replayed once when the stream starts, after that the featurizer state carries
+        # over from one chunk to the next, so only the new frames are featurized
+        self.assertEqual(sum(featurized), worker.featurizer_history + len(expected))
+
+    def test_get_jobs_joins_the_chunks_of_each_stream(self):
+        server = self.create_server(1)
+        try:
+            worker = server.workers[0]
+            # stop the worker so the jobs can be queued up without it taking them
+            worker.jobs.put(None)
+            worker.join()
+            first, second = object(), object()
+            frames = [np.full((i + 1, 8), i, dtype=np.float32) for i in range(4)]
+            for job in [(first, frames[0], False), (second, frames[1], False), (first, frames[2], False),
+                        (second, frames[3], True)]:
+                worker.jobs.put(job)
+            jobs, stop = worker.get_jobs()
+            self.assertFalse(stop)
+            self.assertEqual([(stream, last) for stream, _, last in jobs], [(first, False), (second, True)])
+            np.testing.assert_array_equal(jobs[0][1], np.concatenate((frames[0], frames[2])))
+            np.testing.assert_array_equal(jobs[1][1], np.concatenate((frames[1], frames[3])))
+
+            worker.jobs.put((first, frames[0], True))
+            worker.jobs.put(None)
+            jobs, stop = worker.get_jobs()
+            self.assertTrue(stop)
+            self.assertEqual([(stream, last) for stream, _, last in jobs], [(first, True)])
+        finally:
+            server.shutdown()
+
+    def test_interleaved_streams_match_single_streams(self):
+        rng = np.random.RandomState(0)
+        signals = [rng.uniform(-0.5, 0.5, n) for n in [1000, 803, 1200]]
+
+        expected = [self.process_alone(signal) for signal in signals]
+        self.assertEqual(len(expected[0]), 125)
+
+        for num_workers, chunk_bytes in [(1, 50), (2, 16), (3, 122)]:
+            server = self.create_server(num_workers)
+            try:
+                actual = self.run_streams(server, signals, chunk_bytes)
+            finally:
+                server.shutdown()
+            for e, a in zip(expected, actual):
+                self.assertEqual(e, a)
+
+
+if __name__ == "__main__":
+    unittest.main()
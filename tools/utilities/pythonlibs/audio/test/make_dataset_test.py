@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     make_dataset_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+from unittest import mock
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+sys.path.append(os.path.join(script_path, "..", "training"))
+
+import dataset  # noqa: E402
+import make_dataset  # noqa: E402
+
+# A Python stand-in for a compiled featurizer, returning the magnitude of a fixed projection of each frame
+FEATURIZER_MODULE = '''
+import numpy as np
+
+_weights = np.cos(np.outer(np.arange(8), np.arange(32)) * np.pi / 32).astype(np.float32)
+
+
+class FloatVector(np.ndarray):
+    def __new__(cls, size_or_values):
+        if np.isscalar(size_or_values):
+            return np.zeros(size_or_values, dtype=np.float32).view(cls)
+        return np.array(size_or_values, dtype=np.float32).view(cls)
+
+    def copy_from(self, x):
+        self[:] = x
+
+
+def copy_to_buffer_float(vector, output):
+    output[:] = vector
+
+
+class Shape:
+    def __init__(self, size):
+        self.rows, self.columns, self.channels = 1, 1, size
+
+    def Size(self):
+        return self.channels
+
+
+class MdfeaturizerWrapper:
+    def GetInputSize(self, index):
+        return 32 if index == 0 else 0
+
+    def GetInputShape(self, index):
+        return Shape(32)
+
+    def GetOutputSize(self, index):
+        return 8
+
+    def GetOutputShape(self, index):
+        return Shape(8)
+
+    def Predict(self, input):
+        return FloatVector(np.abs(_weights.dot(input)))
+
+    def Reset(self):
+        pass
+'''
+
+
+class MakeDatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="make_dataset_test")
+        self.featurizer_file = os.path.join(self.temp_dir, "mdfeaturizer.py")
+        with open(self.featurizer_file, "w") as f:
+            f.write(FEATURIZER_MODULE)
+        self.featurizer = os.path.join(self.temp_dir, "mdfeaturizer")
+        self.categories = os.path.join(self.temp_dir, "categories.txt")
+        with open(self.categories, "w") as f:
+            f.write("background\none\ntwo\n")
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+        self.outdir = os.path.join(self.temp_dir, "out")
+        os.makedirs(self.outdir)
+
+        rng = np.random.RandomState(0)
+        names = []
+        for i in range(6):
+            name = "{}/{}.wav".format(["one", "two"][i % 2], i)
+            names += [name]
+            # the last file is empty, so it has no rows
+            length = 0 if i == 5 else 400 + 100 * i
+            self.write_wav(name, rng.randint(-10000, 10000, length))
+        for i in range(2):
+            self.write_wav("noise/{}.wav".format(i), rng.randint(-20000, 20000, 3000))
+        self.list_file = os.path.join(self.temp_dir, "training_list.txt")
+        with open(self.list_file, "w") as f:
+            f.write("\n".join(names) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_wav(self, name, samples):
+        filename = os.path.join(self.temp_dir, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with wave.open(filename, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(16000)
+            w.writeframes(np.asarray(samples, dtype=np.int16).tobytes())
+
+    def make(self, shift=2, **kwargs):
+        make_dataset.make_dataset(self.list_file, self.outdir, self.categories, self.featurizer, 16000, 4, shift,
+                                  **kwargs)
+        return dataset.Dataset.load(os.path.join(self.outdir, "training_list.npz"))
+
+    def cache_files(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return sorted(os.path.join(d, f) for d, _, files in os.walk(self.cache_dir) for f in files)
+
+    def assert_same_dataset(self, expected, actual):
+        np.testing.assert_array_equal(expected.features, actual.features)
+        np.testing.assert_array_equal(expected.label_names, actual.label_names)
+
+    def test_cache_hits(self):
+        expected = self.make()
+        ds = self.make(cache_dir=self.cache_dir)
+        self.assert_same_dataset(expected, ds)
+        # including the file with no rows, so it is not featurized again either
+        files = self.cache_files()
+        self.assertEqual(len(files), 6)
+
+        # the same inputs and settings are all found in the cache, in one process or with workers
+        with mock.patch.object(make_dataset, "_get_file_rows", side_effect=AssertionError("featurized")):
+            with mock.patch.object(make_dataset.multiprocessing, "Pool", side_effect=AssertionError("pool")):
+                for num_workers in [1, 2]:
+                    self.assert_same_dataset(expected, self.make(cache_dir=self.cache_dir, num_workers=num_workers))
+        self.assertEqual(self.cache_files(), files)
+
+    def test_cache_misses(self):
+        expected = self.make(cache_dir=self.cache_dir)
+        self.assertEqual(len(self.cache_files()), 6)
+
+        # a new setting, a changed featurizer or a changed file are featurized again
+        self.assertLess(len(self.make(shift=3, cache_dir=self.cache_dir).features), len(expected.features))
+        self.assertEqual(len(self.cache_files()), 12)
+        self.make(cache_dir=self.cache_dir, auto_scale=False)
+        self.assertEqual(len(self.cache_files()), 18)
+        with open(self.featurizer_file, "a") as f:
+            f.write("# rebuilt\n")
+        self.make(cache_dir=self.cache_dir)
+        self.assertEqual(len(self.cache_files()), 24)
+        self.write_wav("one/0.wav", np.zeros(600))
+        with mock.patch.object(make_dataset, "_get_file_rows", wraps=make_dataset._get_file_rows) as get_file_rows:
+            self.make(cache_dir=self.cache_dir)
+        self.assertEqual(get_file_rows.call_count, 1)
+        self.assertEqual(len(self.cache_files()), 25)
+
+    def test_workers(self):
+        expected = self.make()
+        self.assert_same_dataset(expected, self.make(num_workers=2))
+        self.assert_same_dataset(expected, self.make(num_workers=2, cache_dir=self.cache_dir))
+        self.assertEqual(len(self.cache_files()), 6)
+
+    def test_noise_mixer(self):
+        clean = self.make()
+        noise_path = os.path.join(self.temp_dir, "noise")
+        noisy = self.make(noise_path=noise_path, noise_selection=1, max_noise_ratio=0.5)
+        self.assertEqual(noisy.features.shape, clean.features.shape)
+        self.assertFalse(np.array_equal(noisy.features, clean.features))
+
+        # the cache key does not cover the noise, so the feature cache is not used when mixing
+        ds = self.make(noise_path=noise_path, noise_selection=1, max_noise_ratio=0.5, cache_dir=self.cache_dir)
+        self.assert_same_dataset(noisy, ds)
+        self.assertEqual(self.cache_files(), [])
+
+        # the workers write their rows to temporary files instead, and mix the same noise from a shared noise bank
+        noise_cache = os.path.join(self.temp_dir, "noise.npy")
+        for kwargs in [{}, {"noise_cache": noise_cache}, {"cache_dir": self.cache_dir}]:
+            with mock.patch.object(make_dataset.FeatureCache, "load", wraps=make_dataset.FeatureCache.load) as load:
+                ds = self.make(noise_path=noise_path, noise_selection=1, max_noise_ratio=0.5, num_workers=2,
+                               **kwargs)
+            self.assert_same_dataset(noisy, ds)
+            self.assertEqual(load.call_count, 5)
+            self.assertTrue(all(os.path.basename(call[0][0]) in ["{}.npy".format(i) for i in range(5)]
+                                for call in load.call_args_list))
+        self.assertTrue(os.path.isfile(noise_cache))
+        self.assertEqual(self.cache_files(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
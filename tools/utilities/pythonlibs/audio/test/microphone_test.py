@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     microphone_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import collections
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import microphone  # noqa: E402
+
+
+class FakeStream:
+    def close(self):
+        pass
+
+
+class FakeAudio:
+    """ Stands in for pyaudio.PyAudio, the tests call the recording callback themselves """
+    def get_default_input_device_info(self):
+        return {"defaultSampleRate": 16000}
+
+    def open(self, **kwargs):
+        return FakeStream()
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_capacity(self):
+        self.assertEqual(len(microphone.RingBuffer(1000).buffer), 1024)
+        self.assertEqual(len(microphone.RingBuffer(1024).buffer), 1024)
+
+    def test_matches_queue(self):
+        rng = np.random.RandomState(0)
+        ring = microphone.RingBuffer(64)
+        expected = collections.deque()
+        dropped = 0
+        for i in range(500):
+            samples = rng.randint(-32768, 32767, rng.randint(0, 40)).astype(np.int16)
+            written = ring.write(samples)
+            free = 64 - len(expected)
+            self.assertEqual(written, min(len(samples), free))
+            dropped += len(samples) - written
+            expected.extend(samples[:written])
+            self.assertEqual(len(ring), len(expected))
+
+            out = np.zeros(rng.randint(1, 50), dtype=np.float32)
+            requested = rng.randint(0, len(out) + 1)
+            count = ring.read_into(out, requested)
+            self.assertEqual(count, min(requested, len(expected)))
+            np.testing.assert_array_equal(out[:count], [expected.popleft() for _ in range(count)])
+        self.assertGreater(dropped, 0)
+        self.assertEqual(ring.overruns, dropped)
+
+
+class MicrophoneTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(microphone.pyaudio, "PyAudio", FakeAudio)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.audio = (np.arange(1000) * 37 % 60000 - 30000).astype(np.int16)
+
+    def open(self, auto_scale=True):
+        mic = microphone.Microphone(auto_scale, console=False)
+        mic.open(100, 16000, 1)
+        return mic
+
+    def record(self, mic, samples):
+        mic._on_recording_callback(samples.tobytes(), len(samples), None, None)
+
+    def test_read_into(self):
+        mic = self.open()
+        self.record(mic, self.audio[:250])
+        out = np.zeros(100, dtype=np.float32)
+        self.assertEqual(mic.read_into(out), 100)
+        np.testing.assert_array_equal(out, self.audio[:100] / 32768)
+        self.assertEqual(mic.read_into(out), 100)
+        np.testing.assert_array_equal(out, self.audio[100:200] / 32768)
+
+        # once closed the rest of the audio is padded with zeros, then nothing more is read
+        mic.close()
+        self.assertEqual(mic.read_into(out), 50)
+        np.testing.assert_array_equal(out[:50], self.audio[200:250] / 32768)
+        self.assertFalse(np.any(out[50:]))
+        self.assertEqual(mic.read_into(out), 0)
+        self.assertIsNone(mic.read())
+
+    def test_read_returns_new_arrays(self):
+        mic = self.open(auto_scale=False)
+        self.record(mic, self.audio[:300])
+        chunks = [mic.read() for i in range(3)]
+        self.assertFalse(np.shares_memory(chunks[0], chunks[1]))
+        for i, chunk in enumerate(chunks):
+            self.assertEqual(chunk.dtype, np.float32)
+            np.testing.assert_array_equal(chunk, self.audio[i * 100:(i + 1) * 100])
+
+    def test_read_waits_for_audio(self):
+        mic = self.open()
+        self.record(mic, self.audio[:60])
+        timer = threading.Timer(0.05, self.record, (mic, self.audio[60:200]))
+        timer.start()
+        out = np.zeros(100, dtype=np.float32)
+        self.assertEqual(mic.read_into(out), 100)
+        timer.join()
+        np.testing.assert_array_equal(out, self.audio[:100] / 32768)
+        self.assertEqual(mic.underruns, 1)
+        self.assertEqual(mic.overruns, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     noise_mixer_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+import zlib
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+sys.path.append(os.path.join(script_path, "..", "training"))
+
+import wav_reader  # noqa: E402
+import noise_mixer  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+
+class NoiseMixerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="noise_mixer_test")
+        rng = np.random.RandomState(0)
+        self.stereo_noise = rng.randint(-8000, 8000, (3000, 2)).astype(np.int16)
+        self.mono_noise = rng.randint(-8000, 8000, 500).astype(np.int16)
+        self.noise_files = [self.write_wav(os.path.join("noise", "stereo.wav"), self.stereo_noise),
+                            self.write_wav(os.path.join("noise", "mono.wav"), self.mono_noise)]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_wav(self, name, samples):
+        """ Write the given int16 samples, one column per channel, to a wav file """
+        filename = os.path.join(self.temp_dir, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        samples = np.asarray(samples, dtype=np.int16)
+        channels = 1 if samples.ndim == 1 else samples.shape[1]
+        with wave.open(filename, "wb") as w:
+            w.setnchannels(channels)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes(samples.tobytes())
+        return filename
+
+    def open_reader(self, filename, auto_scale=True, read_size=256):
+        reader = wav_reader.WavReader(SAMPLE_RATE, 1, auto_scale)
+        reader.open(filename, read_size)
+        return reader
+
+    def mix_file(self, mixer, filename, auto_scale=True):
+        mixer.open(self.open_reader(filename, auto_scale))
+        result = mixer.read_all()
+        mixer.close()
+        return result
+
+    def test_noise_bank(self):
+        bank = noise_mixer.NoiseBank(self.noise_files, SAMPLE_RATE)
+        self.assertEqual(len(bank), 2)
+        self.assertEqual(bank.samples.dtype, np.float32)
+        # the stereo channels are averaged rather than dropped
+        np.testing.assert_allclose(bank.get_clip(0), self.stereo_noise.mean(axis=1) / 32768, rtol=1e-6)
+        np.testing.assert_allclose(bank.get_clip(1), self.mono_noise / 32768, rtol=1e-6)
+
+        # a clip shorter than the requested length wraps around to its start
+        for seed in range(10):
+            noise = bank.get_noise(np.random.RandomState(seed), 1200)
+            rng = np.random.RandomState(seed)
+            clip = bank.get_clip(rng.randint(2))
+            start = rng.randint(len(clip))
+            np.testing.assert_array_equal(noise, np.take(clip, np.arange(start, start + 1200) % len(clip)))
+
+    def test_noise_bank_cache(self):
+        cache_file = os.path.join(self.temp_dir, "bank.npy")
+        bank = noise_mixer.NoiseBank(self.noise_files, SAMPLE_RATE, cache_file)
+        self.assertTrue(os.path.isfile(cache_file))
+        self.assertIsInstance(bank.samples, np.memmap)
+
+        # the cached bank is memory mapped without decoding the noise files again
+        cached = noise_mixer.NoiseBank(None, SAMPLE_RATE, cache_file)
+        self.assertIsInstance(cached.samples, np.memmap)
+        np.testing.assert_array_equal(cached.offsets, [0, 3000, 3500])
+        np.testing.assert_array_equal(cached.samples, bank.samples)
+
+    def test_mixer_matches_reference(self):
+        bank = noise_mixer.NoiseBank(self.noise_files, SAMPLE_RATE)
+        speech = np.random.RandomState(2).randint(-10000, 10000, 2000).astype(np.int16)
+        filename = self.write_wav(os.path.join("speech", "one.wav"), speech)
+        mixer = noise_mixer.NoiseBankMixer(bank, mix_ratio=0.2, mix_percent=1, max_sources=3)
+        actual = self.mix_file(mixer, filename)
+        self.assertTrue(mixer.mix)
+
+        # replay the random choices the mixer makes for this file
+        rng = mixer._get_rng(filename)
+        rng.rand()
+        expected = speech / 32768
+        for i in range(rng.randint(1, 4)):
+            expected = expected + 0.2 * bank.get_noise(rng, len(speech))
+        np.testing.assert_allclose(actual, expected, rtol=1e-6)
+
+        # read returns the same audio in zero padded chunks
+        mixer.open(self.open_reader(filename))
+        chunks = []
+        while True:
+            data = mixer.read()
+            if data is None:
+                break
+            chunks += [data]
+        self.assertEqual([len(c) for c in chunks], [256] * 8)
+        np.testing.assert_array_equal(np.concatenate(chunks)[:len(speech)], actual)
+        self.assertFalse(np.any(np.concatenate(chunks)[len(speech):]))
+
+    def test_mixer_clips_to_sample_range(self):
+        bank = noise_mixer.NoiseBank(self.noise_files, SAMPLE_RATE)
+        speech = np.full(2000, 30000, dtype=np.int16)
+        speech[1000:] = -30000
+        filename = self.write_wav(os.path.join("speech", "loud.wav"), speech)
+        for auto_scale, scale in [(True, 1 / 32768), (False, 1)]:
+            mixer = noise_mixer.NoiseBankMixer(bank, mix_ratio=2, mix_percent=1)
+            actual = self.mix_file(mixer, filename, auto_scale)
+            # the noise pushes the audio past full scale in both directions, and int16 would wrap around
+            self.assertEqual(actual.max(), 32767 * scale)
+            self.assertEqual(actual.min(), -32768 * scale)
+            self.assertTrue(np.all(actual[:1000] > 0))
+            self.assertTrue(np.all(actual[1000:] < 0))
+
+    def test_mixer_seed_is_per_file(self):
+        bank = noise_mixer.NoiseBank(self.noise_files, SAMPLE_RATE)
+        rng = np.random.RandomState(3)
+        files = [self.write_wav(os.path.join("speech", "{}.wav".format(i)),
+                                rng.randint(-10000, 10000, 1000).astype(np.int16)) for i in range(6)]
+
+        def mix_all(order, seed=0):
+            mixer = noise_mixer.NoiseBankMixer(bank, mix_percent=0.5, snr=(0, 20), max_sources=2, seed=seed)
+            results = {}
+            for i in order:
+                results[i] = (self.mix_file(mixer, files[i]), mixer.mix)
+            return results
+
+        first = mix_all(range(6))
+        self.assertIn(True, [mixed for _, mixed in first.values()])
+        # the noise added to a file does not depend on which files were mixed before it
+        for order in [[5, 4, 3, 2, 1, 0], [3, 0, 4]]:
+            for i, (data, mixed) in mix_all(order).items():
+                np.testing.assert_array_equal(data, first[i][0])
+                self.assertEqual(mixed, first[i][1])
+
+        # the seed comes from the crc32 of the seed and the last two parts of the path, so a copy of the
+        # folder somewhere else gets the same noise
+        copy = os.path.join(self.temp_dir, "copy", "speech", "0.wav")
+        os.makedirs(os.path.dirname(copy))
+        shutil.copyfile(files[0], copy)
+        mixer = noise_mixer.NoiseBankMixer(bank, mix_percent=0.5, snr=(0, 20), max_sources=2)
+        np.testing.assert_array_equal(self.mix_file(mixer, copy), first[0][0])
+        expected = np.random.RandomState(zlib.crc32(b"0:speech/0.wav")).rand(5)
+        np.testing.assert_array_equal(mixer._get_rng(copy).rand(5), expected)
+
+        other = mix_all(range(6), seed=1)
+        self.assertFalse(all(np.array_equal(other[i][0], first[i][0]) for i in range(6)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     sliding_window_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+sys.path.append(os.path.join(script_path, "..", "training"))
+
+import sliding_window  # noqa: E402
+import make_dataset  # noqa: E402
+
+
+def concatenating_window_frame(source, window_size, shift_amount):
+    """ The original make_dataset.sliding_window_frame, which concatenates each new sample onto a buffer """
+    buffer = None
+    count = 0
+    for new_samples in source:
+        # if new_samples is a scalar, turn it into a 1-element tuple
+        if np.isscalar(new_samples):
+            new_samples = (new_samples,)
+        if buffer is None:
+            buffer = new_samples
+        else:
+            buffer = np.concatenate((buffer, new_samples))
+
+        while len(buffer) >= window_size:
+            count += 1
+            yield buffer[:window_size]
+            buffer = buffer[shift_amount:]
+
+    # return the remainder, if any, to ensure we at least return 1 full frame
+    if buffer is not None and len(buffer) < window_size and (len(buffer) > window_size / 4 or count == 0):
+        shape = buffer.shape
+        if len(shape) == 2:
+            new_sample = np.zeros((window_size - len(buffer), shape[1]))
+        else:
+            new_sample = np.zeros((window_size - len(buffer)))
+        buffer = np.concatenate((buffer, new_sample))
+        yield buffer[:window_size]
+
+
+# (number of frames, window_size, shift_amount)
+WINDOW_CASES = [(100, 8, 2), (100, 10, 10), (37, 8, 3), (5, 8, 2), (1, 4, 1), (64, 16, 1), (30, 4, 6)]
+
+
+class SlidingWindowTest(unittest.TestCase):
+
+    def assert_same_windows(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertEqual(e.shape, a.shape)
+            np.testing.assert_array_equal(e, a)
+
+    def test_sliding_window_frame_matches_concatenating_version(self):
+        rng = np.random.RandomState(0)
+        for num_frames, window_size, shift in WINDOW_CASES:
+            frames = rng.rand(num_frames, 5).astype(np.float32)
+            source = [frames[i:i + 1] for i in range(num_frames)]
+            expected = list(concatenating_window_frame(source, window_size, shift))
+            # keeping every window needs copies, the default views are only valid until the next window
+            actual = list(make_dataset.sliding_window_frame(source, window_size, shift, copy=True))
+            self.assert_same_windows(expected, actual)
+            actual = [np.array(w) for w in make_dataset.sliding_window_frame(source, window_size, shift)]
+            self.assert_same_windows(expected, actual)
+
+    def test_sliding_window_frame_scalars_and_blocks(self):
+        rng = np.random.RandomState(1)
+        samples = rng.rand(50)
+        for window_size, shift in [(8, 2), (7, 3)]:
+            expected = list(concatenating_window_frame(list(samples), window_size, shift))
+            actual = list(make_dataset.sliding_window_frame(list(samples), window_size, shift, copy=True))
+            self.assert_same_windows(expected, actual)
+
+            blocks = [samples[i:i + 6] for i in range(0, len(samples), 6)]
+            expected = list(concatenating_window_frame(blocks, window_size, shift))
+            actual = list(make_dataset.sliding_window_frame(blocks, window_size, shift, copy=True))
+            self.assert_same_windows(expected, actual)
+
+    def test_sliding_window_frame_copies_are_opt_in(self):
+        frames = np.arange(40, dtype=np.float32).reshape(20, 2)
+        source = [frames[i:i + 1] for i in range(len(frames))]
+        views = list(make_dataset.sliding_window_frame(source, 4, 1))
+        self.assertTrue(np.shares_memory(views[0], views[1]))
+        windows = list(make_dataset.sliding_window_frame(source, 4, 1, copy=True))
+        self.assertFalse(np.shares_memory(windows[0], windows[1]))
+
+    def test_sliding_windows_matches_concatenating_version(self):
+        rng = np.random.RandomState(2)
+        for num_frames, window_size, shift in WINDOW_CASES:
+            if shift > window_size:
+                continue  # sliding_windows treats a shift larger than the window as a shift of window_size
+            frames = rng.rand(num_frames, 3).astype(np.float32)
+            expected = list(concatenating_window_frame([frames[i:i + 1] for i in range(num_frames)],
+                                                       window_size, shift))
+            actual = sliding_window.sliding_windows(frames, window_size, shift)
+            self.assert_same_windows(expected, list(actual))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     test_ell_model_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, "..", "training"))
+
+import test_ell_model  # noqa: E402
+import logger  # noqa: E402
+
+CATEGORIES = ["background", "one", "two", "three"]
+INPUT_SIZE = 4
+
+
+class FakePredictor:
+    """ Predicts the category given by the first value of each input, with a confidence from the second """
+    input_size = INPUT_SIZE
+    output_size = len(CATEGORIES)
+
+    def __init__(self):
+        self.total_time = 0
+
+    def reset(self):
+        pass
+
+    def predict_batch(self, features):
+        for row in features:
+            self.total_time += 0.001 * (1 + row[1])
+            yield int(row[0]), row[1], CATEGORIES[int(row[0])]
+
+
+def fake_load_models(self, featurizer_model, classifier_model, categories, sample_rate):
+    return FakePredictor(), mock.Mock(input_size=INPUT_SIZE, output_size=INPUT_SIZE)
+
+
+class RecordingFeatures:
+    """ An array of dataset features that records how it was indexed """
+    def __init__(self, features):
+        self.features = features
+        self.reads = []
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, index):
+        self.reads.append(index)
+        return self.features[index]
+
+
+class Dataset:
+    """ A dataset of rows holding 3 classifier inputs each """
+    def __init__(self, num_rows, seed=0):
+        rng = np.random.RandomState(seed)
+        features = rng.rand(num_rows, 3 * INPUT_SIZE).astype(np.float32)
+        features[:, ::INPUT_SIZE] = rng.randint(0, len(CATEGORIES), (num_rows, 3))
+        # the label is usually the category with the highest confidence
+        best = np.argmax(features[:, 1::INPUT_SIZE], axis=1)
+        predicted = np.array([CATEGORIES[int(row[i * INPUT_SIZE])] for row, i in zip(features, best)])
+        self.label_names = np.where(rng.rand(num_rows) < 0.8, predicted, "two")
+        self.features = RecordingFeatures(features)
+
+
+class AudioModelTesterTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not logger.initialized():
+            logger.init("ERROR")
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_ell_model_test")
+        self.output = os.path.join(self.temp_dir, "failed.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_test(self, dataset, num_workers, max_tests=None):
+        tester = test_ell_model.AudioModelTester(True)
+        dataset.features.reads = []
+        with mock.patch.object(test_ell_model.AudioModelTester, "load_models", fake_load_models):
+            rate, _ = tester.run_test("featurizer", "classifier", None, max_tests, dataset, CATEGORIES, 16000, False,
+                                      self.output, num_workers, seed=1)
+        return tester, rate
+
+    def test_confusion_matrix_and_histogram(self):
+        tester = test_ell_model.AudioModelTester(True)
+        results = [("one", "one", 1.0), ("one", "two", 2.0), ("two", "two", 3.0), ("three", "one", 4.0),
+                   ("one", "one", 10.0)]
+        for i, (expected, prediction, elapsed) in enumerate(results):
+            tester.record_result("row {}".format(i), prediction, expected, 0.5, elapsed)
+
+        self.assertEqual(tester.labels, ["one", "two", "three"])
+        np.testing.assert_array_equal(tester.confusion, [[2, 1, 0], [0, 1, 0], [1, 0, 0]])
+        self.assertEqual((tester.passed, tester.failed), (3, 2))
+        self.assertAlmostEqual(tester.rate, 0.6)
+        self.assertEqual(tester.best_time, 1.0)
+
+        counts, edges = tester.get_timing_histogram(bins=3)
+        np.testing.assert_array_equal(counts, [3, 1, 1])
+        np.testing.assert_allclose(edges, [1, 4, 7, 10])
+        tester.print_summary()
+
+    @unittest.skipIf(multiprocessing.get_start_method() != "fork",
+                     "the worker processes need to inherit the fake models")
+    def test_sharded_run_matches_sequential(self):
+        dataset = Dataset(3 * test_ell_model.SHARD_SIZE + 5)
+        for max_tests in [None, 100]:
+            sequential, sequential_rate = self.run_test(dataset, 1, max_tests)
+            # the sequential run reads one row at a time, without building the shards
+            self.assertTrue(all(np.isscalar(index) for index in dataset.features.reads))
+            with open(self.output) as f:
+                sequential_failed = f.read()
+
+            sharded, sharded_rate = self.run_test(dataset, 2, max_tests)
+            self.assertTrue(all(len(index) <= test_ell_model.SHARD_SIZE for index in dataset.features.reads))
+            with open(self.output) as f:
+                sharded_failed = f.read()
+
+            self.assertEqual(sharded_rate, sequential_rate)
+            self.assertEqual((sharded.passed, sharded.failed), (sequential.passed, sequential.failed))
+            self.assertEqual(sharded.passed + sharded.failed, max_tests or len(dataset.features))
+            self.assertEqual(sharded.labels, sequential.labels)
+            np.testing.assert_array_equal(sharded.confusion, sequential.confusion)
+            np.testing.assert_allclose(sharded.times, sequential.times)
+            self.assertEqual(sharded_failed, sequential_failed)
+
+    def test_imap_bounded(self):
+        taken = []
+
+        def items():
+            for i in range(10):
+                taken.append(i)
+                yield i
+
+        class Pool:
+            def apply_async(self, func, args):
+                return mock.Mock(get=mock.Mock(return_value=func(*args)))
+
+        results = test_ell_model._imap_bounded(Pool(), lambda x: x * x, items(), 3)
+        self.assertEqual(next(results), 0)
+        # only the items waiting for a worker have been taken from the iterable
+        self.assertEqual(taken, [0, 1, 2])
+        self.assertEqual(list(results), [x * x for x in range(1, 10)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     train_classifier_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x, pytorch
+#
+###################################################################################################
+
+import os
+import sys
+import types
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+sys.path.append(os.path.join(script_path, "..", "training"))
+
+import train_classifier  # noqa: E402
+
+
+class FailingFeatures:
+    """ Feature rows that raise an error once the given number of batches have been read """
+    def __init__(self, features, batches):
+        self.features = features
+        self.batches = batches
+
+    def __getitem__(self, index):
+        if self.batches == 0:
+            raise IOError("read failed")
+        self.batches -= 1
+        return self.features[index]
+
+
+class BatchLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.features = rng.uniform(-1, 1, (103, 4, 3)).astype(np.float32)
+        self.labels = rng.randint(0, 5, 103).astype(np.longlong)
+        self.dataset = types.SimpleNamespace(num_rows=103, features=self.features, labels=self.labels)
+
+    def get_batches(self, loader, seed=0):
+        np.random.seed(seed)
+        return [(audio.numpy(), labels.numpy()) for audio, labels in loader]
+
+    def assert_same_batches(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for (audio, labels), (other_audio, other_labels) in zip(expected, actual):
+            np.testing.assert_array_equal(audio, other_audio)
+            np.testing.assert_array_equal(labels, other_labels)
+
+    def test_batches(self):
+        loader = train_classifier.BatchLoader(self.dataset, 10, shuffle=False, drop_last=False)
+        batches = self.get_batches(loader)
+        self.assertEqual(len(loader), 11)
+        self.assertEqual([len(labels) for _, labels in batches], [10] * 10 + [3])
+        np.testing.assert_array_equal(np.concatenate([audio for audio, _ in batches]), self.features)
+        np.testing.assert_array_equal(np.concatenate([labels for _, labels in batches]), self.labels)
+
+        # each shuffled batch is a sorted block of the epoch's permutation, and the partial batch is dropped
+        loader = train_classifier.BatchLoader(self.dataset, 10)
+        batches = self.get_batches(loader, seed=1)
+        self.assertEqual(len(loader), 10)
+        np.random.seed(1)
+        indexes = np.random.permutation(103)
+        for i, (audio, labels) in enumerate(batches):
+            block = np.sort(indexes[i * 10:(i + 1) * 10])
+            self.assertEqual(audio.dtype, np.float32)
+            np.testing.assert_array_equal(audio, self.features[block])
+            np.testing.assert_array_equal(labels, self.labels[block])
+
+    def test_prefetch_gives_same_batches(self):
+        for shuffle in [False, True]:
+            for drop_last in [False, True]:
+                expected = self.get_batches(train_classifier.BatchLoader(self.dataset, 16, shuffle, drop_last))
+                for prefetch in [1, 3, 20]:
+                    loader = train_classifier.BatchLoader(self.dataset, 16, shuffle, drop_last, prefetch=prefetch)
+                    self.assert_same_batches(expected, self.get_batches(loader))
+                    # the loader can be iterated again for the next epoch
+                    self.assert_same_batches(expected, self.get_batches(loader))
+
+    def test_prefetch_stops_early(self):
+        loader = train_classifier.BatchLoader(self.dataset, 5, shuffle=False, prefetch=2)
+        batches = iter(loader)
+        audio, labels = next(batches)
+        np.testing.assert_array_equal(audio.numpy(), self.features[:5])
+        # closing the iterator stops the background thread, which is waiting on a full queue
+        batches.close()
+        self.assert_same_batches(self.get_batches(train_classifier.BatchLoader(self.dataset, 5, shuffle=False)),
+                                 self.get_batches(loader))
+
+    def test_prefetch_raises_errors(self):
+        self.dataset.features = FailingFeatures(self.features, 3)
+        loader = train_classifier.BatchLoader(self.dataset, 10, shuffle=False, prefetch=2)
+        batches = []
+        with self.assertRaises(IOError):
+            for batch in loader:
+                batches += [batch]
+        self.assertEqual(len(batches), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
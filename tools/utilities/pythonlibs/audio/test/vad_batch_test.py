@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     vad_batch_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import math
+import os
+import sys
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import vad  # noqa: E402
+import vad_sweep  # noqa: E402
+
+
+def original_weights(sample_rate, window_size):
+    """ The original per-bin loop of _CMessageWeights.generate """
+    cmw = vad._CMessageWeights(sample_rate, window_size)
+    weights = np.zeros(window_size)
+    div = sample_rate / cmw.max_freq
+    freq_step = sample_rate / window_size / div
+    for i in range(window_size):
+        w = cmw._get_weight(i * freq_step)
+        if w != 0:
+            w = math.pow(10, w / 20)
+        weights[i] = w * w
+    return weights
+
+
+def original_level(detector, data):
+    """ The original per-sample loop of VoiceActivityDetector.process """
+    level = 0
+    for i in range(detector.window_size):
+        level += data[i] * detector.cmw.get_weight(i)
+    return level / detector.window_size
+
+
+def make_frames(num_frames, window_size, seed=0):
+    """ Frames of quiet noise with a few louder bursts, so the detector switches on and off """
+    rng = np.random.RandomState(seed)
+    frames = rng.rand(num_frames, window_size) * 0.01
+    for start in range(20, num_frames, 60):
+        frames[start:start + 25] *= 50
+    return frames
+
+
+class VoiceActivityDetectorTest(unittest.TestCase):
+
+    def test_weights_match_original(self):
+        for sample_rate, window_size in [(16000, 256), (16000, 40), (8000, 128)]:
+            detector = vad.VoiceActivityDetector(sample_rate, window_size)
+            np.testing.assert_allclose(detector.cmw.weights, original_weights(sample_rate, window_size),
+                                       rtol=1e-12)
+
+    def test_process_batch_matches_process(self):
+        frames = make_frames(300, 40)
+        detector = vad.VoiceActivityDetector(16000, 40)
+        expected_signals = []
+        expected_levels = []
+        for frame in frames:
+            expected_levels += [original_level(detector, frame)]
+            expected_signals += [detector.process(frame)]
+        expected_intervals = list(detector.intervals)
+        self.assertIn(1, expected_signals)
+        self.assertIn(0, expected_signals)
+
+        detector.reset()
+        signals, levels = detector.process_batch(frames)
+        np.testing.assert_allclose(levels, expected_levels, rtol=1e-9)
+        self.assertEqual(list(signals), expected_signals)
+        self.assertEqual(detector.intervals, expected_intervals)
+
+    def test_track_activity_matches_detector(self):
+        frames = make_frames(200, 40, seed=1)
+        detector = vad.VoiceActivityDetector(16000, 40)
+        configs = [vad_sweep.DEFAULT_PARAMETERS,
+                   [1.0, 0.05, 3.0, 0.9, 2.0, 0.005, 0.005],
+                   [2.0, 0.1, 4.0, 0.95, 3.0, 0.001, 0.01]]
+        expected = []
+        for config in configs:
+            detector.reset()
+            detector.configure(*config)
+            signals, levels = detector.process_batch(frames)
+            expected += [signals]
+        signals = vad_sweep.track_activity(levels, detector.frame_duration, configs)
+        np.testing.assert_array_equal(signals, np.array(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     vad_sweep_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+from unittest import mock
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import featurizer  # noqa: E402
+import vad  # noqa: E402
+import vad_sweep  # noqa: E402
+import wav_reader  # noqa: E402
+
+# A Python stand-in for a compiled featurizer, returning the magnitude of a fixed projection of each frame
+FEATURIZER_MODULE = '''
+import numpy as np
+
+_weights = np.cos(np.outer(np.arange(16), np.arange(32)) * np.pi / 32).astype(np.float32)
+
+
+class FloatVector(np.ndarray):
+    def __new__(cls, size_or_values):
+        if np.isscalar(size_or_values):
+            return np.zeros(size_or_values, dtype=np.float32).view(cls)
+        return np.array(size_or_values, dtype=np.float32).view(cls)
+
+    def copy_from(self, x):
+        self[:] = x
+
+
+def copy_to_buffer_float(vector, output):
+    output[:] = vector
+
+
+class Shape:
+    def __init__(self, size):
+        self.rows, self.columns, self.channels = 1, 1, size
+
+    def Size(self):
+        return self.channels
+
+
+class SweepfeaturizerWrapper:
+    def GetInputSize(self, index):
+        return 32 if index == 0 else 0
+
+    def GetInputShape(self, index):
+        return Shape(32)
+
+    def GetOutputSize(self, index):
+        return 16
+
+    def GetOutputShape(self, index):
+        return Shape(16)
+
+    def Predict(self, input):
+        return FloatVector(np.abs(_weights.dot(input)))
+
+    def Reset(self):
+        pass
+'''
+
+
+def make_levels(num_frames, seed=0):
+    """ Levels of quiet noise with a few louder bursts, so the activity tracker switches on and off """
+    rng = np.random.RandomState(seed)
+    levels = rng.rand(num_frames) * 0.005
+    for start in range(30, num_frames, 80):
+        levels[start:start + 30] *= 20
+    return levels
+
+
+def count_frames(signal, truth):
+    """ The true positive, false positive and false negative frames of the given signal """
+    signal = signal.astype(bool)
+    return np.sum(signal & truth), np.sum(signal & ~truth), np.sum(~signal & truth)
+
+
+class VadSweepTest(unittest.TestCase):
+
+    def test_make_grid(self):
+        np.testing.assert_array_equal(vad_sweep.make_grid(), [vad_sweep.DEFAULT_PARAMETERS])
+        grid = vad_sweep.make_grid(tau_up=[1, 2], threshold_up=[3, 4, 5], gain_att=None)
+        self.assertEqual(grid.shape, (6, 7))
+        np.testing.assert_array_equal(grid[:, 0], [1, 1, 1, 2, 2, 2])
+        np.testing.assert_array_equal(grid[:, 2], [3, 4, 5, 3, 4, 5])
+        for i in [1, 3, 4, 5, 6]:
+            np.testing.assert_array_equal(grid[:, i], vad_sweep.DEFAULT_PARAMETERS[i])
+
+    def test_intervals_to_frames(self):
+        truth = vad_sweep.intervals_to_frames([[0.05, 0.12], [0.57, 0.605], [0.95, 2]], 100, 0.01)
+        expected = np.zeros(100, dtype=bool)
+        expected[5:12] = True
+        expected[57:61] = True
+        expected[95:] = True
+        np.testing.assert_array_equal(truth, expected)
+        # an interval that ends exactly on a frame boundary does not include the next frame
+        np.testing.assert_array_equal(np.nonzero(vad_sweep.intervals_to_frames([[0.03, 0.07]], 10, 0.01))[0],
+                                      [3, 4, 5, 6])
+        self.assertFalse(np.any(vad_sweep.intervals_to_frames([], 10, 0.01)))
+
+    def test_sweep(self):
+        frame_duration = 0.016
+        grid = vad_sweep.make_grid(tau_up=[0.5, 1.54], threshold_up=[2, 3.5, 5], level_threshold=[0.005, 0.02])
+        # the truth comes from one of the configurations, so it gets a perfect score
+        best = 7
+        files = []
+        for seed in range(3):
+            levels = make_levels(400 + 50 * seed, seed)
+            truth = vad_sweep.track_activity(levels, frame_duration, grid[best:best + 1])[0].astype(bool)
+            files += [(levels, truth)]
+
+        precision, recall, f1 = vad_sweep.sweep(files, frame_duration, grid, num_workers=1)
+        self.assertEqual((precision[best], recall[best], f1[best]), (1, 1, 1))
+        self.assertLess(f1.min(), 1)
+        for i, config in enumerate(grid):
+            counts = np.sum([count_frames(vad_sweep.track_activity(levels, frame_duration, [config])[0], truth)
+                             for levels, truth in files], axis=0)
+            tp, fp, fn = counts
+            self.assertAlmostEqual(precision[i], tp / max(1, tp + fp))
+            self.assertAlmostEqual(recall[i], tp / max(1, tp + fn))
+            self.assertEqual(f1[i] == 1, fp + fn == 0)
+
+        # sharding the grid over processes gives the same results
+        for result, expected in zip(vad_sweep.sweep(files, frame_duration, grid, num_workers=2, shard_size=5),
+                                    [precision, recall, f1]):
+            np.testing.assert_array_equal(result, expected)
+
+
+class LevelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="vad_sweep_test")
+        with open(os.path.join(self.temp_dir, "sweepfeaturizer.py"), "w") as f:
+            f.write(FEATURIZER_MODULE)
+        self.featurizer = os.path.join(self.temp_dir, "sweepfeaturizer")
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+        rng = np.random.RandomState(0)
+        self.audio = (rng.uniform(-1, 1, 1000) * np.repeat([500, 20000, 500, 20000], 250)).astype(np.int16)
+        self.wav_file = os.path.join(self.temp_dir, "a.wav")
+        self.write_wav(self.audio)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_wav(self, samples):
+        with wave.open(self.wav_file, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(16000)
+            w.writeframes(samples.tobytes())
+
+    def expected_levels(self, audio):
+        weights = np.cos(np.outer(np.arange(16), np.arange(32)) * np.pi / 32)
+        features = np.abs(wav_reader.to_frames(audio / 32768, 32).dot(weights.T))
+        detector = vad.VoiceActivityDetector(16000, 16)
+        return detector.process_batch(features)[1]
+
+    def test_get_levels(self):
+        cache = vad_sweep.LevelCache(self.featurizer, 16000, True, self.cache_dir)
+        levels = cache.get_levels(self.wav_file)
+        self.assertEqual(len(levels), 32)
+        np.testing.assert_allclose(levels, self.expected_levels(self.audio), rtol=1e-4)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        # the second time the levels come from the cache without featurizing the file
+        with mock.patch.object(featurizer.AudioTransform, "transform_batch", side_effect=AssertionError("featurized")):
+            np.testing.assert_array_equal(cache.get_levels(self.wav_file), levels)
+            cache = vad_sweep.LevelCache(self.featurizer, 16000, True, self.cache_dir)
+            np.testing.assert_array_equal(cache.get_levels(self.wav_file), levels)
+
+        # a rewritten file has a new mtime, so it is featurized again
+        self.write_wav(self.audio[::-1])
+        stat = os.stat(self.wav_file)
+        os.utime(self.wav_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        np.testing.assert_allclose(cache.get_levels(self.wav_file), self.expected_levels(self.audio[::-1]),
+                                   rtol=1e-4)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        # as are files read with different settings
+        vad_sweep.LevelCache(self.featurizer, 16000, False, self.cache_dir).get_levels(self.wav_file)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+    def test_no_cache(self):
+        cache = vad_sweep.LevelCache(self.featurizer, 16000, True)
+        np.testing.assert_array_equal(cache.get_levels(self.wav_file), cache.get_levels(self.wav_file))
+        self.write_wav(self.audio[:0])
+        self.assertEqual(len(cache.get_levels(self.wav_file)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     wav_reader_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import wav_reader  # noqa: E402
+
+
+def original_get_requested_channels(data, actual_channels, requested_channels):
+    """ The original WavReader.get_requested_channels, which split and re-zipped the channels in Python """
+    if requested_channels < actual_channels:
+        data = np.frombuffer(data, dtype=np.int16)
+        channels = []
+        for i in range(actual_channels):
+            channels += [data[i::actual_channels]]
+        channels = channels[0:requested_channels]
+        data = np.array(list(zip(*channels))).flatten()
+        data = bytes(np.array(data, dtype=np.int16))
+    return data
+
+
+def original_read_all(reader):
+    """ The original WavReader.read loop, which concatenated a tail array on every chunk, returning every
+    chunk read until the end of the file.  The leftover tail chunks are scaled here, which the original
+    forgot to do. """
+    tail = None
+    result = []
+    while True:
+        if tail is not None and len(tail) >= reader.read_size:
+            data = tail[0:reader.read_size]
+            tail = tail[reader.read_size:]
+            result += [data * reader.audio_scale_factor]
+            continue
+
+        data = reader.wav_file.readframes(reader.buffer_size)
+        if len(data) == 0:
+            break
+        if reader.actual_rate != reader.requested_rate:
+            data, reader.cvstate = wav_reader.audioop.ratecv(data, reader.sample_width, reader.actual_channels,
+                                                             reader.actual_rate, reader.requested_rate,
+                                                             reader.cvstate)
+        data = original_get_requested_channels(data, reader.actual_channels, reader.requested_channels)
+        data = np.frombuffer(data, dtype=reader.dtype).astype(float)
+        if tail is not None:
+            data = np.concatenate((tail, data))
+        if len(data) > reader.read_size:
+            tail = data[reader.read_size:]
+            data = data[0:reader.read_size]
+        if len(data) < reader.read_size:
+            data = np.concatenate((data, np.zeros(reader.read_size - len(data))))
+        result += [data * reader.audio_scale_factor]
+    return result
+
+
+def reference_resample(samples, actual_rate, requested_rate):
+    """ The same polyphase filter as wav_reader.resample, computed one output sample at a time """
+    divisor = math.gcd(actual_rate, requested_rate)
+    up = requested_rate // divisor
+    down = actual_rate // divisor
+    half_width = 8 * int(math.ceil(down / up))
+    phases = wav_reader._get_polyphase_filter(up, down, half_width).astype(np.float64)
+    padded = np.pad(np.asarray(samples, dtype=np.float64), (half_width, half_width + 1), mode="constant")
+    output = np.zeros(int(math.ceil(len(samples) * up / down)))
+    for k in range(len(output)):
+        start = (k * down) // up
+        output[k] = np.dot(padded[start:start + phases.shape[1]], phases[(k * down) % up, ::-1])
+    return output
+
+
+class WavReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="wav_reader_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_wav(self, name, samples, sample_rate):
+        """ Write the given int16 samples, one column per channel, to a wav file """
+        filename = os.path.join(self.temp_dir, name)
+        samples = np.asarray(samples, dtype=np.int16)
+        channels = 1 if samples.ndim == 1 else samples.shape[1]
+        with wave.open(filename, "wb") as w:
+            w.setnchannels(channels)
+            w.setsampwidth(2)
+            w.setframerate(sample_rate)
+            w.writeframes(samples.tobytes())
+        return filename
+
+    def make_audio(self, count, channels, seed=0):
+        rng = np.random.RandomState(seed)
+        return rng.randint(-20000, 20000, (count, channels)).astype(np.int16)
+
+    def read_chunks(self, filename, sample_rate, channels, read_size):
+        reader = wav_reader.WavReader(sample_rate, channels)
+        reader.open(filename, read_size)
+        chunks = []
+        while True:
+            data = reader.read()
+            if data is None:
+                break
+            chunks += [data]
+        reader.close()
+        return chunks
+
+    def test_get_requested_channels_matches_original(self):
+        audio = self.make_audio(1000, 3)
+        filename = self.write_wav("three.wav", audio, 16000)
+        for channels in [1, 2, 3]:
+            reader = wav_reader.WavReader(16000, channels)
+            reader.open(filename, 256)
+            data = audio.tobytes()
+            self.assertEqual(reader.get_requested_channels(data), original_get_requested_channels(data, 3, channels))
+            reader.close()
+
+    def test_read_matches_original(self):
+        # same rate, channel selection and rate conversion, with read sizes that do and don't divide the file
+        cases = [(16000, 1, 1, 256), (16000, 2, 1, 100), (8000, 1, 1, 160), (44100, 2, 1, 512), (22050, 2, 2, 333)]
+        for actual_rate, actual_channels, channels, read_size in cases:
+            audio = self.make_audio(actual_rate // 3, actual_channels, seed=actual_rate)
+            filename = self.write_wav("audio.wav", audio, actual_rate)
+            reader = wav_reader.WavReader(16000, channels)
+            reader.open(filename, read_size)
+            expected = original_read_all(reader)
+            reader.close()
+            actual = self.read_chunks(filename, 16000, channels, read_size)
+            self.assertEqual(len(expected), len(actual))
+            for e, a in zip(expected, actual):
+                np.testing.assert_allclose(a, e, rtol=1e-12)
+
+    def test_read_all_matches_read(self):
+        for channels, read_size in [(1, 256), (2, 100), (1, 1000)]:
+            audio = self.make_audio(5000, channels, seed=channels)
+            filename = self.write_wav("audio.wav", audio, 16000)
+            chunks = self.read_chunks(filename, 16000, channels, read_size)
+            reader = wav_reader.WavReader(16000, channels)
+            reader.open(filename, read_size)
+            samples = reader.read_all()
+            reader.close()
+            self.assertEqual(samples.dtype, np.float32)
+            np.testing.assert_allclose(samples, audio.ravel() / 32768, rtol=1e-6)
+            np.testing.assert_allclose(wav_reader.to_frames(samples, read_size), np.array(chunks), rtol=1e-6)
+
+    def test_read_all_after_read(self):
+        audio = self.make_audio(3000, 1, seed=5)
+        filename = self.write_wav("audio.wav", audio, 16000)
+        reader = wav_reader.WavReader(16000, 1)
+        reader.open(filename, 300)
+        first = reader.read()
+        rest = reader.read_all()
+        reader.close()
+        np.testing.assert_allclose(np.concatenate((first, rest)), audio.ravel() / 32768, rtol=1e-6)
+
+    def test_resample_matches_reference(self):
+        rng = np.random.RandomState(3)
+        samples = rng.uniform(-1, 1, 3000).astype(np.float32)
+        for actual_rate, requested_rate in [(8000, 16000), (44100, 16000), (22050, 16000), (16000, 8000)]:
+            expected = reference_resample(samples, actual_rate, requested_rate)
+            actual = wav_reader.resample(samples, actual_rate, requested_rate, block_size=97)
+            np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-5)
+            stereo = wav_reader.resample(np.stack((samples, -samples), axis=1), actual_rate, requested_rate)
+            np.testing.assert_allclose(stereo[:, 0], actual, rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(stereo[:, 1], -actual, rtol=1e-5, atol=1e-6)
+
+    def test_resample_keeps_low_frequencies(self):
+        for actual_rate in [8000, 22050, 44100]:
+            t = np.arange(actual_rate) / actual_rate
+            samples = np.sin(2 * np.pi * 440 * t)
+            output = wav_reader.resample(samples, actual_rate, 16000)
+            expected = np.sin(2 * np.pi * 440 * np.arange(len(output)) / 16000)
+            # ignore the edges where the filter runs off the ends of the signal
+            np.testing.assert_allclose(output[100:-100], expected[100:-100], atol=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
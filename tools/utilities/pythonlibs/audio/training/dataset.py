@@ -7,9 +7,175 @@
 #  Requires: Python 3.x
 #
 ###################################################################################################
+import json
+import os
 
 import numpy as np
 
+MEMMAP_FORMAT = "ell-audio-dataset"
+MEMMAP_VERSION = 1
+
+
+def _get_memmap_paths(filename):
+    """ Return the paths of the raw features and labels files that go with the given json header file """
+    base = os.path.splitext(filename)[0]
+    return base + ".features", base + ".labels"
+
+
+class ColumnStatistics:
+    """ The running mean and standard deviation of each column of a stream of 2D chunks of rows.  Chunks are
+    merged with the parallel variance formula (Chan et al.) so the rows never need to be in memory at once """
+    def __init__(self, row_size):
+        self.count = 0
+        self.mean = np.zeros(row_size)
+        self.m2 = np.zeros(row_size)
+
+    def add(self, rows):
+        """ Add a 2D chunk of rows """
+        n = len(rows)
+        if n == 0:
+            return
+        rows = np.asarray(rows, dtype=np.float64)
+        mean = rows.mean(axis=0)
+        m2 = np.square(rows - mean).sum(axis=0)
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += m2 + np.square(delta) * self.count * n / total
+        self.count = total
+
+    def get_mean(self):
+        return self.mean if self.count else np.full(len(self.mean), np.nan)
+
+    def get_std(self):
+        return np.sqrt(self.m2 / self.count) if self.count else np.full(len(self.mean), np.nan)
+
+
+def compute_statistics(features, chunk_size=65536):
+    """
+    Scan the given 2D features (which may be a memmap) in chunks, returning a tuple containing the boolean
+    mask of the rows with finite entries (or None if all rows are finite), and the mean and standard deviation
+    of each column over those rows.
+    """
+    num_rows = len(features)
+    stats = ColumnStatistics(int(np.prod(features.shape[1:])) if num_rows else 0)
+    good_rows = None
+    for i in range(0, num_rows, chunk_size):
+        chunk = np.asarray(features[i:i + chunk_size]).reshape(-1, len(stats.mean))
+        finite = np.isfinite(chunk).all(axis=1)
+        if not finite.all():
+            if good_rows is None:
+                good_rows = np.ones(num_rows, dtype=bool)
+            good_rows[i:i + len(chunk)] = finite
+            chunk = chunk[finite]
+        stats.add(chunk)
+    return good_rows, stats.get_mean(), stats.get_std()
+
+
+def write_memmap(filename, features, label_index, label_table, valid_classes, parameters, chunk_size=65536):
+    """
+    Save a dataset in the memory mappable format, which is a json header file (the given filename) containing
+    the parameters, valid_classes, label table and the mean and standard deviation of each column, a raw
+    float32 .features file with one row per sample and a raw int32 .labels file containing the index of each
+    row's label in the label table.  The features are written in chunks so they are never copied in full, and
+    rows containing non-finite values are dropped so the file can be used as is when it is loaded.
+    """
+    features_path, labels_path = _get_memmap_paths(filename)
+    row_size = int(np.prod(features.shape[1:])) if len(features) else 0
+    label_index = np.asarray(label_index)
+    stats = ColumnStatistics(row_size)
+
+    with open(features_path, "wb") as f, open(labels_path, "wb") as labels:
+        for i in range(0, len(features), chunk_size):
+            chunk = np.ascontiguousarray(features[i:i + chunk_size], dtype=np.float32).reshape(-1, row_size)
+            chunk_labels = label_index[i:i + chunk_size]
+            finite = np.isfinite(chunk).all(axis=1)
+            if not finite.all():
+                chunk = chunk[finite]
+                chunk_labels = chunk_labels[finite]
+            f.write(chunk.tobytes())
+            labels.write(chunk_labels.astype(np.int32).tobytes())
+            stats.add(chunk)
+
+    header = {
+        "format": MEMMAP_FORMAT,
+        "version": MEMMAP_VERSION,
+        "num_rows": stats.count,
+        "row_size": row_size,
+        "dtype": "float32",
+        "features": os.path.basename(features_path),
+        "labels": os.path.basename(labels_path),
+        "label_table": [str(x) for x in label_table],
+        "valid_classes": [str(x) for x in valid_classes],
+        "parameters": [x.item() if hasattr(x, "item") else x for x in parameters],
+        "mean": stats.get_mean().tolist(),
+        "std": stats.get_std().tolist()
+    }
+    with open(filename, "w") as f:
+        json.dump(header, f, indent=2)
+
+
+def read_memmap(filename, mode="r"):
+    """
+    Open a dataset saved by write_memmap.  Returns a tuple containing the (num_rows, row_size) float32 features
+    memmap, the int32 array of label indexes, the label table, and the json header which also contains the
+    "parameters", "valid_classes" and the column "mean" and "std".  Opening the features is O(1) since nothing
+    is read until it is used.
+    """
+    with open(filename, "r") as f:
+        header = json.load(f)
+    if header.get("format") != MEMMAP_FORMAT:
+        raise Exception("{} is not a memory mapped dataset".format(filename))
+    if header.get("version") != MEMMAP_VERSION:
+        raise Exception("{} has unsupported version {}".format(filename, header.get("version")))
+
+    folder = os.path.dirname(filename)
+    num_rows = header["num_rows"]
+    row_size = header["row_size"]
+    if num_rows == 0:
+        features = np.zeros((0, row_size), dtype=np.float32)
+    else:
+        features = np.memmap(os.path.join(folder, header["features"]), dtype=header["dtype"], mode=mode,
+                             shape=(num_rows, row_size))
+    label_index = np.fromfile(os.path.join(folder, header["labels"]), dtype=np.int32)
+    if len(label_index) != num_rows:
+        raise Exception("{} has {} labels, but {} rows".format(filename, len(label_index), num_rows))
+    label_table = np.array(header["label_table"])
+    return features, label_index, label_table, header
+
+
+def get_label_index(data):
+    """
+    Return the int32 label index and label table from the arrays of a loaded .npz dataset, which stores the
+    labels as a compact "label_index" array plus a "label_table" of names.  Older files which store the
+    label names of every row in a "labels" array are converted with np.unique.
+    """
+    if "label_index" in data:
+        return data["label_index"].astype(np.int32), data["label_table"]
+    label_table, label_index = np.unique(data["labels"], return_inverse=True)
+    return label_index.astype(np.int32), label_table
+
+
+def map_label_table(label_table, categories, missing=None):
+    """ Map each name in the label table to its index in the given list of categories, returning an int64 array
+    that can be indexed by a label index array.  Names not in categories map to 'missing', or raise an
+    exception if missing is None """
+    lookup = {name: i for i, name in enumerate(categories)}
+    result = np.zeros(len(label_table), dtype=np.int64)
+    for i, name in enumerate(label_table):
+        if name in lookup:
+            result[i] = lookup[name]
+        elif missing is not None:
+            result[i] = missing
+        else:
+            raise Exception("label {} not found in categories".format(name))
+    return result
+
+
+def is_memmap(filename):
+    """ Return True if the given dataset file name is in the memory mapped format """
+    return os.path.splitext(filename)[1] == ".json"
+
 
 class Dataset(object):
     """
@@ -17,25 +183,37 @@ class Dataset(object):
     A labelled dataset contains a "truth" label for each row of data that can be used in a supervised
     training process.
     """
-    def __init__(self, features, label_names, valid_classes, parameters):
+    def __init__(self, features, label_names, valid_classes, parameters, label_table=None, mean=None, std=None):
         """
         Create new Dataset from the given features and label names and parameters.  The parameters
         can be any tuple that is application specific.  For example, in the case of audio one might
         want to store the sample rate, window size and other audio specific parameters associated
         with the featurized data.  The valid_classes list all possible labels and label_names might only
-        mention a subset of these.
+        mention a subset of these.  If label_table is given then label_names is instead the index of each
+        row's label in that table.  If the mean and std of each column are given, the features must not contain
+        any non-finite rows and they are used as is, so a memory mapped dataset is never read in full.
         """
+        if label_table is None:
+            label_table, label_index = np.unique(np.asarray(label_names), return_inverse=True)
+        else:
+            label_index = np.asarray(label_names)
 
-        # Keep rows with finite entries (there are lots of NaNs initially)
-        good_rows = np.isfinite(features).all(axis=1)
-        features = features[good_rows]
-        label_names = label_names[good_rows]
+        if mean is None or std is None:
+            # Keep rows with finite entries (there are lots of NaNs initially)
+            good_rows, mean, std = compute_statistics(features)
+            if good_rows is not None:
+                features = features[good_rows]
+                label_index = label_index[good_rows]
+        dtype = features.dtype if np.issubdtype(features.dtype, np.floating) else np.float64
 
         self.file_name = None
         self.features = features
         self.labels = None  # computable labels ([0,1] for binary classification, 1-hot vector for multiclass)
         self.raw_labels = None  # numeric labels ([0, num_classes])
-        self.label_names = label_names  # textual labels
+        self.label_index = label_index.astype(np.int32)  # index of each row's label in the label_table
+        self.label_table = np.asarray(label_table)  # textual labels
+        self.mean = np.asarray(mean, dtype=dtype)
+        self.std = np.asarray(std, dtype=dtype)
         self.categories = None  # map from textual -> numeric label
         self.category_names = None  # map from numeric -> textual label
         self.class_weights = None
@@ -45,14 +223,16 @@ class Dataset(object):
 
         self._init()
 
+    @property
+    def label_names(self):
+        """ the textual label of each row """
+        return self.label_table[self.label_index]
+
     def _init(self):
 
         # Process features
-        self.mean = np.mean(self.features, axis=0)
-
-        std = np.std(self.features, axis=0)
-        std[np.equal(std, 0)] = 1e-5
-        self.std = std
+        self.std = self.std.copy()
+        self.std[np.equal(self.std, 0)] = 1e-5
 
         self._process_labels()
         self._compute_class_weights()
@@ -60,22 +240,33 @@ class Dataset(object):
 
     @staticmethod
     def load(filename):
-        """ Load a dataset from a numpy file.  """
+        """ Load a dataset from a numpy file, or from a memory mapped dataset if the filename ends with .json """
+        if is_memmap(filename):
+            features, label_index, label_table, header = read_memmap(filename)
+            result = Dataset(features, label_index, np.array(header["valid_classes"]), header["parameters"],
+                             label_table, header["mean"], header["std"])
+            result.file_name = filename
+            return result
+
         with np.load(filename) as data:
             features = data["features"]
-            label_names = data["labels"]
+            label_index, label_table = get_label_index(data)
             parameters = data["parameters"]
             valid_classes = data["valid_classes"]
 
-        result = Dataset(features, label_names, valid_classes, parameters)
+        result = Dataset(features, label_index, valid_classes, parameters, label_table)
         result.file_name = filename
         return result
 
     def save(self, filename):
-        """ Save the dataset fo a numpy .npz file """
+        """ Save the dataset fo a numpy .npz file, or to the memory mapped format if the filename ends with .json """
         self.file_name = filename
-        np.savez(filename, features=self.features, labels=self.label_names, valid_classes=self.valid_classes,
-                 parameters=self.parameters)
+        if is_memmap(filename):
+            write_memmap(filename, self.features, self.label_index, self.label_table, self.valid_classes,
+                         self.parameters)
+            return
+        np.savez(filename, features=self.features, label_index=self.label_index, label_table=self.label_table,
+                 valid_classes=self.valid_classes, parameters=self.parameters)
 
     def _process_labels(self):
         # Generate map from name -> label value, starting with index 1 (reserving 0 for 'null')
@@ -83,7 +274,11 @@ class Dataset(object):
         self.category_names = {d[1]: d[0] for d in self.categories.items()}  # map from label value -> name
         self.num_classes = len(self.categories)
 
-        self.raw_labels = np.array([self.categories[n] for n in self.label_names])
+        # labels in the table that no row uses any more are allowed to be missing from the valid classes
+        self.raw_labels = map_label_table(self.label_table, self.valid_classes, -1)[self.label_index]
+        if len(self.raw_labels) and self.raw_labels.min() < 0:
+            missing = self.label_table[self.label_index[np.argmin(self.raw_labels)]]
+            raise Exception("label {} not found in categories".format(missing))
         self.labels = self.raw_labels
 
         # Deal with multiclass datasets, create a vector [0,1,0,0,0,...] for each expected label row
@@ -94,16 +289,16 @@ class Dataset(object):
 
     def _compute_class_weights(self):
         total_entries = len(self.raw_labels)
-        unique_labels = set(self.raw_labels)
-        self.class_distribution = {l: 0 for l in set(unique_labels)}  # init to zero
-        for label in self.raw_labels:
-            self.class_distribution[label] += 1
-        self.class_weights = {label: (total_entries / self.class_distribution[label]) for label in unique_labels}
+        counts = np.bincount(self.raw_labels, minlength=self.num_classes)
+        unique_labels = np.nonzero(counts)[0]
+        self.class_distribution = {int(label): int(counts[label]) for label in unique_labels}
+        self.class_weights = {label: (total_entries / count) for label, count in self.class_distribution.items()}
+        # the weight of each class as an array indexed by label value
+        self.class_weight_table = np.zeros(len(counts))
+        self.class_weight_table[unique_labels] = total_entries / counts[unique_labels]
 
     def _compute_sample_weights(self):
-        self.sample_weights = np.zeros(len(self.raw_labels))
-        for index in range(len(self.raw_labels)):
-            self.sample_weights[index] = self.class_weights[self.raw_labels[index]]
+        self.sample_weights = self.class_weight_table[self.raw_labels]
 
     def normalize(self):
         """ Normalize the dataset by subtracting the mean and dividing by the standard deviation """
@@ -12,14 +12,19 @@
 Utility for featurizing a bunch of wav files into a training dataset.
 """
 import argparse
+import hashlib
+import multiprocessing
 import os
+import shutil
 import sys
+import tempfile
 
 sys.path += [os.path.join(os.path.dirname(__file__), "..")]
 import numpy as np
 
 from dataset import Dataset
 import featurizer
+import sliding_window
 import wav_reader
 import noise_mixer
 
@@ -57,35 +62,15 @@ def lazy_apply_transform(transform):
         yield y[np.newaxis, ...]
 
 
-def sliding_window_frame(source, window_size, shift_amount):
-    """ General windowing and merging generator that concatenates & shifts samples through a sliding window frame """
-    # Source is a container or generator that returns numpy vectors
-    # We buffer them and return arrays of length window_size, shifted by shift_amount
-    buffer = None
-    count = 0
-    for new_samples in source:
-        # if new_samples is a scalar, turn it into a 1-element tuple
-        if np.isscalar(new_samples):
-            new_samples = (new_samples,)
-        if buffer is None:
-            buffer = new_samples
-        else:
-            buffer = np.concatenate((buffer, new_samples))
-
-        while len(buffer) >= window_size:
-            count += 1
-            yield buffer[:window_size]
-            buffer = buffer[shift_amount:]
-
-    # return the remainder, if any, to ensure we at least return 1 full frame
-    if buffer is not None and len(buffer) < window_size and (len(buffer) > window_size / 4 or count == 0):
-        shape = buffer.shape
-        if len(shape) == 2:
-            new_sample = np.zeros((window_size - len(buffer), shape[1]))
-        else:
-            new_sample = np.zeros((window_size - len(buffer)))
-        buffer = np.concatenate((buffer, new_sample))
-        yield buffer[:window_size]
+def sliding_window_frame(source, window_size, shift_amount, copy=False):
+    """ General windowing and merging generator that shifts samples through a sliding window frame.
+    Source is a container or generator that returns numpy vectors, and the windows returned are views into a
+    reused buffer which are only valid until the next window is requested.  Pass copy=True to get each window
+    as a new array instead when the windows are kept, for example with list(). """
+    windows = sliding_window.SlidingWindow(window_size, shift_amount).process(source)
+    if not copy:
+        return windows
+    return (np.array(window) for window in windows)
 
 
 def get_wav_features(input_filename, transform, sample_rate, window_size, shift, auto_scale, mixer):
@@ -104,65 +89,231 @@ def get_wav_features(input_filename, transform, sample_rate, window_size, shift,
         mixer.open(source)
         source = mixer
 
-    # apply the featurizing transform
+    # read all the audio and apply the featurizing transform in one batch
     transform.open(source)
-
-    source = lazy_apply_transform(transform)
-
-    # and apply the classifier window frame size
-    source = sliding_window_frame(source, window_size, shift)
-
-    rows_generated = 0
-    for row in source:
-        features = np.ravel(row)
-        rows_generated += 1
-        yield features
-
-    if rows_generated == 0:
+    audio = source.read_all()
+    if len(audio) == 0:
         print("### no rows generated for input file: {}".format(input_filename))
+        return
+    frames = transform.transform_batch(wav_reader.to_frames(audio, transform_input_size))
 
+    # and apply the classifier window frame size, returning each window as one row
+    windows = sliding_window.sliding_windows(frames, window_size, shift)
+    for row in windows:
+        yield np.ravel(row)
 
-def _get_dataset(entry_map, categories, transform, sample_rate, window_size, shift, auto_scale, mixer):
-    data_rows = []
-    label_rows = []
 
+class FeatureCache:
+    """
+    Per-file cache of featurized rows.  Each wav file is stored as a .npy file whose name is a hash of the
+    wav file contents combined with the featurizer and the sample_rate, window_size, shift and auto_scale
+    settings, so re-running make_dataset with the same settings only featurizes files it has not seen before.
+    """
+    def __init__(self, cache_dir, featurizer_path, sample_rate, window_size, shift, auto_scale):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        settings = hashlib.sha1()
+        for filename in self._get_featurizer_files(featurizer_path):
+            settings.update(self.hash_file(filename).encode("utf-8"))
+        settings.update(repr((sample_rate, window_size, shift, bool(auto_scale))).encode("utf-8"))
+        self.settings_hash = settings.hexdigest()
+
+    @staticmethod
+    def _get_featurizer_files(featurizer_path):
+        """ Return the files that identify the featurizer, either the .ell file or the compiled module files """
+        if os.path.isfile(featurizer_path):
+            return [featurizer_path]
+        parent_dir = os.path.dirname(featurizer_path) or "."
+        module_name = os.path.basename(featurizer_path)
+        files = []
+        if os.path.isdir(parent_dir):
+            files = [os.path.join(parent_dir, f) for f in sorted(os.listdir(parent_dir))
+                     if f.startswith(module_name) and os.path.isfile(os.path.join(parent_dir, f))]
+        if not files:
+            raise Exception("featurizer {} not found".format(featurizer_path))
+        return files
+
+    @staticmethod
+    def hash_file(filename):
+        """ Compute the content hash of the given file """
+        h = hashlib.sha1()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def get_path(self, wav_file):
+        """ Get the cache file path for the given wav file """
+        h = hashlib.sha1(self.settings_hash.encode("utf-8"))
+        h.update(self.hash_file(wav_file).encode("utf-8"))
+        key = h.hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    @staticmethod
+    def load(cache_path):
+        """ Return the cached rows for the given cache path, or None if it is not cached.  A file that produced
+        no rows is cached as an empty array """
+        if os.path.isfile(cache_path):
+            return np.load(cache_path, mmap_mode="r")
+        return None
+
+    @staticmethod
+    def save(cache_path, rows):
+        """ Save the featurized rows, writing to a temp file first so a killed run never leaves partial entries.
+        Pass None for a file that produced no rows, so it is not featurized again """
+        if rows is None:
+            rows = np.zeros((0, 0), dtype=np.float32)
+        folder = os.path.dirname(cache_path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        temp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        with open(temp_path, "wb") as f:
+            np.save(f, rows)
+        os.replace(temp_path, cache_path)
+
+
+def _get_file_rows(full_path, transform, sample_rate, window_size, shift, auto_scale, mixer):
+    """ Featurize the given wav file returning a 2D array of rows, or None if no rows were generated """
+    file_features = list(get_wav_features(full_path, transform, sample_rate, window_size, shift, auto_scale,
+                                          mixer))
+    if len(file_features) == 0:
+        return None
+    return np.array(file_features)
+
+
+# each featurizing worker process owns its own featurizer, created once by _init_worker.
+_worker_state = None
+
+
+def _init_worker(featurizer_path, sample_rate, window_size, shift, auto_scale, noise_file=None, mixer_settings=None):
+    """ Load the featurizer, and memory map the noise bank from noise_file if noise is being mixed in, so the
+    bank is shared by the workers rather than pickled to each of them """
+    global _worker_state
+    transform = featurizer.AudioTransform(featurizer_path, 0)
+    mixer = None
+    if noise_file:
+        bank = noise_mixer.NoiseBank(None, sample_rate, noise_file)
+        mixer = noise_mixer.NoiseBankMixer(bank, **mixer_settings)
+    _worker_state = (transform, sample_rate, window_size, shift, auto_scale, mixer)
+
+
+def _featurize_in_worker(job):
+    """ Featurize one wav file in a worker process.  The rows are written to the given cache path (which is
+    a temporary file when there is no FeatureCache) and only the row count is returned to the parent process,
+    so the rows are never pickled. """
+    full_path, cache_path = job
+    transform, sample_rate, window_size, shift, auto_scale, mixer = _worker_state
+    rows = _get_file_rows(full_path, transform, sample_rate, window_size, shift, auto_scale, mixer)
+    FeatureCache.save(cache_path, rows)
+    return 0 if rows is None else len(rows)
+
+
+def _copy_rows(jobs, results):
+    """ Copy the rows of each file into one preallocated features array, returning it with the label of each row """
+    total = sum(len(rows) for rows in results if rows is not None)
+    print(" found {} rows".format(total))
+    first = next((rows for rows in results if rows is not None), None)
+    if first is None:
+        return np.zeros((0, 0)), np.array([])
+    features = np.empty((total, first.shape[1]), dtype=first.dtype)
+    label_names = np.empty(total, dtype="<U{}".format(max(len(job[0]) for job in jobs)))
+    pos = 0
+    for (label, full_path, cache_path), rows in zip(jobs, results):
+        if rows is not None:
+            features[pos:pos + len(rows)] = rows
+            label_names[pos:pos + len(rows)] = label
+            pos += len(rows)
+    return features, label_names
+
+
+def _get_dataset(entry_map, categories, transform, sample_rate, window_size, shift, auto_scale, mixer,
+                 featurizer_path=None, num_workers=1, cache=None):
+    """
+    Featurize all the files in the entry_map.  Files found in the optional FeatureCache are not featurized
+    again, and when num_workers > 1 the remaining files are featurized by a pool of worker processes each
+    with their own featurizer loaded from featurizer_path.  The workers write their rows to the cache, or to
+    temporary files when there is no cache.  The rows are then copied into one preallocated features array in
+    the same order the serial path would produce.
+    """
+    jobs = []  # (label, full_path, cache_path)
     for e in entry_map:
         label = os.path.basename(e)
         if label not in categories:
             raise Exception("label {} not found in categories file".format(label))
-
-        total = 0
-        print("Transforming {} files from {} ... ".format(len(entry_map[e]), label), end='', flush=True)
-
         for file in entry_map[e]:
             full_path = os.path.join(e, file)
-            file_features = list(get_wav_features(full_path, transform, sample_rate, window_size, shift, auto_scale,
-                                                  mixer))
-            if len(file_features) > 0:
-                labels = [label for r in file_features]
-                data_rows.append(file_features)
-                label_rows.append(labels)
-            total += len(file_features)
-
-        print(" found {} rows".format(total))
-
-    features = np.concatenate(data_rows, axis=0)
-    label_names = np.concatenate(label_rows, axis=0)
+            cache_path = cache.get_path(full_path) if cache else None
+            jobs += [(label, full_path, cache_path)]
+
+    results = [None] * len(jobs)
+    pending = []
+    for i, (label, full_path, cache_path) in enumerate(jobs):
+        rows = cache.load(cache_path) if cache else None
+        if rows is None:
+            pending += [i]
+        elif len(rows):
+            results[i] = rows
+
+    print("Transforming {} files ({} found in cache) ... ".format(len(jobs), len(jobs) - len(pending)),
+          end='', flush=True)
+
+    temp_dir = None
+    try:
+        if num_workers > 1 and len(pending) > 1:
+            if not featurizer_path:
+                raise Exception("featurizer_path is required when num_workers > 1")
+            if not cache or mixer:
+                temp_dir = tempfile.mkdtemp(prefix="make_dataset")
+            work = [(jobs[i][1], jobs[i][2] or os.path.join(temp_dir, "{}.npy".format(i))) for i in pending]
+            initargs = (featurizer_path, sample_rate, window_size, shift, auto_scale)
+            if mixer:
+                noise_file = mixer.noise_bank.cache_file
+                if not noise_file:
+                    noise_file = os.path.join(temp_dir, "noise.npy")
+                    mixer.noise_bank.save(noise_file)
+                initargs += (noise_file, mixer.get_settings())
+            with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=initargs) as pool:
+                for i, job, count in zip(pending, work, pool.imap(_featurize_in_worker, work, chunksize=8)):
+                    if count:
+                        results[i] = FeatureCache.load(job[1])
+        else:
+            for i in pending:
+                label, full_path, cache_path = jobs[i]
+                rows = _get_file_rows(full_path, transform, sample_rate, window_size, shift, auto_scale, mixer)
+                if cache:
+                    cache.save(cache_path, rows)
+                results[i] = rows
+
+        features, label_names = _copy_rows(jobs, results)
+    finally:
+        if temp_dir:
+            # release the memory maps before removing their files
+            results = None
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
     # remember these settings in the dataset
     parameters = (sample_rate, transform.input_size, transform.output_size, window_size, shift)
     return Dataset(features, label_names, categories, parameters)
 
 
 def make_dataset(list_file, outdir, categories_path, featurizer_path, sample_rate, window_size, shift, auto_scale=True,
-                 noise_path=None, max_noise_ratio=0.1, noise_selection=0.1, use_cache=False):
+                 noise_path=None, max_noise_ratio=0.1, noise_selection=0.1, use_cache=False, num_workers=1,
+                 cache_dir=None, file_format="npz", noise_cache=None, snr=None, max_noise_sources=1, seed=0):
 
     """
     Create a dataset given the input list file, a featurizer, the desired .wav sample rate,
     classifier window_size and window shift amount.  The dataset is saved to the same file name
-    with .npz extension.  This will do nothing if dataset is already created, unless use_cache=False.
+    with .npz extension, or in the memory mapped format with .json extension if file_format="memmap".
+    This will do nothing if dataset is already created, unless use_cache=False.
+    num_workers > 1 featurizes the files in that many worker processes, and cache_dir enables the
+    per-file feature cache (it is not used when mixing in noise).  The noise files are decoded once into a
+    NoiseBank, saved to the optional noise_cache file, and mixed in at the given max_noise_ratio, or at a random
+    signal to noise ratio from the (min, max) snr range, using up to max_noise_sources noise clips per file.
+    The seed makes the noise mixing reproducible.
     """
     dataset_name = os.path.basename(list_file)
-    dataset_path = os.path.splitext(dataset_name)[0] + ".npz"
+    dataset_path = os.path.splitext(dataset_name)[0] + (".json" if file_format == "memmap" else ".npz")
     dataset_path = os.path.join(outdir, dataset_path)
     if use_cache and os.path.isfile(dataset_path):
       return
@@ -181,9 +332,15 @@ def make_dataset(list_file, outdir, categories_path, featurizer_path, sample_rat
     if noise_path:
         noise_files = [os.path.join(noise_path, f) for f in os.listdir(noise_path)
                        if os.path.splitext(f)[1] == ".wav"]
-        mixer = noise_mixer.AudioNoiseMixer(noise_files, max_noise_ratio, noise_selection)
+        bank = noise_mixer.NoiseBank(noise_files, sample_rate, noise_cache)
+        mixer = noise_mixer.NoiseBankMixer(bank, max_noise_ratio, noise_selection, snr, max_noise_sources, seed)
+
+    cache = None
+    if cache_dir and not mixer:
+        cache = FeatureCache(cache_dir, featurizer_path, sample_rate, window_size, shift, auto_scale)
 
-    dataset = _get_dataset(entry_map, categories, transform, sample_rate, window_size, shift, auto_scale, mixer)
+    dataset = _get_dataset(entry_map, categories, transform, sample_rate, window_size, shift, auto_scale, mixer,
+                           featurizer_path, num_workers, cache)
     if len(dataset.features) == 0:
         print("No features found in list file")
 
@@ -197,7 +354,7 @@ if __name__ == "__main__":
 
     # options
     arg_parser.add_argument("--list_file", "-l", help="The path to the list file to process")
-    arg_parser.add_argument("--outdir", "-o", help="The path where you want the *.npz files saved",
+    arg_parser.add_argument("--outdir", "-o", help="The path where you want the dataset files saved",
                             default=os.getcwd())
     arg_parser.add_argument("--categories", "-c",
                             help="The full list of labels (a given list file might only see a subset of these)")
@@ -213,6 +370,20 @@ if __name__ == "__main__":
                             help="Specifies the ratio of noise to audio (default 0.1)")
     arg_parser.add_argument("--noise_selection", type=float, default=0.1,
                             help="Ratio of audio files to mix with noise (default 0.1)")
+    arg_parser.add_argument("--noise_cache", default=None,
+                            help="Path of a .npy file to save the decoded noise bank in, so it is only decoded once")
+    arg_parser.add_argument("--snr", type=lambda s: [float(x) for x in s.split(",")], default=None,
+                            help="Mix noise at a random signal to noise ratio in this 'min,max' range of decibels, "
+                            "instead of at max_noise_ratio")
+    arg_parser.add_argument("--max_noise_sources", type=int, default=1,
+                            help="Maximum number of noise clips to mix into each audio file (default 1)")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Random seed for the noise mixing (default 0)")
+    arg_parser.add_argument("--workers", "-j", type=int, default=1,
+                            help="Number of featurizing worker processes (default 1)")
+    arg_parser.add_argument("--cache_dir", default=None,
+                            help="Folder for caching the features of each wav file so re-runs skip them")
+    arg_parser.add_argument("--format", choices=["npz", "memmap"], default="npz",
+                            help="Save a numpy *.npz file or memory mapped dataset with *.json header (default npz)")
     args = arg_parser.parse_args()
 
     if args.noise_path and not os.path.isdir(args.noise_path):
@@ -220,4 +391,6 @@ if __name__ == "__main__":
         sys.exit(1)
 
     make_dataset(args.list_file, args.outdir, args.categories, args.featurizer, args.sample_rate, args.window_size,
-                 args.shift, args.auto_scale, args.noise_path, args.max_noise_ratio, args.noise_selection)
+                 args.shift, args.auto_scale, args.noise_path, args.max_noise_ratio, args.noise_selection,
+                 num_workers=args.workers, cache_dir=args.cache_dir, file_format=args.format,
+                 noise_cache=args.noise_cache, snr=args.snr, max_noise_sources=args.max_noise_sources, seed=args.seed)
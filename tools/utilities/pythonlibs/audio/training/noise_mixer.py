@@ -12,6 +12,8 @@ import os
 import sys
 
 import audioop
+import zlib
+
 import numpy as np
 
 sys.path += [os.path.join(os.path.dirname(__file__), "..")]
@@ -124,6 +126,174 @@ class AudioNoiseMixer:
         return self.wav_reader1 is None
 
 
+class NoiseBank:
+    """
+    This class decodes a set of noise files once, resampled to the given sample rate and mixed down to mono,
+    into one shared float32 array in the range [-1, 1].  The decoded bank can be saved to a cache file and
+    is then memory mapped, so large banks are not loaded into memory and can be shared by worker processes.
+    """
+    def __init__(self, noise_files, sample_rate=16000, cache_file=None):
+        """ 'noise_files' is the list of noise wav files, and 'cache_file' is the optional path of a .npy file
+        to save the decoded bank to, or to load it from if it already exists """
+        self.sample_rate = sample_rate
+        self.cache_file = None
+        if cache_file and os.path.isfile(cache_file):
+            self._load(cache_file)
+            return
+
+        clips = [self._decode(f) for f in noise_files]
+        clips = [c for c in clips if len(c) > 0]
+        if not clips:
+            raise Exception("No noise found in the given noise files")
+        self.offsets = np.cumsum([0] + [len(c) for c in clips])
+        self.samples = np.concatenate(clips)
+        if cache_file:
+            self.save(cache_file)
+            self._load(cache_file)
+
+    @staticmethod
+    def _get_offsets_file(cache_file):
+        return os.path.splitext(cache_file)[0] + ".offsets.npy"
+
+    def _load(self, cache_file):
+        self.cache_file = cache_file
+        self.samples = np.load(cache_file, mmap_mode="r")
+        self.offsets = np.load(self._get_offsets_file(cache_file))
+
+    def save(self, cache_file):
+        """ Save the decoded bank to the given cache file, which NoiseBank(None, sample_rate, cache_file) can
+        then memory map """
+        np.save(cache_file, self.samples)
+        np.save(self._get_offsets_file(cache_file), self.offsets)
+
+    def _decode(self, filename):
+        reader = wav_reader.WavReader(self.sample_rate, 1, auto_scale=True)
+        reader.open(filename, 16384)
+        # read every channel and average them, rather than keeping only the first one
+        channels = reader.actual_channels
+        reader.requested_channels = channels
+        samples = reader.read_all()
+        reader.close()
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+        return samples
+
+    def __len__(self):
+        """ Return the number of noise clips in the bank """
+        return len(self.offsets) - 1
+
+    def get_clip(self, index):
+        """ Return the samples of the given noise clip as a view into the bank """
+        return self.samples[self.offsets[index]:self.offsets[index + 1]]
+
+    def get_noise(self, rng, length):
+        """ Return 'length' samples from a random clip starting at a random offset, wrapping around to the start
+        of the clip if it is shorter than the requested length """
+        clip = self.get_clip(rng.randint(len(self)))
+        start = rng.randint(len(clip))
+        if start + length <= len(clip):
+            return np.asarray(clip[start:start + length])
+        return np.take(clip, np.arange(start, start + length) % len(clip))
+
+
+class NoiseBankMixer:
+    """
+    This class is a vectorized alternative to AudioNoiseMixer that mixes noise from a NoiseBank into each
+    opened audio file.  The whole utterance is read on open and each noise source is added with one NumPy
+    operation.  The noise level is either a fixed mix_ratio like AudioNoiseMixer, or is chosen at random
+    from the given (min, max) signal to noise ratio range in decibels.  Every random choice comes from a
+    generator seeded by the seed and the name of the audio file, so results are reproducible no matter
+    which order (or which process) the files are processed in.
+    """
+    def __init__(self, noise_bank, mix_ratio=0.1, mix_percent=0.2, snr=None, max_sources=1, seed=0):
+        """ 'noise_bank' is the NoiseBank to mix noise from, 'mix_ratio' is the fixed amount of noise to mix in
+        when 'snr' is None, 'mix_percent' is the fraction of the audio files that get noise added, and
+        'max_sources' is the maximum number of noise clips to add to each audio file """
+        self.noise_bank = noise_bank
+        self.mix_ratio = mix_ratio
+        self.mix_percent = mix_percent
+        self.snr = snr
+        self.max_sources = max_sources
+        self.seed = seed
+        self.wav_reader = None
+        self.mix = False
+
+    def get_settings(self):
+        """ Return the keyword arguments, other than the noise bank, needed to create an identical mixer """
+        return {"mix_ratio": self.mix_ratio, "mix_percent": self.mix_percent, "snr": self.snr,
+                "max_sources": self.max_sources, "seed": self.seed}
+
+    def _get_rng(self, filename):
+        name = "{}:{}".format(self.seed, "/".join(os.path.normpath(filename).split(os.sep)[-2:]))
+        return np.random.RandomState(zlib.crc32(name.encode("utf-8")))
+
+    def open(self, input_wav_reader, speaker=None):
+        """ Open the given audio file for mixing.  This mixer will return the same requested #
+        channels and sample rate that the wav_reader was given """
+        self.wav_reader = input_wav_reader
+        self.read_size = input_wav_reader.read_size
+        self.dtype = input_wav_reader.dtype
+        self.sample_width = input_wav_reader.sample_width
+        self.requested_channels = input_wav_reader.requested_channels
+        self.requested_rate = input_wav_reader.requested_rate
+        self.audio_scale_factor = input_wav_reader.audio_scale_factor
+
+        data = input_wav_reader.read_all()
+        rng = self._get_rng(input_wav_reader.filename)
+        self.mix = len(data) > 0 and rng.rand() < self.mix_percent
+        if self.mix:
+            data = self.mix_noise(data, rng)
+        self.buffer = data
+        self.pos = 0
+
+        if speaker:
+            audio_format = input_wav_reader.audio.get_format_from_width(self.sample_width)
+            speaker.open(audio_format, self.requested_channels, self.requested_rate)
+            speaker.write((data / self.audio_scale_factor).astype(self.dtype).tobytes())
+
+    def mix_noise(self, data, rng):
+        """ Add between 1 and max_sources noise clips to the given audio using the given random generator.  The
+        result is clipped to the range of the sample format, like audioop.add in AudioNoiseMixer """
+        # the noise bank is in the range [-1, 1] so scale it to match the units of the audio
+        max_sample = pow(2, (8 * self.sample_width) - 1)
+        full_scale = max_sample * self.audio_scale_factor
+        signal_power = np.mean(np.square(data))
+        result = np.array(data, dtype=np.float64)
+        for i in range(rng.randint(1, self.max_sources + 1)):
+            noise = self.noise_bank.get_noise(rng, len(data))
+            if self.snr is None:
+                gain = self.mix_ratio * full_scale
+            else:
+                snr = rng.uniform(self.snr[0], self.snr[1])
+                noise_power = max(float(np.mean(np.square(noise))), 1e-12)
+                gain = np.sqrt(signal_power / (noise_power * pow(10, snr / 10)))
+            result += gain * noise
+        return np.clip(result, -full_scale, (max_sample - 1) * self.audio_scale_factor, out=result)
+
+    def read(self):
+        if self.pos >= len(self.buffer):
+            return None
+        data = self.buffer[self.pos:self.pos + self.read_size]
+        self.pos += self.read_size
+        if len(data) < self.read_size:
+            data = np.concatenate((data, np.zeros(self.read_size - len(data))))
+        return data
+
+    def read_all(self):
+        """ Return all the remaining mixed audio at once, without padding """
+        data = self.buffer[self.pos:]
+        self.pos = len(self.buffer)
+        return data
+
+    def close(self):
+        if self.wav_reader:
+            self.wav_reader.close()
+            self.wav_reader = None
+
+    def is_closed(self):
+        return self.wav_reader is None
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Test the AudioNoiseMixer class")
     parser.add_argument("--wav_file", "-w", help=".wav file to process")
@@ -11,6 +11,8 @@
 
 # evaluate accuracy of model against the given testing dataset.
 import argparse
+import collections
+import multiprocessing
 import os
 import sys
 import time
@@ -20,12 +22,14 @@ sys.path += [os.path.join(os.path.dirname(__file__), "..", "..")]
 import numpy as np
 
 import classifier
+from dataset import get_label_index, is_memmap, read_memmap
 import featurizer
 import wav_reader
 import logger
 
 THRESHOLD = 0.01
 SMOOTHING = 0  # no smoothing window on classifier output
+SHARD_SIZE = 64  # number of tests sent to a worker process at a time
 
 
 class FeatureReader:
@@ -62,6 +66,9 @@ class AudioModelTester:
         self.silent = self.logger.getSilent()
         self.reset = reset
         self.best_time = None
+        self.labels = []
+        self.confusion = None
+        self.times = []
 
     def get_prediction(self, name, transform, predictor):
         """
@@ -96,6 +103,26 @@ class AudioModelTester:
 
         return (best_prediction, best_probability, label, elapsed)
 
+    def get_batch_prediction(self, name, features, predictor):
+        """
+        Same as get_prediction, but for pre-featurized rows which are all passed to the predictor in one batch.
+        The returned elapsed time is the average time per row.
+        """
+        if self.reset:
+            predictor.reset()
+
+        best_prediction = None
+        best_probability = 0
+        label = None
+        predictor.total_time = 0
+        for _, probability, label in predictor.predict_batch(features):
+            if probability is not None and probability > best_probability:
+                best_probability = probability
+                best_prediction = label
+
+        elapsed = predictor.total_time * 1000 / max(1, len(features))
+        return (best_prediction, best_probability, label, elapsed)
+
     def process_prediction(self, name, prediction, expected, confidence):
         """
         Print result of a given prediction and whether the test passed or failed given the expected result
@@ -118,17 +145,79 @@ class AudioModelTester:
                 self.logger.error("FAILED: {}, expecting {}, path={}".format(prediction, expected, name))
         return prediction == expected
 
+    def load_models(self, featurizer_model, classifier_model, categories, sample_rate):
+        """ Load the featurizer and classifier models, returning the (predictor, transform) pair """
+        predictor = classifier.AudioClassifier(classifier_model, categories, THRESHOLD, SMOOTHING)
+        transform = featurizer.AudioTransform(featurizer_model, predictor.input_size)
+        predictor.set_frame_duration(transform.input_size / sample_rate)
+        if transform.using_map != predictor.using_map:
+            raise Exception("cannot mix .ell and compiled models")
+        return predictor, transform
+
+    def test_file(self, wav_file, name, transform, predictor, sample_rate, auto_scale):
+        """ Featurize and classify the given wav file, returning the (prediction, confidence, elapsed) tuple """
+        reader = wav_reader.WavReader(sample_rate, 1, auto_scale)
+        reader.open(wav_file, transform.input_size, None)
+        transform.open(reader)
+        prediction, confidence, _, elapsed = self.get_prediction(name, transform, predictor)
+        return prediction, confidence, elapsed
+
+    def test_rows(self, name, features, predictor):
+        """ Classify the given pre-featurized dataset row, returning the (prediction, confidence, elapsed) tuple """
+        reader = FeatureReader(features, predictor.input_size)
+        prediction, confidence, _, elapsed = self.get_batch_prediction(name, reader.features, predictor)
+        return prediction, confidence, elapsed
+
+    def record_result(self, name, prediction, expected, confidence, elapsed):
+        """ Add the result of one test to the pass/fail counts, the confusion matrix and the timing list """
+        for label in (expected, prediction):
+            if label not in self.labels:
+                self.labels += [label]
+        size = len(self.labels)
+        if self.confusion is None or len(self.confusion) < size:
+            confusion = np.zeros((size, size), dtype=np.int64)
+            if self.confusion is not None:
+                confusion[:len(self.confusion), :len(self.confusion)] = self.confusion
+            self.confusion = confusion
+        self.confusion[self.labels.index(expected), self.labels.index(prediction)] += 1
+        self.times += [elapsed]
+        if self.best_time is None or elapsed < self.best_time:
+            self.best_time = elapsed
+        return self.process_prediction(name, prediction, expected, confidence)
+
+    def get_timing_histogram(self, bins=10):
+        """ Return the (counts, bin_edges) histogram of the prediction times in milliseconds """
+        return np.histogram(self.times, bins=bins)
+
+    def print_summary(self):
+        """ Log the confusion matrix, with expected labels as rows and predictions as columns, and the timing
+        histogram """
+        if self.confusion is None:
+            return
+        names = [str(label) for label in self.labels]
+        width = max(len(n) for n in names)
+        self.logger.info("Confusion matrix (rows are expected, columns are predicted):")
+        self.logger.info(" " * width + " " + " ".join(n.rjust(width) for n in names))
+        for name, row in zip(names, self.confusion):
+            self.logger.info(name.rjust(width) + " " + " ".join(str(x).rjust(width) for x in row))
+        counts, edges = self.get_timing_histogram()
+        self.logger.info("Prediction time histogram (ms):")
+        for count, low, high in zip(counts, edges[:-1], edges[1:]):
+            self.logger.info("  {:10.4f} - {:10.4f}: {}".format(low, high, count))
+
     def run_test(self, featurizer_model, classifier_model, list_file, max_tests, dataset, categories, sample_rate,
-                 auto_scale, output_file):
+                 auto_scale, output_file, num_workers=1, seed=0):
         """
         Run the test using the given input models (featurizer and classifier) which may or may not be compiled.
         The test set is defined by a list_file or a dataset.  The list file lists .wav files which we will featurize
         using the given featurizer.  The dataset contains pre-featurized data as created by make_dataset.py.
         The categories define the names of the keywords detected by the classifier and the sample_rate defines the
         audio sample rate in Hertz -- all input audio is resampled at this rate before featurization.
+        If max_tests is given then that many tests are chosen at random using the given seed, so repeated runs
+        test the same subset.  If num_workers is more than 1 the tests are sharded over that many processes, each
+        loading its own copy of the models, and the results are merged in the original test order.
         """
-        predictor = classifier.AudioClassifier(classifier_model, categories, THRESHOLD, SMOOTHING)
-        transform = featurizer.AudioTransform(featurizer_model, predictor.input_size)
+        predictor, transform = self.load_models(featurizer_model, classifier_model, categories, sample_rate)
 
         if not self.silent:
             self.logger.info("Evaluation with transform input size {}, output size {}".format(
@@ -136,10 +225,10 @@ class AudioModelTester:
             self.logger.info("Evaluation with classifier input size {}, output size {}".format(
                 predictor.input_size, predictor.output_size))
 
-        if transform.using_map != predictor.using_map:
-            raise Exception("cannot mix .ell and compiled models")
-
         failed_tests = []
+        rng = np.random.RandomState(seed)
+        initargs = (featurizer_model, classifier_model, categories, sample_rate, auto_scale, self.reset,
+                    self.logger.verbosity)
 
         if list_file:
             with open(list_file, "r") as fp:
@@ -148,48 +237,65 @@ class AudioModelTester:
             wav_dir = os.path.dirname(list_file)
 
             if max_tests:
-                testlist = np.random.choice(testlist, max_tests, replace=False)
-
-            start = time.time()
-
-            for name in testlist:
-                # e.g. bed/28497c5b_nohash_0.wav
-                expected = name.split('/')[0]
-                wav_file = os.path.join(wav_dir, name)
-                # open the wav file.
-                reader = wav_reader.WavReader(sample_rate, 1, auto_scale)
-                reader.open(wav_file, transform.input_size, None)
-                transform.open(reader)
-                prediction, confidence, _, elapsed = self.get_prediction(name, transform, predictor)
-                if not self.process_prediction(name, prediction, expected, confidence):
-                    failed_tests += [name]
-                if self.best_time is None or elapsed < self.best_time:
-                    self.best_time = elapsed
+                testlist = [testlist[i] for i in np.sort(rng.choice(len(testlist), max_tests, replace=False))]
+
+            # e.g. bed/28497c5b_nohash_0.wav
+            names = testlist
+            expected_labels = [name.split('/')[0] for name in testlist]
+            shards = ((wav_dir, testlist[i:i + SHARD_SIZE]) for i in range(0, len(testlist), SHARD_SIZE))
+            worker = _test_files
+
+            def run_sequential():
+                for name in testlist:
+                    yield self.test_file(os.path.join(wav_dir, name), name, transform, predictor, sample_rate,
+                                         auto_scale)
 
         elif dataset:
-            if type(dataset) is str:
+            if type(dataset) is str and is_memmap(dataset):
+                features, label_index, label_table, _ = read_memmap(dataset)
+                labels = label_table[label_index]
+            elif type(dataset) is str:
                 ds = np.load(dataset)
                 features = ds['features']
-                labels = ds['labels']
+                label_index, label_table = get_label_index(ds)
+                labels = label_table[label_index]
             else:
                 features = dataset.features
                 labels = dataset.label_names
 
-            index = 0
+            rows = np.arange(len(features))
+            if max_tests:
+                rows = np.sort(rng.choice(len(features), max_tests, replace=False))
+
+            names = ["row " + str(index) for index in rows]
+            expected_labels = [labels[index] for index in rows]
+            # the shards are only read from the dataset as they are sent to the workers
+            shards = ((names[i:i + SHARD_SIZE], np.asarray(features[rows[i:i + SHARD_SIZE]]))
+                      for i in range(0, len(rows), SHARD_SIZE))
+            worker = _test_rows
+
+            def run_sequential():
+                for name, index in zip(names, rows):
+                    yield self.test_rows(name, features[index], predictor)
+        else:
+            raise Exception("Missing list_file and dataset arguments")
+
+        def record_all(results):
+            for name, expected, (prediction, confidence, elapsed) in zip(names, expected_labels, results):
+                if not self.record_result(name, prediction, expected, confidence, elapsed) and list_file:
+                    failed_tests.append(name)
 
-            start = time.time()
+        start = time.time()
 
-            for f in features:
-                expected = labels[index]
-                reader = FeatureReader(f, predictor.input_size)
-                name = "row " + str(index)
-                prediction, confidence, _, elapsed = self.get_prediction(name, reader, predictor)
-                self.process_prediction(name, prediction, expected, confidence)
-                if self.best_time is None or elapsed < self.best_time:
-                    self.best_time = elapsed
-                index += 1
+        if num_workers is None or num_workers > 1:
+            if not self.reset:
+                self.logger.warning("Without --reset each worker process sees its own continuous stream of audio")
+            num_workers = num_workers or multiprocessing.cpu_count()
+            with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=initargs) as pool:
+                results = _imap_bounded(pool, worker, shards, 2 * num_workers)
+                record_all(result for shard_results in results for result in shard_results)
         else:
-            raise Exception("Missing list_file and dataset arguments")
+            record_all(run_sequential())
 
         end = time.time()
         seconds = end - start
@@ -200,6 +306,8 @@ class AudioModelTester:
                 f.write(line)
                 f.write('\n')
 
+        if not self.silent:
+            self.print_summary()
         self.logger.info("Test completed in {:.2f} seconds".format(seconds))
         self.logger.info("{} passed, {} failed, pass rate of {:.2f} %".format(
             self.passed, self.failed, self.rate * 100))
@@ -207,6 +315,49 @@ class AudioModelTester:
         return self.rate, self.best_time
 
 
+def _imap_bounded(pool, func, items, max_pending):
+    """
+    Like pool.imap, returns the results of func on each of the items in order, but only takes the next item
+    from the iterable when fewer than max_pending are waiting for a worker, where pool.imap would read all of
+    them up front.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+# the tester and models loaded in each worker process by _init_worker.
+_worker_state = None
+
+
+def _init_worker(featurizer_model, classifier_model, categories, sample_rate, auto_scale, reset, verbosity):
+    global _worker_state
+    if not logger.initialized():
+        logger.init(verbosity)  # worker processes that are spawned rather than forked start without a logger
+    tester = AudioModelTester(reset)
+    predictor, transform = tester.load_models(featurizer_model, classifier_model, categories, sample_rate)
+    _worker_state = (tester, predictor, transform, sample_rate, auto_scale)
+
+
+def _test_files(shard):
+    """ Test the given (wav_dir, names) shard of the list file, returning a list of results """
+    tester, predictor, transform, sample_rate, auto_scale = _worker_state
+    wav_dir, names = shard
+    return [tester.test_file(os.path.join(wav_dir, name), name, transform, predictor, sample_rate, auto_scale)
+            for name in names]
+
+
+def _test_rows(shard):
+    """ Test the given (names, features) shard of the dataset rows, returning a list of results """
+    tester, predictor, _, _, _ = _worker_state
+    names, features = shard
+    return [tester.test_rows(name, f, predictor) for name, f in zip(names, features)]
+
+
 def verify_file_exists(name, path):
     if not os.path.isfile(path):
         logger.get().error("Could not find {} at: {}".format(name, path))
@@ -220,13 +371,16 @@ if __name__ == "__main__":
     parser.add_argument("--classifier", "-c", required=True,
                         help="specify path to classifier model (*.ell or compiled_folder/model_name)")
     parser.add_argument("--list_file", "-l", help="specify path to testing_list.txt")
-    parser.add_argument("--dataset", "-d", help="specify path to cached dataset file (*.npz)")
+    parser.add_argument("--dataset", "-d", help="specify path to cached dataset file (*.npz or memory mapped *.json)")
     parser.add_argument("--categories", "-cat", help="specify path to categories file", required=True)
     parser.add_argument("--sample_rate", "-s", help="specify audio sample rate (default 16000)", default=16000,
                         type=int)
     parser.add_argument("--reset", "-r", help="do a GRU reset between each test file", action="store_true")
-    parser.add_argument("--max_tests", type=int, help="maximum number of words chosen at random from each word list",
-                        default=None)
+    parser.add_argument("--max_tests", type=int, help="maximum number of tests chosen at random from the word list "
+                        "or dataset", default=None)
+    parser.add_argument("--seed", type=int, help="random seed used to choose the --max_tests (default 0)", default=0)
+    parser.add_argument("--workers", "-j", type=int, default=1,
+                        help="number of processes to shard the tests over, 0 means one per cpu (default 1)")
     parser.add_argument("--auto_scale", help="Whether to auto-scale audio input to range [-1, 1] (default false).",
                         action='store_true')
     parser.add_argument("--output", help="Name of text file to contain list of failed tests.", default="failed.txt")
@@ -247,4 +401,4 @@ if __name__ == "__main__":
 
     test = AudioModelTester(args.reset)
     test.run_test(args.featurizer, args.classifier, args.list_file, args.max_tests, args.dataset, args.categories,
-                  sample_rate, args.auto_scale, args.output)
+                  sample_rate, args.auto_scale, args.output, args.workers or None, args.seed)
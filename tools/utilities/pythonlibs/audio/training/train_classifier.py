@@ -13,7 +13,9 @@ import argparse
 import json
 import math
 import os
+import queue
 import sys
+import threading
 import time
 
 import numpy as np
@@ -25,6 +27,7 @@ from torch.autograd import Variable
 import torch.onnx
 from torch.utils.data import Dataset, DataLoader
 
+import dataset
 from training_config import TrainingConfig
 
 
@@ -392,6 +395,86 @@ class LSTMKeywordSpotter(KeywordSpotter):
         return result
 
 
+class BatchLoader:
+    """
+    An alternative to the per-item DataLoader that returns whole shuffled batches from an AudioDataset.
+    Each epoch the row indexes are shuffled and split into blocks of batch_size, and each block (sorted so
+    memory mapped features are read in file order) is gathered from the feature array with one numpy
+    indexing operation.  Batches can optionally be copied to pinned memory and prepared by a background
+    thread that keeps up to 'prefetch' batches ready.
+    """
+    def __init__(self, dataset, batch_size, shuffle=True, drop_last=True, pin_memory=False, prefetch=0):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.prefetch = prefetch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.dataset.num_rows // self.batch_size
+        return (self.dataset.num_rows + self.batch_size - 1) // self.batch_size
+
+    def _get_batches(self):
+        num_rows = self.dataset.num_rows
+        if self.shuffle:
+            indexes = np.random.permutation(num_rows)
+        else:
+            indexes = np.arange(num_rows)
+        for i in range(len(self)):
+            block = np.sort(indexes[i * self.batch_size:(i + 1) * self.batch_size])
+            audio = torch.from_numpy(np.ascontiguousarray(self.dataset.features[block], dtype=np.float32))
+            labels = torch.from_numpy(self.dataset.labels[block])
+            if self.pin_memory:
+                audio = audio.pin_memory()
+                labels = labels.pin_memory()
+            yield audio, labels
+
+    def _prefetch_batches(self):
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            # returns False if the consumer has stopped listening
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            try:
+                for batch in self._get_batches():
+                    if not put(batch):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def __iter__(self):
+        if self.prefetch > 0:
+            return self._prefetch_batches()
+        return self._get_batches()
+
+
 class AudioDataset(Dataset):
     """
     Featurized Audio in PyTorch Dataset so we can get a DataLoader that is needed for
@@ -399,35 +482,65 @@ class AudioDataset(Dataset):
     """
 
     def __init__(self, filename, keywords):
-        """ Initialize the AudioDataset from the given *.npz file """
-        self.dataset = np.load(filename)
+        """ Initialize the AudioDataset from the given *.npz file, or memory mapped *.json dataset.  The features
+        of a memory mapped dataset are not loaded into memory, they are paged in as the batches are read """
+        if dataset.is_memmap(filename):
+            features, label_index, label_table, header = dataset.read_memmap(filename)
+            parameters = header["parameters"]
+        else:
+            self.dataset = np.load(filename)
+            # get parameters saved by make_dataset.py
+            parameters = self.dataset["parameters"]
 
-        # get parameters saved by make_dataset.py
-        parameters = self.dataset["parameters"]
         self.sample_rate = int(parameters[0])
         self.audio_size = int(parameters[1])
         self.input_size = int(parameters[2])
         self.window_size = int(parameters[3])
         self.shift = int(parameters[4])
-        self.features = self.dataset["features"].astype(np.float32)
-        self.num_rows = len(self.features)
-        self.features = self.features.reshape((self.num_rows, self.window_size, self.input_size))
-        self.label_names = self.dataset["labels"]
+        if dataset.is_memmap(filename):
+            self.num_rows = len(features)
+            self.features = features.reshape((self.num_rows, self.window_size, self.input_size))
+        else:
+            self.features = self.dataset["features"].astype(np.float32)
+            self.num_rows = len(self.features)
+            self.features = self.features.reshape((self.num_rows, self.window_size, self.input_size))
+            label_index, label_table = dataset.get_label_index(self.dataset)
+        self.label_index = label_index
+        self.label_table = label_table
         self.keywords = keywords
         self.num_keywords = len(self.keywords)
         self.labels = self.to_long_vector()
+        self.batch_loader = False
+        self.pin_memory = False
+        self.prefetch = 0
         msg = "Loaded dataset {} and found sample rate {}, audio_size {}, input_size {}, window_size {} and shift {}"
         print(msg.format(os.path.basename(filename), self.sample_rate, self.audio_size, self.input_size,
                          self.window_size, self.shift))
 
+    def set_loader_options(self, batch_loader, pin_memory=False, prefetch=0):
+        """ Choose whether get_data_loader returns a BatchLoader, and with which options """
+        self.batch_loader = batch_loader
+        self.pin_memory = pin_memory
+        self.prefetch = prefetch
+
     def get_data_loader(self, batch_size):
         """ Get a DataLoader that can enumerate shuffled batches of data in this dataset """
+        if self.batch_loader:
+            return BatchLoader(self, batch_size, shuffle=True, drop_last=True, pin_memory=self.pin_memory,
+                               prefetch=self.prefetch)
         return DataLoader(self, batch_size=batch_size, shuffle=True, drop_last=True)
 
+    @property
+    def label_names(self):
+        """ the textual label of each row """
+        return self.label_table[self.label_index]
+
     def to_long_vector(self):
         """ convert the expected labels to a list of integer indexes into the array of keywords """
-        indexer = [(0 if x == "<null>" else self.keywords.index(x)) for x in self.label_names]
-        return np.array(indexer, dtype=np.longlong)
+        table = [x for x in self.label_table if x != "<null>"]
+        lookup = np.zeros(len(self.label_table), dtype=np.longlong)
+        lookup[self.label_table != "<null>"] = dataset.map_label_table(table, self.keywords)
+        return lookup[self.label_index]
 
     def __len__(self):
         """ Return the number of rows in this Dataset """
@@ -455,6 +568,14 @@ def save_json(obj, filename):
         json.dump(obj, f, indent=2)
 
 
+def get_dataset_file(folder, name):
+    """ Return the path to the named dataset, preferring the memory mapped *.json format over *.npz """
+    filename = os.path.join(folder, name + ".json")
+    if os.path.isfile(filename):
+        return filename
+    return os.path.join(folder, name + ".npz")
+
+
 def train(config, evaluate_only=False, outdir=".", detail=False):
 
     filename = config.model.filename
@@ -488,9 +609,9 @@ def train(config, evaluate_only=False, outdir=".", detail=False):
     with open(categories_file, "r") as f:
         keywords = [x.strip() for x in f.readlines()]
 
-    training_file = os.path.join(wav_directory, "training_list.npz")
-    testing_file = os.path.join(wav_directory, "testing_list.npz")
-    validation_file = os.path.join(wav_directory, "validation_list.npz")
+    training_file = get_dataset_file(wav_directory, "training_list")
+    testing_file = get_dataset_file(wav_directory, "testing_list")
+    validation_file = get_dataset_file(wav_directory, "validation_list")
 
     if not os.path.isfile(training_file):
         print("Missing file {}".format(training_file))
@@ -516,14 +637,18 @@ def train(config, evaluate_only=False, outdir=".", detail=False):
 
     print("Loading {}...".format(testing_file))
     test_data = AudioDataset(testing_file, keywords)
+    loader_options = (config.training.batch_loader, config.training.pin_memory, config.training.prefetch)
+    test_data.set_loader_options(*loader_options)
 
     log = None
     if not evaluate_only:
         print("Loading {}...".format(training_file))
         training_data = AudioDataset(training_file, keywords)
+        training_data.set_loader_options(*loader_options)
 
         print("Loading {}...".format(validation_file))
         validation_data = AudioDataset(validation_file, keywords)
+        validation_data.set_loader_options(*loader_options)
 
         print("Training model {}".format(filename))
         model = create_model(architecture, training_data.input_size, training_data.num_keywords, hidden_units,
@@ -598,6 +723,12 @@ if __name__ == '__main__':
     parser.add_argument("--num_layers", type=int, help="Number of RNN layers (1, 2 or 3)")
     parser.add_argument("--hidden_units", "-hu", help="Number of hidden units in the GRU layers")
     parser.add_argument("--use_gpu", help="Whether to use GPU for training")
+    parser.add_argument("--batch_loader", help="Whether to load whole batches at a time instead of using the "
+                        "per-item torch DataLoader")
+    parser.add_argument("--pin_memory", help="Whether the batch loader copies batches to pinned memory for faster "
+                        "transfer to the GPU")
+    parser.add_argument("--prefetch", help="Number of batches the batch loader prepares on a background thread",
+                        type=int)
 
     # or you can just specify an options file.
     parser.add_argument("--config", help="Use json file containing all these options (as per 'training_config.py')")
@@ -638,6 +769,12 @@ if __name__ == '__main__':
         config.model.filename = args.filename
     if args.use_gpu:
         config.training.use_gpu = str2bool(args.use_gpu)
+    if args.batch_loader:
+        config.training.batch_loader = str2bool(args.batch_loader)
+    if args.pin_memory:
+        config.training.pin_memory = str2bool(args.pin_memory)
+    if args.prefetch is not None:
+        config.training.prefetch = args.prefetch
     if args.categories:
         config.dataset.categories = args.categories
     if args.dataset:
@@ -47,6 +47,9 @@ class TrainingOptions:
         self.optimizer = "RMSprop"
         self.optimizer_options = OptimizerOptions()
         self.use_gpu = True
+        self.batch_loader = False  # load whole batches with BatchLoader instead of the per-item DataLoader
+        self.pin_memory = False  # BatchLoader copies batches to pinned memory for faster GPU transfer
+        self.prefetch = 2  # number of batches BatchLoader prepares on a background thread
 
 
 class TrainingConfig:
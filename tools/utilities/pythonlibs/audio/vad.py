@@ -10,7 +10,6 @@
 ###################################################################################################
 
 import numpy as np
-import math
 
 DEFAULT_TAU_UP = 1.54
 DEFAULT_TAU_DOWN = 0.074326
@@ -47,11 +46,25 @@ class VoiceActivityDetector:
         """
         if len(data) != self.window_size:
             raise Exception("data length should match window_size")
-        level = 0
-        for i in range(self.window_size):
-            level += data[i] * self.cmw.get_weight(i)
+        level = np.dot(data, self.cmw.weights) / self.window_size
+        return self._track(level)
 
-        level = level / self.window_size
+    def process_batch(self, frames):
+        """ process a 2D array of incoming audio frames, one frame per row, returning a tuple containing
+        an array of the activity signal for each frame and an array of the weighted level of each frame.
+        The state of the detector is updated exactly as if each frame was passed to process in turn.
+        """
+        frames = np.asarray(frames)
+        if frames.ndim != 2 or frames.shape[1] != self.window_size:
+            raise Exception("frames should be a 2D array with rows of length window_size")
+        levels = np.dot(frames, self.cmw.weights) / self.window_size
+        signals = np.zeros(len(levels), dtype=np.int32)
+        for i, level in enumerate(levels):
+            signals[i] = self._track(level)
+        return signals, levels
+
+    def _track(self, level):
+        """ run the activity tracker on the next weighted level """
         self.level = level
 
         t = self.count * self.frame_duration
@@ -144,14 +157,14 @@ class _CMessageWeights:
 
     def generate(self, sample_rate, window_size):
         """ generates a lookup table of size window_size """
-        self.weights = np.zeros(window_size)
         div = sample_rate / self.max_freq
         freq_step = sample_rate / window_size / div
-        for i in range(window_size):
-            w = self._get_weight(i * freq_step)
-            if w != 0:
-                w = math.pow(10, w / 20)
-            self.weights[i] = w * w
+        freqs = np.arange(window_size) * freq_step
+        f = np.searchsorted(self.freq_map, freqs)
+        inside = (f > 0) & (f < len(self.msg_weights))
+        w = np.where(inside, np.interp(freqs, self.freq_map, self.msg_weights), 0)
+        w = np.where(w != 0, np.power(10, w / 20), 0)
+        self.weights = w * w
 
     def get_weight(self, bin):
         """ lookup the weight for given bin number out of window_size bins """
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     vad_sweep.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+"""
+Parameter sweep for the VoiceActivityDetector.  Each wav file is featurized once and the per-frame
+VAD levels are cached, then a grid of activity tracker settings is evaluated against labelled speech
+intervals.  The tracker is vectorized across configurations and the grid is sharded across processes.
+
+The labels file is a json dictionary mapping each wav file (relative to the labels file) to a list of
+[start, end] speech intervals in seconds, for example: { "a.wav": [[0.5, 1.2], [2.0, 2.7]] }.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+import vad
+
+PARAMETER_NAMES = ["tau_up", "tau_down", "threshold_up", "threshold_down", "large_input", "gain_att",
+                   "level_threshold"]
+
+DEFAULT_PARAMETERS = [vad.DEFAULT_TAU_UP, vad.DEFAULT_TAU_DOWN, vad.DEFAULT_THRESHOLD_UP, vad.DEFAULT_THRESHOLD_DOWN,
+                      vad.DEFAULT_LARGE_INPUT, vad.DEFAULT_GAIN_ATT, vad.DEFAULT_LEVEL_THRESHOLD]
+
+
+def track_activity(levels, frame_duration, parameters, truth=None):
+    """
+    Run the _ActivityTracker state machine over the given levels for many configurations at once.
+    parameters - a 2D array with one row per configuration, containing the values in PARAMETER_NAMES order.
+    truth - optional boolean array with the expected speech state of each frame.
+    Returns the (num_configs, num_frames) array of signals, or when truth is given, returns arrays of the true
+    positive, false positive and false negative frame counts for each configuration.
+    """
+    parameters = np.asarray(parameters, dtype=np.float64)
+    tau_up, tau_down, threshold_up, threshold_down, large_input, gain_att, level_threshold = parameters.T
+    num_configs = len(parameters)
+    level = np.full(num_configs, 0.1)
+    signal = np.zeros(num_configs, dtype=bool)
+    last_time = 0.0
+    if truth is None:
+        signals = np.zeros((num_configs, len(levels)), dtype=np.int8)
+    else:
+        true_positives = np.zeros(num_configs, dtype=np.int64)
+        false_positives = np.zeros(num_configs, dtype=np.int64)
+        false_negatives = np.zeros(num_configs, dtype=np.int64)
+
+    for i, x in enumerate(levels):
+        time = i * frame_duration
+        dt = time - last_time
+        down = x < level
+        large = ~down & (x > large_input * level)
+        up = np.where(large, gain_att * dt / tau_up, dt / tau_up)
+        next_level = level + np.where(down, dt / tau_down, up) * (x - level)
+        level = np.where(down, np.maximum(next_level, x), np.minimum(next_level, x))
+        signal = signal | ((x > threshold_up * level) & (x > level_threshold))
+        signal = signal & ~(x < threshold_down * level)
+        last_time = time
+        if truth is None:
+            signals[:, i] = signal
+        elif truth[i]:
+            true_positives += signal
+            false_negatives += ~signal
+        else:
+            false_positives += signal
+
+    if truth is None:
+        return signals
+    return true_positives, false_positives, false_negatives
+
+
+def intervals_to_frames(intervals, num_frames, frame_time):
+    """ Convert a list of [start, end] intervals in seconds to a boolean array with one entry per frame """
+    truth = np.zeros(num_frames, dtype=bool)
+    for start, end in intervals:
+        # round away the floating point error, so with 0.01 second frames an interval starting at 0.57 seconds
+        # starts at frame 57 rather than 56, and one ending at 0.07 seconds ends with frame 6 rather than 7
+        first = int(np.floor(round(start / frame_time, 6)))
+        last = int(np.ceil(round(end / frame_time, 6)))
+        truth[first:last] = True
+    return truth
+
+
+class LevelCache:
+    """ Featurizes wav files and caches the resulting per-frame VAD levels so each file is only featurized once """
+    def __init__(self, featurizer_path, sample_rate, auto_scale, cache_dir=None):
+        import featurizer
+        self.transform = featurizer.AudioTransform(featurizer_path, 0)
+        self.sample_rate = sample_rate
+        self.auto_scale = auto_scale
+        self.detector = vad.VoiceActivityDetector(sample_rate, self.transform.output_size)
+        self.cache_dir = cache_dir
+        self.key = "{}:{}:{}:{}".format(os.path.abspath(featurizer_path), sample_rate, auto_scale,
+                                        self.transform.output_size)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _cache_path(self, wav_file):
+        stat = os.stat(wav_file)
+        key = "{}:{}:{}:{}".format(self.key, os.path.abspath(wav_file), stat.st_size, stat.st_mtime)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
+    def get_levels(self, wav_file):
+        """ Return the VAD level of each featurizer frame in the given wav file """
+        cache_path = None
+        if self.cache_dir:
+            cache_path = self._cache_path(wav_file)
+            if os.path.isfile(cache_path):
+                return np.load(cache_path)
+
+        import wav_reader
+        reader = wav_reader.WavReader(self.sample_rate, 1, self.auto_scale)
+        reader.open(wav_file, self.transform.input_size)
+        self.transform.open(reader)
+        audio = reader.read_all()
+        reader.close()
+        self.detector.reset()
+        if len(audio) == 0:
+            levels = np.zeros(0)
+        else:
+            features = self.transform.transform_batch(wav_reader.to_frames(audio, self.transform.input_size))
+            _, levels = self.detector.process_batch(features)
+
+        if cache_path:
+            np.save(cache_path, levels)
+        return levels
+
+
+# the levels and truth arrays for each file, shared with the worker processes by _init_worker.
+_sweep_data = None
+
+
+def _init_worker(data):
+    global _sweep_data
+    _sweep_data = data
+
+
+def _evaluate_configs(parameters):
+    """ Evaluate the given configurations against all the files, returning the summed tp, fp and fn counts """
+    frame_duration, files = _sweep_data
+    totals = np.zeros((3, len(parameters)), dtype=np.int64)
+    for levels, truth in files:
+        totals += np.array(track_activity(levels, frame_duration, parameters, truth))
+    return totals
+
+
+def sweep(files, frame_duration, parameters, num_workers=None, shard_size=64):
+    """
+    Evaluate every configuration in the parameters array on the given list of (levels, truth) tuples, returning
+    the precision, recall and F1 score of each configuration.  The configurations are split into shards of
+    shard_size and evaluated by num_workers processes (default is one per cpu).
+    """
+    parameters = np.asarray(parameters, dtype=np.float64)
+    shards = [parameters[i:i + shard_size] for i in range(0, len(parameters), shard_size)]
+    data = (frame_duration, files)
+    if num_workers == 1 or len(shards) == 1:
+        _init_worker(data)
+        results = [_evaluate_configs(shard) for shard in shards]
+    else:
+        with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(data,)) as pool:
+            results = pool.map(_evaluate_configs, shards)
+
+    true_positives, false_positives, false_negatives = np.concatenate(results, axis=1)
+    precision = true_positives / np.maximum(1, true_positives + false_positives)
+    recall = true_positives / np.maximum(1, true_positives + false_negatives)
+    f1 = 2 * precision * recall / np.maximum(1e-12, precision + recall)
+    return precision, recall, f1
+
+
+def make_grid(**values):
+    """ Build the configuration grid from lists of values for each of PARAMETER_NAMES, any name that is not
+    provided uses the default setting from vad.py """
+    axes = []
+    for name, default in zip(PARAMETER_NAMES, DEFAULT_PARAMETERS):
+        axes += [values.get(name) or [default]]
+    return np.array(list(itertools.product(*axes)), dtype=np.float64)
+
+
+def run_sweep(featurizer_path, labels_file, sample_rate, auto_scale, grid, cache_dir=None, num_workers=None,
+              top=5):
+    """ Run the sweep over all the files listed in the labels_file, print and return the best settings """
+    with open(labels_file, "r") as f:
+        labels = json.load(f)
+    root = os.path.dirname(os.path.abspath(labels_file))
+
+    cache = LevelCache(featurizer_path, sample_rate, auto_scale, cache_dir)
+    frame_time = cache.transform.input_size / sample_rate
+    files = []
+    for name in sorted(labels):
+        levels = cache.get_levels(os.path.join(root, name))
+        files += [(levels, intervals_to_frames(labels[name], len(levels), frame_time))]
+    print("Evaluating {} configurations on {} files".format(len(grid), len(files)))
+
+    precision, recall, f1 = sweep(files, cache.detector.frame_duration, grid, num_workers)
+    order = np.argsort(-f1)
+    for i in order[:top]:
+        settings = ", ".join("{}={:g}".format(n, v) for n, v in zip(PARAMETER_NAMES, grid[i]))
+        print("F1={:.4f} precision={:.4f} recall={:.4f}: {}".format(f1[i], precision[i], recall[i], settings))
+    best = order[0]
+    return dict(zip(PARAMETER_NAMES, grid[best])), f1[best]
+
+
+def add_sweep_args(arg_parser):
+    """ Add the sweep grid arguments to the given argparse parser """
+    for name, default in zip(PARAMETER_NAMES, DEFAULT_PARAMETERS):
+        arg_parser.add_argument("--" + name, type=lambda s: [float(x) for x in s.split(",")], default=None,
+                                help="Comma separated list of {} values to sweep (default {})".format(name, default))
+    arg_parser.add_argument("--cache_dir", help="Folder for caching the featurized levels of each wav file",
+                            default=None)
+    arg_parser.add_argument("--workers", "-j", type=int, default=None,
+                            help="Number of processes to shard the grid over (default one per cpu)")
+
+
+def get_grid(args):
+    """ Get the configuration grid from the parsed arguments """
+    return make_grid(**{name: getattr(args, name) for name in PARAMETER_NAMES})
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Sweep VoiceActivityDetector settings against labelled wav files")
+    arg_parser.add_argument("--featurizer", "-m", help="Compiled ELL model to use for generating features",
+                            required=True)
+    arg_parser.add_argument("--labels", "-l", help="Json file containing speech intervals for each wav file",
+                            required=True)
+    arg_parser.add_argument("--sample_rate", type=int, help="The sample rate that featurizer is setup to use",
+                            default=16000)
+    arg_parser.add_argument("--auto_scale", help="Auto-scale audio input to range [-1,1]", action="store_true")
+    add_sweep_args(arg_parser)
+    args = arg_parser.parse_args()
+    run_sweep(args.featurizer, args.labels, args.sample_rate, args.auto_scale, get_grid(args), args.cache_dir,
+              args.workers)
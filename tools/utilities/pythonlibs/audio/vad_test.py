@@ -32,7 +32,9 @@ import matplotlib.animation as animation
 import featurizer
 import wav_reader
 import microphone
+import sliding_window
 import vad
+import vad_sweep
 
 
 class VadTest(Frame):
@@ -62,6 +64,7 @@ class VadTest(Frame):
         self.max_spectrogram_width = 120
         self.spectrogram_image = None
         self.spectrogram_image_data = None
+        self.spectrogram_window = None
         self.show_spectrogram = True
         self.colormap_name = "inferno"
         self.min_value = 0.0
@@ -216,19 +219,27 @@ class VadTest(Frame):
         """ this need to be called if you load a new feature model, because the featurizer output size might have
         changed. """
         if self.featurizer:
-            dim = (self.featurizer.output_size, self.max_spectrogram_width)
-            self.spectrogram_image_data = np.zeros(dim, dtype=float)
+            self.reset_spectrogram_image_data()
             self.subplot.clear()
             self.spectrogram_image = self.subplot.imshow(self.spectrogram_image_data, vmin=self.min_value,
                                                          vmax=self.max_value, origin="lower", animated=True,
                                                          cmap=pyplot.get_cmap(self.colormap_name))
 
+    def reset_spectrogram_image_data(self):
+        """ start a new spectrogram image of max_spectrogram_width zero columns.  The columns are the rows of a
+        SlidingWindow that shifts one feature frame at a time and the image is a transposed view of its latest
+        window, so scrolling in a new frame does not allocate a new image """
+        width = self.max_spectrogram_width
+        self.spectrogram_window = sliding_window.SlidingWindow(width, 1)
+        self.spectrogram_window.append(np.zeros((width, self.featurizer.output_size), dtype=float))
+        for window in self.spectrogram_window.windows():
+            self.spectrogram_image_data = window.T
+
     def accumulate_spectrogram_image(self, feature_data):
         """ accumulate the feature data into the spectrogram image """
-        image_data = self.spectrogram_image_data
-        feature_data = np.reshape(feature_data, [-1, 1])
-        new_image = np.hstack((image_data, feature_data))[:, -image_data.shape[1]:]
-        image_data[:, :] = new_image
+        self.spectrogram_window.append(np.reshape(feature_data, [1, -1]))
+        for window in self.spectrogram_window.windows():
+            self.spectrogram_image_data = window.T
 
     def set_spectrogram_image(self):
         """ update the spectrogram image and the min/max values """
@@ -293,8 +304,7 @@ class VadTest(Frame):
     def init_data(self):
         """ initialize the spectrogram_image_data based on the newly loaded model info """
         if self.featurizer:
-            dim = (self.featurizer.output_size, self.max_spectrogram_width)
-            self.spectrogram_image_data = np.zeros(dim, dtype=float)
+            self.reset_spectrogram_image_data()
             if self.spectrogram_image is not None:
                 self.spectrogram_image.set_data(self.spectrogram_image_data)
 
@@ -583,8 +593,14 @@ if __name__ == "__main__":
     arg_parser.add_argument("--auto_scale", help="Auto-scale autio input to range [-1,1]", action="store_true")
     arg_parser.add_argument("--sample_rate", type=int, help="The sample rate that featurizer is setup to use",
                             default=16000)
+    arg_parser.add_argument("--sweep", help="Instead of showing the GUI, sweep the VAD settings against the speech "
+                            "intervals in the given json labels file (see vad_sweep.py)", default=None)
+    vad_sweep.add_sweep_args(arg_parser)
     args = arg_parser.parse_args()
     if args.list_devices:
         microphone.list_devices()
+    elif args.sweep:
+        vad_sweep.run_sweep(args.featurizer, args.sweep, args.sample_rate, args.auto_scale,
+                            vad_sweep.get_grid(args), args.cache_dir, args.workers)
     else:
         main(args.featurizer, args.input_device, args.wav_file, args.sample_rate, args.auto_scale)
@@ -206,6 +206,7 @@ class AudioDemo(Frame):
                 self.spectrogram_image.set_data(self.spectrogram_image_data)
 
             if self.classifier:
+                self.classifier.set_frame_duration(self.featurizer.input_size / self.sample_rate)
                 self.num_classifier_features = self.classifier.input_size // self.featurizer.output_size
                 dim = (self.num_classifier_features, self.featurizer.output_size)
                 self.classifier_feature_data = np.zeros(dim, dtype=float)
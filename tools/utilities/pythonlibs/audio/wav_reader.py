@@ -15,6 +15,68 @@ import numpy as np
 import pyaudio
 
 
+def to_frames(samples, frame_size):
+    """ Return the given 1D samples as a 2D float32 array of frame_size rows, padding the last row with zeros
+    the same way WavReader.read pads the end of a file """
+    samples = np.asarray(samples, dtype=np.float32)
+    count = int(math.ceil(len(samples) / frame_size))
+    if count * frame_size == len(samples):
+        return samples.reshape(count, frame_size)
+    frames = np.zeros((count, frame_size), dtype=np.float32)
+    frames.ravel()[:len(samples)] = samples
+    return frames
+
+
+def _get_polyphase_filter(up, down, half_width):
+    """ Design a Kaiser windowed sinc low pass filter for resampling by up/down and split it into up phases,
+    returning an array of shape (up, 2 * half_width + 1) where each row sums to one """
+    cutoff = 1 / max(up, down)
+    taps = 2 * half_width + 1
+    center = half_width * up
+    m = np.arange(2 * center + 1) - center
+    h = np.zeros(taps * up)
+    h[:len(m)] = cutoff * np.sinc(cutoff * m) * np.kaiser(len(m), 5.0)
+    phases = h.reshape(taps, up).T
+    return (phases / phases.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def resample(samples, actual_rate, requested_rate, block_size=65536):
+    """
+    Resample the given 1D array of samples, or 2D array with one column per channel, from actual_rate to
+    requested_rate using a vectorized polyphase filter.  The output is computed block_size samples at a time
+    so the temporary arrays stay small even for long files.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if actual_rate == requested_rate or len(samples) == 0:
+        return samples
+    divisor = math.gcd(int(actual_rate), int(requested_rate))
+    up = int(requested_rate) // divisor
+    down = int(actual_rate) // divisor
+    half_width = 8 * int(math.ceil(down / up))
+    phases = _get_polyphase_filter(up, down, half_width)
+    taps = phases.shape[1]
+
+    # output sample k is centered on input position k * down / up, it uses filter phase (k * down) % up and
+    # reads the taps input samples ending at (k * down) // up + 2 * half_width in the padded input.  The outputs
+    # k = r, r + up, r + 2 * up ... all share one phase and their inputs are down samples apart, so each phase is
+    # a dot product over a strided view of the input.
+    padding = [(half_width, half_width + 1)] + [(0, 0)] * (samples.ndim - 1)
+    padded = np.pad(samples, padding, mode="constant")
+    count = int(math.ceil(len(samples) * up / down))
+    output = np.zeros((count,) + samples.shape[1:], dtype=np.float32)
+    stride = padded.strides[0]
+    for r in range(min(up, count)):
+        base = (r * down) // up
+        weights = phases[(r * down) % up, ::-1]
+        rows = len(range(r, count, up))
+        for start in range(0, rows, block_size):
+            size = min(block_size, rows - start)
+            view = np.lib.stride_tricks.as_strided(padded[base + start * down:], shape=(size, taps) + padded.shape[1:],
+                                                   strides=(down * stride,) + padded.strides, writeable=False)
+            output[r + start * up:r + (start + size) * up:up] = np.tensordot(view, weights, axes=([1], [0]))
+    return output
+
+
 class WavReader:
     def __init__(self, sample_rate=16000, channels=1, auto_scale=True):
         """ Initialize the wav reader with the type of audio you want returned.
@@ -25,6 +87,7 @@ class WavReader:
         self.input_stream = None
         self.audio = pyaudio.PyAudio()
         self.wav_file = None
+        self.filename = None
         self.requested_channels = int(channels)
         self.requested_rate = int(sample_rate)
         self.buffer_size = 0
@@ -33,7 +96,8 @@ class WavReader:
         self.dtype = None
         self.auto_scale = auto_scale
         self.audio_scale_factor = 1
-        self.tail = None
+        self.pending = None
+        self.pending_count = 0
 
     def open(self, filename, buffer_size, speaker=None):
         """ open a wav file for reading
@@ -42,6 +106,7 @@ class WavReader:
         """
         self.speaker = speaker
         # open a stream on the audio input file.
+        self.filename = filename
         self.wav_file = wave.open(filename, "rb")
         self.cvstate = None
         self.read_size = int(buffer_size)
@@ -55,6 +120,9 @@ class WavReader:
         if self.requested_rate == 0:
             raise Exception("Requested rate cannot be zero")
         self.buffer_size = int(math.ceil((self.read_size * self.actual_rate) / self.requested_rate))
+        # the converted samples not returned yet, reused from one read to the next
+        self.pending = np.zeros(2 * (self.read_size + self.buffer_size) * self.actual_channels)
+        self.pending_count = 0
 
         # convert int16 data to scaled floats
         if self.sample_width == 1:
@@ -96,17 +164,9 @@ class WavReader:
                 self.actual_channels, self.requested_channels))
 
         if self.requested_channels < self.actual_channels:
-            data = np.frombuffer(data, dtype=np.int16)
-            channels = []
-            # split into separate channels
-            for i in range(self.actual_channels):
-                channels += [data[i::self.actual_channels]]
-            # drop the channels we don't want
-            channels = channels[0:self.requested_channels]
-            # zip the resulting channels back up.
-            data = np.array(list(zip(*channels))).flatten()
-            # convert back to packed bytes in PCM 16 format
-            data = bytes(np.array(data, dtype=np.int16))
+            # view the interleaved samples as one row per frame and keep the first requested_channels columns
+            data = np.frombuffer(data, dtype=self.dtype).reshape(-1, self.actual_channels)
+            data = data[:, :self.requested_channels].tobytes()
 
         return data
 
@@ -115,39 +175,69 @@ class WavReader:
         It returns the data converted to floating point numbers between -1 and 1, scaled by the range of
         values possible for the given audio format.
         """
+        data = np.zeros(self.read_size)
+        if self.read_into(data) == 0:
+            return None
+        return data
 
-        # deal with any accumulation of tails, if the tail grows to a full
-        # buffer then return it!
-        if self.tail is not None and len(self.tail) >= self.read_size:
-            data = self.tail[0:self.read_size]
-            self.tail = self.tail[self.read_size:]
-            return data
+    def read_into(self, out):
+        """ Read the next len(out) samples into the given float array, scaled like read, padding with zeros at the
+        end of the file.  Returns the number of samples read, which is 0 at the end of the file.  The converted
+        samples are staged in a buffer that is reused from one call to the next, so reading a file this way
+        only allocates what audioop needs for the rate conversion """
+        count = len(out)
+        if self.pending_count < count:
+            data = self.read_raw()
+            if data is None:
+                return 0
+
+            if self.speaker:
+                self.speaker.write(data)
+
+            samples = np.frombuffer(data, dtype=self.dtype)
+            end = self.pending_count + len(samples)
+            if end > len(self.pending):
+                grown = np.zeros(2 * end)
+                grown[:self.pending_count] = self.pending[:self.pending_count]
+                self.pending = grown
+            self.pending[self.pending_count:end] = samples
+            self.pending_count = end
+
+        # now the caller needs us to stick to our sample_size contract, but when rate conversion happens we
+        # can't be sure the data is exactly that size, so keep the rest for the next read.
+        available = min(count, self.pending_count)
+        out[:available] = self.pending[:available]
+        out[:available] *= self.audio_scale_factor
+        out[available:] = 0
+        self.pending_count -= available
+        self.pending[:self.pending_count] = self.pending[available:available + self.pending_count]
+        return available
+
+    def read_all(self):
+        """ Read the rest of the file in one go, returning a 1D float32 array of samples at the requested rate with
+        the requested channels interleaved, scaled like read but without the zero padding at the end.  This is
+        much faster than reading chunk by chunk for offline processing.  Rate conversion uses the polyphase
+        filter in resample rather than audioop.ratecv, so the samples can differ slightly from what read
+        returns when the rates differ. """
+        if self.wav_file is None:
+            return np.zeros(0, dtype=np.float32)
+        if self.requested_channels > self.actual_channels:
+            raise Exception("Cannot add channels, actual is {}, requested is {}".format(
+                self.actual_channels, self.requested_channels))
 
-        data = self.read_raw()
-        if data is None:
-            return None
+        data = self.wav_file.readframes(self.wav_file.getnframes() - self.wav_file.tell())
+        samples = np.frombuffer(data, dtype=self.dtype).reshape(-1, self.actual_channels)
+        samples = resample(samples[:, :self.requested_channels], self.actual_rate, self.requested_rate)
+        samples = samples.reshape(-1)
+        if self.pending_count:
+            samples = np.concatenate((self.pending[:self.pending_count].astype(np.float32), samples))
+            self.pending_count = 0
 
         if self.speaker:
-            self.speaker.write(data)
-
-        data = np.frombuffer(data, dtype=self.dtype).astype(float)
-        if self.tail is not None:
-            # we have a tail from previous frame, so prepend it
-            data = np.concatenate((self.tail, data))
-
-        # now the caller needs us to stick to our sample_size contract, but when
-        # rate conversion happens we can't be sure that 'data' is exactly that size.
-        if len(data) > self.read_size:
-            # usually one byte extra so add this to our accumulating tail
-            self.tail = data[self.read_size:]
-            data = data[0:self.read_size]
-
-        if len(data) < self.read_size:
-            # might have reached the end of a file, so pad with zeros.
-            zeros = np.zeros(self.read_size - len(data))
-            data = np.concatenate((data, zeros))
-
-        return data * self.audio_scale_factor
+            self.speaker.write(samples.astype(self.dtype).tobytes())
+
+        samples *= self.audio_scale_factor
+        return samples
 
     def close(self):
         if self.wav_file:
@@ -20,6 +20,80 @@ sys.path.append(os.path.join(script_path, 'build'))
 sys.path.append(os.path.join(script_path, 'build/Release'))
 
 
+class ImagePreprocessor:
+    """ Prepares images for use with a model by center cropping them to a square, resizing them to the model's
+    input size and optionally re-ordering the channels from BGR to RGB, writing the result straight into a flat
+    row major (rows, columns, channels) destination buffer.  The crop for each source resolution is computed
+    once and cached, and the resize goes into a reusable staging buffer, so preparing a frame allocates nothing
+    when the caller provides the destination.  The channel re-ordering and the conversion to the destination
+    dtype (float32 by default) happen in the same pass that copies the staging buffer into the destination.
+    """
+    def __init__(self, width, height, reorder_to_rgb=False, dtype=np.float32):
+        """
+        width, height - the size of the model input
+        reorder_to_rgb - whether to re-order OpenCV's BGR channels to RGB
+        dtype - the dtype of the arrays returned when no destination buffer is given
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.reorder_to_rgb = reorder_to_rgb
+        self.dtype = dtype
+        self.plans = {}
+
+    def get_plan(self, image):
+        """ Return the (crop, staging, offset, scale) plan for images with the same shape and dtype as this one.
+        crop is the pair of slices that center crop the image, staging is the buffer the crop is resized into,
+        and offset and scale map the model input coordinates back to the source image """
+        key = (image.shape, image.dtype)
+        plan = self.plans.get(key)
+        if plan is None:
+            rows, cols = image.shape[:2]
+            size = min(rows, cols)
+            row_start = int((rows - size) / 2)
+            col_start = int((cols - size) / 2)
+            crop = (slice(row_start, row_start + size), slice(col_start, col_start + size))
+            staging = np.zeros((self.height, self.width) + image.shape[2:], dtype=image.dtype)
+            plan = (crop, staging, (col_start, row_start), (size / self.width, size / self.height))
+            self.plans[key] = plan
+        return plan
+
+    def input_size(self, image):
+        """ Return the number of values in the prepared version of the given image """
+        channels = image.shape[2] if image.ndim > 2 else 1
+        return self.height * self.width * channels
+
+    def resize(self, image):
+        """ Center crop and resize the image, returning the (resized, offset, scale) where resized is a view of
+        the staging buffer that is only valid until the next image of the same shape is resized """
+        crop, staging, offset, scale = self.get_plan(image)
+        cropped = image[crop]
+        if cropped.shape[:2] == staging.shape[:2]:
+            np.copyto(staging, cropped)
+        else:
+            cv2.resize(cropped, (self.width, self.height), dst=staging)
+        return staging, offset, scale
+
+    def prepare(self, image, out=None):
+        """ Prepare the image, writing the values into out (converting to its dtype) when given, otherwise into a
+        new flat array of self.dtype """
+        resized, _, _ = self.resize(image)
+        if self.reorder_to_rgb and resized.ndim > 2:
+            resized = resized[..., ::-1]
+        if out is None:
+            out = np.empty(self.input_size(image), dtype=self.dtype)
+        np.copyto(out.reshape(resized.shape), resized, casting="unsafe")
+        return out
+
+    def prepare_batch(self, images, out=None):
+        """ Prepare a list of images into the rows of out (a new (len(images), size) array if not given) so a
+        batch of frames can be handed to the model in one buffer """
+        if out is None:
+            out = np.empty((len(images), self.input_size(images[0])), dtype=self.dtype)
+        for i, image in enumerate(images):
+            self.prepare(image, out[i])
+        return out
+
+
 def prepare_image_for_model(image, requiredWidth, requiredHeight, reorder_to_rgb=False, convert_to_float=True):
     """ Prepare an image for use with a model. Typically, this involves:
         - Resize and center crop to the required width and height while
@@ -28,32 +102,12 @@ def prepare_image_for_model(image, requiredWidth, requiredHeight, reorder_to_rgb
         classify images.
         - OpenCV gives the image in BGR order, so we may need to re-order the
         channels to RGB.
-        - Convert the OpenCV result to a std::vector<float> for use with ELL
+        - Convert the OpenCV result to a flat float32 vector for use with ELL
         model
+        Use an ImagePreprocessor directly to avoid the per call allocations when preparing many images.
     """
-    if image.shape[0] > image.shape[1]:  # Tall (more rows than cols)
-        rowStart = int((image.shape[0] - image.shape[1]) / 2)
-        rowEnd = rowStart + image.shape[1]
-        colStart = 0
-        colEnd = image.shape[1]
-    else:  # Wide (more cols than rows)
-        rowStart = 0
-        rowEnd = image.shape[0]
-        colStart = int((image.shape[1] - image.shape[0]) / 2)
-        colEnd = colStart + image.shape[0]
-    # Center crop the image maintaining aspect ratio
-    cropped = image[rowStart:rowEnd, colStart:colEnd]
-    # Resize to model's requirements
-    resized = cv2.resize(cropped, (requiredHeight, requiredWidth))
-    # Re-order if needed
-    if reorder_to_rgb:
-        resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-    if convert_to_float:
-        # Return as a vector of floats
-        result = resized.astype(np.float).ravel()
-    else:
-        result = resized.ravel()
-    return result
+    dtype = np.float32 if convert_to_float else image.dtype
+    return ImagePreprocessor(requiredWidth, requiredHeight, reorder_to_rgb, dtype).prepare(image)
 
 
 def get_top_n_predictions(predictions, N=5, threshold=0.20):
@@ -10,25 +10,228 @@
 ####################################################################################################
 import argparse
 import json
+import math
 import psutil
+import signal
 import statistics
-from time import sleep
+import subprocess
+import sys
+import threading
+import time
+
+PERCENTILES = [50, 95, 99]
+
+
+class StreamingHistogram:
+    """ Tracks the count, mean, min, max and approximate percentiles of a stream of non-negative values in
+    constant memory.  Values are counted in logarithmic buckets that are 'precision' apart (relative), so the
+    percentiles are accurate to about half that precision, no matter how long the stream is.
+    """
+    def __init__(self, precision=0.02):
+        self.log_base = math.log1p(precision)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self.zeros += 1
+        else:
+            index = int(math.floor(math.log(value) / self.log_base))
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p):
+        """ Return the approximate p'th percentile (0-100) of the values added so far """
+        if not self.count:
+            return 0
+        rank = p / 100 * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # the middle of the bucket, clamped to the observed range
+                value = math.exp((index + 0.5) * self.log_base)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        result = {"count": self.count, "mean": self.mean(), "min": self.min or 0, "max": self.max or 0}
+        for p in PERCENTILES:
+            result["p{}".format(p)] = self.percentile(p)
+        return result
+
+
+class ProcessStats:
+    """ The running statistics of the samples taken by a ProcessMonitor in streaming mode """
+    def __init__(self):
+        self.histograms = {name: StreamingHistogram() for name in ["cpu_percent", "resident_set_b"]}
+        self.sample_count = 0
+        self.num_threads_total = 0
+        self.system_cpu_totals = []
+        self.last = None
+
+    def add(self, sample):
+        """ Update the statistics with the given sample """
+        self.sample_count += 1
+        self.histograms["cpu_percent"].add(sample["cpu_percent"])
+        self.histograms["resident_set_b"].add(sample["resident_set_b"])
+        self.num_threads_total += sample["num_threads"]
+        system_cpu_percent = sample["system_cpu_percent"]
+        if len(self.system_cpu_totals) < len(system_cpu_percent):
+            self.system_cpu_totals += [0] * (len(system_cpu_percent) - len(self.system_cpu_totals))
+        for i, x in enumerate(system_cpu_percent):
+            self.system_cpu_totals[i] += x
+        self.last = sample
+
+    def summary(self):
+        summary = {}
+        if not self.sample_count:
+            return summary
+        count = self.sample_count
+        summary["sample_count"] = count
+        summary["mean_cpu_percent"] = self.histograms["cpu_percent"].mean()
+        summary["mean_num_threads"] = self.num_threads_total / count
+        summary["mean_system_cpu_percent"] = [x / count for x in self.system_cpu_totals]
+        summary["user_cpu_time_s"] = self.last["user_cpu_time_s"]
+        summary["system_cpu_time_s"] = self.last["system_cpu_time_s"]
+        summary["mean_resident_set_b"] = self.histograms["resident_set_b"].mean()
+        summary["cpu_percent"] = self.histograms["cpu_percent"].summary()
+        summary["resident_set_b"] = self.histograms["resident_set_b"].summary()
+        return summary
 
 
 class ProcessMonitor:
-    def __init__(self, process_id, output_file, interval):
+    def __init__(self, process_id, output_file, interval, stream=False, children=False):
+        """
+        process_id - the process to monitor
+        output_file - the file to write the results to
+        interval - the time between samples in seconds
+        stream - append one compact json sample per line to the output file as they are taken, between a run
+            header line and a summary line, instead of keeping every sample in memory and writing them all at the
+            end.  Appending lets several monitored runs share one file, see read_stream
+        children - include the child processes in the cpu, memory and thread totals
+        """
         self.output_file = output_file
         self.interval = interval
+        self.stream = stream
+        self.children = children
         self.process = psutil.Process(process_id)
+        self.child_processes = {}
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = ProcessStats()
+
+    def get_processes(self):
+        """ Return the monitored process and (if enabled) its current children.  The child Process objects are
+        kept from one sample to the next because cpu_percent measures the time since the previous call """
+        if not self.children:
+            return [self.process]
+        current = {}
+        try:
+            for child in self.process.children(recursive=True):
+                current[child.pid] = self.child_processes.get(child.pid, child)
+        except psutil.AccessDenied:
+            pass
+        self.child_processes = current
+        return [self.process] + list(current.values())
+
+    def sample(self):
+        """ Take one compact sample of the monitored processes """
+        cpu_percent = 0
+        rss = 0
+        vms = 0
+        num_threads = 0
+        user = 0
+        system = 0
+        for i, p in enumerate(self.get_processes()):
+            try:
+                with p.oneshot():
+                    cpu_percent += p.cpu_percent()
+                    memory = p.memory_info()
+                    times = p.cpu_times()
+                    num_threads += p.num_threads()
+            except psutil.NoSuchProcess:
+                if i == 0:
+                    raise
+                continue  # a child exited while we were sampling
+            rss += memory.rss
+            vms += memory.vms
+            user += times.user
+            system += times.system
+        return {"time": time.time(), "cpu_percent": cpu_percent, "resident_set_b": rss, "virtual_memory_b": vms,
+                "num_threads": num_threads, "user_cpu_time_s": user, "system_cpu_time_s": system,
+                "num_processes": 1 + len(self.child_processes),
+                "system_cpu_percent": psutil.cpu_percent(interval=None, percpu=True)}
 
     def start(self):
         """While the process is running, monitor its vitals (e.g. resource usage)
            and log the results
         """
+        if self.stream:
+            self.run_streaming()
+        else:
+            self.run()
+
+    def start_thread(self):
+        """ Start monitoring on a background thread, call stop to finish and write the results """
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.start, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stop monitoring, waiting for the background thread (if any) to write the results """
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start_thread()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def samples(self):
+        """ Yield a sample every interval until the process exits or stop is called """
+        # first call is throwaway (see documentation for cpu_percent on why)
+        self.sample()
+        while not self.stopped.wait(self.interval):
+            yield self.sample()
+
+    def run_streaming(self):
+        self.stats = ProcessStats()
+        with open(self.output_file, 'a', encoding='utf-8') as outfile:
+            # start on a new line in case a previous monitor was killed in the middle of writing a line
+            header = {"run": {"pid": self.process.pid, "time": time.time(), "children": self.children}}
+            outfile.write(("\n" if outfile.tell() else "") + json.dumps(header, separators=(',', ':')) + "\n")
+            try:
+                for sample in self.samples():
+                    self.stats.add(sample)
+                    outfile.write(json.dumps(sample, separators=(',', ':')) + "\n")
+                    outfile.flush()
+            except psutil.NoSuchProcess:
+                print("Process has exited")
+            finally:
+                outfile.write(json.dumps({"summary": self.stats.summary()}, separators=(',', ':')) + "\n")
+
+    def run(self):
         stats = []
         try:
             firstcall = True
-            while True:
+            while not self.stopped.is_set():
                 stat = self.process.as_dict(attrs=[
                     'cpu_times', 'cpu_percent', 'num_threads', 'memory_info'])
                 stat['timestamp'] = psutil.boot_time()
@@ -41,7 +244,7 @@ class ProcessMonitor:
                 else:
                     stats.append(stat)
 
-                sleep(self.interval)
+                self.stopped.wait(self.interval)
 
         except psutil.NoSuchProcess:
             print("Process has exited")
@@ -59,6 +262,8 @@ class ProcessMonitor:
 
     def summarize(self, stats):
         summary = {}
+        if not stats:
+            return summary
 
         # 'cpu_percent' is an aggregate across the logical CPUs in use
         summary["mean_cpu_percent"] = statistics.mean([x['cpu_percent'] for x in stats])
@@ -74,19 +279,103 @@ class ProcessMonitor:
         summary["mean_resident_set_b"] = statistics.mean([x['memory_info'].rss for x in stats])
         summary["mean_virtual_memory_b"] = statistics.mean([x['memory_info'].vms for x in stats])
 
+        cpu = StreamingHistogram()
+        rss = StreamingHistogram()
+        for x in stats:
+            cpu.add(x['cpu_percent'])
+            rss.add(x['memory_info'].rss)
+        summary["cpu_percent"] = cpu.summary()
+        summary["resident_set_b"] = rss.summary()
+
         return summary
 
 
+def read_stream(filename):
+    """ Read a file written in streaming mode, returning a list with the (header, samples, summary) of each
+    monitored run in the order they were appended.  If a monitor was killed before it could write the summary,
+    the summary is recomputed from the samples """
+    runs = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue  # a line may be incomplete if the monitor was killed while writing it
+            if "run" in item or not runs:
+                runs.append((item.get("run", {}), [], None))
+                if "run" in item:
+                    continue
+            header, samples, summary = runs[-1]
+            if "summary" in item:
+                runs[-1] = (header, samples, item["summary"])
+            else:
+                samples.append(item)
+
+    result = []
+    for header, samples, summary in runs:
+        if summary is None:
+            stats = ProcessStats()
+            for sample in samples:
+                stats.add(sample)
+            summary = stats.summary()
+        result.append((header, samples, summary))
+    return result
+
+
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Monitor the resource usage of a process, or of a command given after '--', for example:\n"
+        "    python procmon.py 1234 --logfile results.json\n"
+        "    python procmon.py --stream --children --logfile results.ndjson -- python demo.py ...")
 
     # required arguments
-    parser.add_argument("process_id", type=int, help="process identifier to monitor")
+    parser.add_argument("process_id", type=int, nargs="?", help="process identifier to monitor")
 
     # options
     parser.add_argument("--interval", type=float, default=1, help="monitoring interval in seconds")
     parser.add_argument("--logfile", help="path to the output file")
-    args = parser.parse_args()
+    parser.add_argument("--stream", action="store_true",
+                        help="append one json sample per line as they are taken (requires --logfile)")
+    parser.add_argument("--children", action="store_true", help="include child processes in the totals")
+
+    argv = sys.argv[1:]
+    command = []
+    if "--" in argv:
+        command = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    if args.process_id is None and not command:
+        parser.error("either a process_id or a command is required")
+    if args.stream and not args.logfile:
+        parser.error("--stream requires --logfile")
+
+    proc = None
+    if args.process_id is None:
+        proc = subprocess.Popen(command)
+        args.process_id = proc.pid
+
+    # make sure the results are written if we are killed
+    def on_terminate(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, on_terminate)
 
-    pm = ProcessMonitor(args.process_id, args.logfile, args.interval)
-    pm.start()
+    pm = ProcessMonitor(args.process_id, args.logfile, args.interval, args.stream, args.children)
+    exit_code = 0
+    try:
+        if proc:
+            pm.start_thread()
+            exit_code = proc.wait()
+        else:
+            pm.start()
+    except KeyboardInterrupt:
+        if proc:
+            proc.terminate()
+            exit_code = proc.wait()
+    finally:
+        pm.stop()
+    sys.exit(exit_code)
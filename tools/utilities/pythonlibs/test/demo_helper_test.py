@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     demo_helper_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+import unittest
+
+import cv2
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+sys.path.append(os.path.join(script_path, "..", "vision"))
+
+import modelHelpers  # noqa: E402
+import demoHelper  # noqa: E402
+import benchmark_folder  # noqa: E402
+
+INPUT_SHAPE = types.SimpleNamespace(rows=4, columns=4, channels=3)
+WEIGHTS = np.cos(np.arange(5 * 48, dtype=np.float32)).reshape(5, 48) / 256
+
+
+class FakeModel(demoHelper.EllModel):
+    """ A model that scores the images with a fixed matrix, taking the given time for each prediction """
+    def __init__(self, delay=0):
+        super(FakeModel, self).__init__()
+        self.input_shape = INPUT_SHAPE
+        self.output_size = 5
+        self.delay = delay
+
+    def predict(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+        return WEIGHTS.dot(data)
+
+
+class FakeMap:
+    """ Stands in for ell.model.Map """
+    def Compute(self, data, dtype):
+        return WEIGHTS.dot(data).astype(dtype)
+
+
+class FakeCamera(demoHelper.VideoStream):
+    """ A live camera that returns numbered random frames, raising an error after max_frames if given """
+    def __init__(self, delay=0, max_frames=None):
+        self.frames = []
+        self.delay = delay
+        self.max_frames = max_frames
+
+    def get_next_frame(self):
+        if self.delay:
+            time.sleep(self.delay)
+        if len(self.frames) == self.max_frames:
+            raise IOError("camera disconnected")
+        self.frames += [np.random.RandomState(len(self.frames)).randint(0, 256, (6, 8, 3)).astype(np.uint8)]
+        return self.frames[-1]
+
+    def index(self, frame):
+        return next(i for i, f in enumerate(self.frames) if f is frame)
+
+
+def make_helper(model, source=None):
+    helper = demoHelper.DemoHelper()
+    helper.model = model
+    helper.source = source
+    helper.preprocessor = modelHelpers.ImagePreprocessor(INPUT_SHAPE.columns, INPUT_SHAPE.rows, True)
+    return helper
+
+
+def expected_predictions(images):
+    preprocessor = modelHelpers.ImagePreprocessor(INPUT_SHAPE.columns, INPUT_SHAPE.rows, True)
+    return [WEIGHTS.dot(preprocessor.prepare(image)) for image in images]
+
+
+class PredictBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = np.random.RandomState(0).uniform(0, 255, (7, 48)).astype(np.float32)
+        self.expected = np.array([WEIGHTS.dot(row) for row in self.data])
+
+    def check_model(self, model):
+        actual = model.predict_batch(self.data)
+        self.assertEqual(actual.dtype, np.float32)
+        np.testing.assert_allclose(actual, [model.predict(row) for row in self.data], rtol=1e-6)
+        np.testing.assert_allclose(actual, self.expected, rtol=1e-5)
+
+        # the given output is filled in place, and 4D images are flattened
+        output = np.zeros((7, 5), dtype=np.float32)
+        self.assertIs(model.predict_batch(self.data.reshape(7, 4, 4, 3), output), output)
+        np.testing.assert_array_equal(output, actual)
+        with self.assertRaises(Exception):
+            model.predict_batch(self.data[:, :47])
+        with self.assertRaises(Exception):
+            model.predict_batch(self.data, output[:6])
+
+    def test_fake_model(self):
+        self.check_model(FakeModel())
+
+    def test_reference_model(self):
+        model = demoHelper.ReferenceModel("model.ell")
+        model.model = FakeMap()
+        model.input_shape = INPUT_SHAPE
+        model.output_size = 5
+        self.check_model(model)
+
+    def test_compiled_model(self):
+        model = demoHelper.CompiledModel("model", "model")
+        model.compiled_func = lambda data: WEIGHTS.dot(data)
+        model.input_shape = INPUT_SHAPE
+        model.output_size = 5
+        self.check_model(model)
+
+    def test_helper_times_per_image(self):
+        helper = make_helper(FakeModel(0.002))
+        np.testing.assert_allclose(helper.predict_batch(self.data), self.expected, rtol=1e-5)
+        self.assertEqual(helper.time_count, 7)
+        self.assertGreater(helper.get_times(), 0.0015)
+        self.assertLess(helper.get_times(), 0.1)
+
+
+class FramePipelineTest(unittest.TestCase):
+
+    def run_pipeline(self, helper, results, frames=None, drop_frames=False):
+        """ Append the (frame, predictions) from the pipeline to results, stopping after the given number """
+        pipeline = helper.start_pipeline(drop_frames=drop_frames)
+        try:
+            for frame, predictions in pipeline:
+                results += [(frame, predictions)]
+                if len(results) == frames:
+                    break
+        finally:
+            pipeline.stop()
+        return pipeline
+
+    def check_predictions(self, results):
+        expected = expected_predictions([frame for frame, _ in results])
+        for (_, predictions), e in zip(results, expected):
+            np.testing.assert_allclose(predictions, e, rtol=1e-5)
+
+    def test_every_frame(self):
+        camera = FakeCamera()
+        results = []
+        pipeline = self.run_pipeline(make_helper(FakeModel(0.002), camera), results, 20)
+        self.assertEqual([camera.index(frame) for frame, _ in results], list(range(20)))
+        self.check_predictions(results)
+        self.assertEqual(pipeline.dropped, 0)
+        self.assertEqual(pipeline.stats["predict"].count, 20)
+        self.assertGreaterEqual(pipeline.stats["latency"].mean(), pipeline.stats["predict"].mean())
+
+    def test_drop_frames(self):
+        # the camera is faster than the model, so the oldest frames are dropped
+        camera = FakeCamera(0.001)
+        results = []
+        pipeline = self.run_pipeline(make_helper(FakeModel(0.01), camera), results, 10, drop_frames=True)
+        indexes = [camera.index(frame) for frame, _ in results]
+        self.assertEqual(indexes, sorted(set(indexes)))
+        self.assertGreater(pipeline.dropped, 0)
+        self.assertGreater(indexes[-1], 10)
+        self.check_predictions(results)
+
+    def test_capture_error(self):
+        helper = make_helper(FakeModel(), FakeCamera(max_frames=5))
+        results = []
+        with self.assertRaises(IOError):
+            self.run_pipeline(helper, results)
+        self.assertLessEqual(len(results), 5)
+        self.check_predictions(results)
+
+    def test_needs_camera(self):
+        with self.assertRaises(Exception):
+            make_helper(FakeModel(), demoHelper.ImageStream()).start_pipeline()
+
+
+class BenchmarkFolderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="demo_helper_test")
+        self.images = []
+        for i in range(7):
+            image = np.random.RandomState(i).randint(0, 256, (6 + i, 8, 3)).astype(np.uint8)
+            cv2.imwrite(os.path.join(self.temp_dir, "{}.png".format(i)), image)
+            self.images += [cv2.imread(os.path.join(self.temp_dir, "{}.png".format(i)))]
+        with open(os.path.join(self.temp_dir, "labels.txt"), "w") as f:
+            f.write("not an image")
+        with open(os.path.join(self.temp_dir, "broken.png"), "w") as f:
+            f.write("not an image either")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_list_images(self):
+        files = benchmark_folder.list_images(self.temp_dir)
+        self.assertEqual([os.path.basename(f) for f in files], ["0.png", "1.png", "2.png", "3.png", "4.png", "5.png",
+                                                                "6.png", "broken.png"])
+        self.assertEqual(benchmark_folder.list_images(self.temp_dir, 2), files[:2])
+
+    def test_benchmark(self):
+        files = benchmark_folder.list_images(self.temp_dir)
+        expected = expected_predictions(self.images)
+        for batch_size in [1, 3, 16]:
+            helper = make_helper(FakeModel())
+            # the broken image is skipped
+            actual = benchmark_folder.benchmark(helper, files, batch_size)
+            self.assertEqual(actual.shape, (7, 5))
+            np.testing.assert_allclose(actual, expected, rtol=1e-5)
+            self.assertEqual(helper.time_count, 7)
+        self.assertEqual(benchmark_folder.benchmark(make_helper(FakeModel()), files[-1:], 4).shape, (0, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     model_helpers_test.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+###################################################################################################
+
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import modelHelpers  # noqa: E402
+
+
+def reference_prepare(image, width, height, reorder_to_rgb=False):
+    """ Center crop, resize and re-order the image directly with OpenCV """
+    rows, cols = image.shape[:2]
+    size = min(rows, cols)
+    row_start = int((rows - size) / 2)
+    col_start = int((cols - size) / 2)
+    cropped = image[row_start:row_start + size, col_start:col_start + size]
+    resized = cv2.resize(cropped, (width, height))
+    if reorder_to_rgb:
+        resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    return resized
+
+
+def make_image(rows, cols, seed=0):
+    return np.random.RandomState(seed).randint(0, 256, size=(rows, cols, 3)).astype(np.uint8)
+
+
+class ImagePreprocessorTest(unittest.TestCase):
+    def test_non_square_image_and_input(self):
+        # a landscape source and a model input that is wider than it is high, so swapping width and height
+        # would give a transposed result
+        image = make_image(48, 64)
+        for reorder_to_rgb in [False, True]:
+            preprocessor = modelHelpers.ImagePreprocessor(40, 24, reorder_to_rgb)
+            expected = reference_prepare(image, 40, 24, reorder_to_rgb)
+            self.assertEqual(expected.shape, (24, 40, 3))
+
+            prepared = preprocessor.prepare(image)
+            self.assertEqual(prepared.dtype, np.float32)
+            np.testing.assert_array_equal(prepared, expected.astype(np.float32).ravel())
+
+            # the staging buffer is reused, so a second frame must not see the first
+            second = make_image(48, 64, seed=1)
+            np.testing.assert_array_equal(preprocessor.prepare(second),
+                                          reference_prepare(second, 40, 24, reorder_to_rgb).ravel())
+
+    def test_portrait_image(self):
+        image = make_image(70, 30)
+        expected = reference_prepare(image, 16, 32, True)
+        np.testing.assert_array_equal(modelHelpers.prepare_image_for_model(image, 16, 32, reorder_to_rgb=True),
+                                      expected.astype(np.float32).ravel())
+
+        _, offset, scale = modelHelpers.ImagePreprocessor(16, 32).resize(image)
+        self.assertEqual(offset, (0, 20))
+        self.assertEqual(scale, (30 / 16, 30 / 32))
+
+    def test_crop_without_resize(self):
+        image = make_image(24, 40)
+        expected = image[:, 8:32]
+        np.testing.assert_array_equal(modelHelpers.ImagePreprocessor(24, 24).prepare(image),
+                                      expected.astype(np.float32).ravel())
+
+    def test_dtype_and_destination(self):
+        image = make_image(48, 64)
+        expected = reference_prepare(image, 40, 24).ravel()
+
+        prepared = modelHelpers.prepare_image_for_model(image, 40, 24, convert_to_float=False)
+        self.assertEqual(prepared.dtype, np.uint8)
+        np.testing.assert_array_equal(prepared, expected)
+
+        out = np.zeros(40 * 24 * 3, dtype=np.float64)
+        preprocessor = modelHelpers.ImagePreprocessor(40, 24)
+        self.assertIs(preprocessor.prepare(image, out), out)
+        np.testing.assert_array_equal(out, expected)
+
+    def test_prepare_batch(self):
+        images = [make_image(48, 64, seed) for seed in range(3)]
+        batch = modelHelpers.ImagePreprocessor(40, 24, True).prepare_batch(images)
+        self.assertEqual(batch.shape, (3, 40 * 24 * 3))
+        self.assertEqual(batch.dtype, np.float32)
+        for image, row in zip(images, batch):
+            np.testing.assert_array_equal(row, reference_prepare(image, 40, 24, True).ravel())
+
+
+if __name__ == "__main__":
+    unittest.main()
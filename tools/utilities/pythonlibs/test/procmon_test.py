@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+###################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     procmon_test.py
+#  Authors:  Lisa Ong
+#
+#  Requires: Python 3.x, psutil
+#
+###################################################################################################
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_path, ".."))
+
+import procmon  # noqa: E402
+
+
+def make_samples(count, seed=0):
+    rng = np.random.RandomState(seed)
+    samples = []
+    for i in range(count):
+        samples.append({"time": 1000.0 + i, "cpu_percent": float(rng.uniform(0, 400)),
+                        "resident_set_b": int(rng.randint(10**6, 10**9)),
+                        "virtual_memory_b": int(rng.randint(10**9, 2 * 10**9)),
+                        "num_threads": int(rng.randint(1, 20)), "user_cpu_time_s": 0.5 * i,
+                        "system_cpu_time_s": 0.1 * i, "num_processes": 1,
+                        "system_cpu_percent": [float(x) for x in rng.uniform(0, 100, 4)]})
+    return samples
+
+
+class StreamingHistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        rng = np.random.RandomState(0)
+        for values in [rng.lognormal(10, 2, 20000), rng.uniform(0, 100, 5000), np.arange(1, 11)]:
+            histogram = procmon.StreamingHistogram()
+            for value in values:
+                histogram.add(value)
+            self.assertEqual(histogram.count, len(values))
+            self.assertAlmostEqual(histogram.mean(), np.mean(values))
+            self.assertEqual((histogram.min, histogram.max), (values.min(), values.max()))
+            for p in [0, 1, 25, 50, 95, 99, 100]:
+                # the value at the same rank, which the histogram gets to within about half its 2% precision
+                expected = np.sort(values)[int(p / 100 * (len(values) - 1))]
+                self.assertLess(abs(histogram.percentile(p) - expected) / expected, 0.011, "p{}".format(p))
+
+    def test_zeros_and_empty(self):
+        histogram = procmon.StreamingHistogram()
+        self.assertEqual(histogram.percentile(50), 0)
+        self.assertEqual(histogram.summary(), {"count": 0, "mean": 0, "min": 0, "max": 0, "p50": 0, "p95": 0,
+                                               "p99": 0})
+        for value in [0] * 60 + [5] * 40:
+            histogram.add(value)
+        self.assertEqual(histogram.percentile(50), 0)
+        self.assertAlmostEqual(histogram.percentile(95), 5, delta=0.05)
+        self.assertEqual(histogram.summary()["mean"], 2)
+
+
+class ReadStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="procmon_test")
+        self.filename = os.path.join(self.temp_dir, "results.ndjson")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def monitor(self, samples):
+        """ Append a run with the given samples, the way ProcessMonitor does in streaming mode """
+        monitor = procmon.ProcessMonitor(os.getpid(), self.filename, 0.01, stream=True)
+        monitor.samples = lambda: iter(samples)
+        monitor.start()
+        return monitor
+
+    def test_appended_runs(self):
+        first, second = make_samples(5), make_samples(8, seed=1)
+        summaries = [self.monitor(first).stats.summary(), self.monitor(second).stats.summary()]
+        runs = procmon.read_stream(self.filename)
+        self.assertEqual(len(runs), 2)
+        for (header, samples, summary), expected, expected_summary in zip(runs, [first, second], summaries):
+            self.assertEqual(header["pid"], os.getpid())
+            self.assertEqual(samples, expected)
+            self.assertEqual(summary, expected_summary)
+        self.assertEqual(runs[1][2]["sample_count"], 8)
+        self.assertAlmostEqual(runs[1][2]["mean_cpu_percent"], np.mean([s["cpu_percent"] for s in second]))
+        self.assertEqual(runs[1][2]["user_cpu_time_s"], second[-1]["user_cpu_time_s"])
+
+    def test_truncated_run(self):
+        first, killed, last = make_samples(3), make_samples(6, seed=2), make_samples(4, seed=3)
+        self.monitor(first)
+        # a monitor that was killed in the middle of writing a sample, so it never wrote its summary
+        with open(self.filename, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"run": {"pid": 42, "time": 0, "children": False}}) + "\n")
+            for sample in killed[:5]:
+                f.write(json.dumps(sample) + "\n")
+            f.write(json.dumps(killed[5])[:40])
+        # the next run starts on a new line
+        self.monitor(last)
+
+        runs = procmon.read_stream(self.filename)
+        self.assertEqual([len(samples) for _, samples, _ in runs], [3, 5, 4])
+        header, samples, summary = runs[1]
+        self.assertEqual(header["pid"], 42)
+        self.assertEqual(samples, killed[:5])
+        # the missing summary is recomputed from the samples that were written
+        stats = procmon.ProcessStats()
+        for sample in killed[:5]:
+            stats.add(sample)
+        self.assertEqual(summary, stats.summary())
+        self.assertEqual(runs[2][1], last)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+####################################################################################################
+#
+#  Project:  Embedded Learning Library (ELL)
+#  File:     benchmark_folder.py
+#  Authors:  Chris Lovett
+#
+#  Requires: Python 3.x
+#
+####################################################################################################
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+import demoHelper as d
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp"]
+
+
+def list_images(folder, limit=None):
+    """ Return the sorted list of image files in the given folder, at most limit of them if given """
+    files = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+             if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS]
+    if limit:
+        files = files[:limit]
+    return files
+
+
+def benchmark(helper, files, batch_size, print_labels=False):
+    """ Classify the given image files in batches of batch_size, printing the time spent in each stage and
+    the overall images per second.  The input and output buffers are allocated once and reused for every batch.
+    Returns the 2D array of predictions, one row per image that loaded successfully. """
+    input_shape = helper.model.input_shape
+    input_size = input_shape.rows * input_shape.columns * input_shape.channels
+    batch = np.zeros((batch_size, input_size), dtype=np.float32)
+    output = np.zeros((batch_size, helper.model.output_size), dtype=np.float32)
+    results = []
+    load_time = 0
+    prepare_time = 0
+    predict_time = 0
+    start = time.time()
+    for pos in range(0, len(files), batch_size):
+        t0 = time.time()
+        images = []
+        names = []
+        for filename in files[pos:pos + batch_size]:
+            image = cv2.imread(filename)
+            if image is None:
+                print("Error loading image: {}".format(filename))
+            else:
+                images += [image]
+                names += [filename]
+        if not images:
+            continue
+        count = len(images)
+        t1 = time.time()
+        helper.prepare_batch(images, batch[:count])
+        t2 = time.time()
+        predictions = helper.predict_batch(batch[:count], output[:count])
+        t3 = time.time()
+        load_time += t1 - t0
+        prepare_time += t2 - t1
+        predict_time += t3 - t2
+        results += [predictions.copy()]
+        if print_labels:
+            for name, row in zip(names, predictions):
+                top = helper.get_top_n_predictions(row, 1)
+                label = "({}%) {}".format(int(top[0][1] * 100), helper.get_label(top[0][0])) if top else "unknown"
+                print("{}: {}".format(name, label))
+
+    elapsed = time.time() - start
+    total = sum(len(r) for r in results)
+    print("Classified {} images in batches of {} in {:.2f} seconds, {:.1f} images/second".format(
+        total, batch_size, elapsed, total / elapsed if elapsed else 0))
+    if total:
+        print("Per image: load {:.2f} ms, prepare {:.2f} ms, predict {:.2f} ms ({:.1f} predictions/second)".format(
+            1000 * load_time / total, 1000 * prepare_time / total, 1000 * predict_time / total,
+            total / predict_time if predict_time else 0))
+    if not results:
+        return np.zeros((0, helper.model.output_size), dtype=np.float32)
+    return np.concatenate(results)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        "Benchmarks the given ELL model on a folder of images, reporting the images per second\n"
+        "Either the ELL model file, or the compiled model's Python module must be given,\n"
+        "using the --model or --compiled_model options respectively.\n"
+        "Example:\n"
+        "   python benchmark_folder.py images --compiled_model tutorial1/pi3/model1 --batch_size 32\n")
+
+    arg_parser.add_argument("folder", help="path to the folder of images to classify")
+    arg_parser.add_argument("--labels", help="path to the labels file, needed for --print_labels", default=None)
+    arg_parser.add_argument("--model_name", help="name of the compiled model's Python module", default=None)
+    arg_parser.add_argument("--bgr", help="specify True if input data should be in BGR format (default False)",
+                            default=False)
+    arg_parser.add_argument("--batch_size", "-b", type=int, help="number of images per batch (default 16)",
+                            default=16)
+    arg_parser.add_argument("--limit", type=int, help="maximum number of images to classify", default=None)
+    arg_parser.add_argument("--print_labels", help="print the top prediction for each image", action='store_true')
+
+    group = arg_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--model", help="path to a model file")
+    group.add_argument("--compiled_model", help="path to the compiled model's Python module")
+
+    args = arg_parser.parse_args()
+
+    files = list_images(args.folder, args.limit)
+    if not files:
+        print("### Error: no images found in {}".format(args.folder))
+        return
+
+    helper = d.DemoHelper()
+    helper.bgr = args.bgr
+    helper.model_name = args.model_name
+    helper.load_model(args.labels, args.model, args.compiled_model)
+
+    benchmark(helper, files, max(1, args.batch_size), args.print_labels)
+    helper.report_times()
+
+
+if __name__ == "__main__":
+    main()
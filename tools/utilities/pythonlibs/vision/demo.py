@@ -47,6 +47,8 @@ threshold will show more prediction labels, but they have a higher chance of bei
 each image to get better timing information")
     arg_parser.add_argument("--print_labels", help="print predictions instead of drawing them on the image",
                             action='store_true')
+    arg_parser.add_argument("--pipeline", help="capture, preprocess and predict on separate threads so they overlap \
+(camera input only)", action='store_true')
 
     # mutually exclusive options
     group = arg_parser.add_mutually_exclusive_group()
@@ -68,6 +70,10 @@ list")
         print("### Error: Required one of --model or --compiled_model")
         return
 
+    if args.pipeline and (args.image or args.folder or args.list):
+        print("### Error: --pipeline can only be used with --camera")
+        return
+
     # setup some options on the demo helper
     if args.save:
         helper.save_images = True
@@ -88,16 +94,26 @@ list")
     lastPrediction = ""
     help_prompt = 60
 
+    pipeline = None
+    if args.pipeline:
+        # the pipeline grabs and prepares the next frames while the model is busy with this one
+        pipeline = helper.start_pipeline()
+        results = iter(pipeline)
+
     while (not helper.done()):
-        # Grab next frame
-        frame = helper.get_next_frame()
+        if pipeline:
+            frame, predictions = next(results)
+        else:
+            # Grab next frame
+            frame = helper.get_next_frame()
 
-        # Prepare the image to send to the model.
-        # This involves scaling to the required input dimension and re-ordering from BGR to RGB
-        data = helper.prepare_image_for_predictor(frame)
+            # Prepare the image to send to the model.
+            # This involves scaling to the required input dimension and re-ordering from BGR to RGB
+            data = helper.prepare_image_for_predictor(frame)
 
-        # Get the model to classify the image, by returning a list of probabilities for the classes it can detect
-        predictions = helper.predict(data)
+            # Get the model to classify the image, by returning a list of probabilities for the classes it can
+            # detect
+            predictions = helper.predict(data)
 
         # Get the (at most) top 5 predictions that meet our threshold. This is returned as a list of tuples,
         # each with the text label and the prediction score.
@@ -130,8 +146,12 @@ list")
             # Show the new frame
             helper.show_image(frameToShow, save)
 
+    if pipeline:
+        pipeline.stop()
     print("Last prediction: " + lastPrediction)
     helper.report_times()
+    if pipeline:
+        pipeline.report()
 
 
 if __name__ == "__main__":
@@ -10,7 +10,9 @@
 ####################################################################################################
 
 import os
+import queue
 import sys
+import threading
 import cv2
 import numpy as np
 import time
@@ -18,6 +20,8 @@ import time
 script_path = os.path.dirname(os.path.abspath(__file__))
 sys.path += [os.path.join(script_path, "..")]
 
+import modelHelpers
+
 
 class EllModel:
     """ this is the base class for interacting with ELL models """
@@ -32,6 +36,28 @@ class EllModel:
     def predict(self, data):
         return None
 
+    def get_predict_function(self):
+        """ return the function that predict_batch calls on each input vector """
+        return self.predict
+
+    def predict_batch(self, data, output=None):
+        """ predict each row of the given 2D float32 array of preprocessed images, returning a 2D float32 array
+        with one row of outputs per image.  The optional output array of shape (len(data), output_size) is
+        filled in place, so the caller can reuse it from one batch to the next """
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        data = data.reshape(len(data), -1)
+        input_size = self.input_shape.rows * self.input_shape.columns * self.input_shape.channels
+        if data.shape[1] != input_size:
+            raise Exception("Expecting images of size {}, but got {}".format(input_size, data.shape[1]))
+        if output is None:
+            output = np.zeros((len(data), self.output_size), dtype=np.float32)
+        elif output.shape != (len(data), self.output_size):
+            raise Exception("Expecting output of shape ({}, {})".format(len(data), self.output_size))
+        predict = self.get_predict_function()
+        for i in range(len(data)):
+            output[i] = predict(data[i])
+        return output
+
     def print_profile_info(self, node_level):
         pass
 
@@ -103,6 +129,9 @@ have you compiled this project yet?")
     def predict(self, data):
         return self.compiled_func(data)
 
+    def get_predict_function(self):
+        return self.compiled_func
+
     def print_profile_info(self, node_level):
         # if the model is compiled with profiling enabled, report the additional info
         print("==== Profile ====")
@@ -141,6 +170,10 @@ class ReferenceModel(EllModel):
     def predict(self, data):
         return self.model.Compute(data, dtype=np.float32)
 
+    def get_predict_function(self):
+        compute = self.model.Compute
+        return lambda data: compute(data, dtype=np.float32)
+
 
 class ImageStream:
     def __init__(self):
@@ -235,6 +268,167 @@ class StaticImageList(ImageStream):
         return frame
 
 
+class StageStats:
+    """ Keeps latency statistics for one stage of a FramePipeline, over all frames and for the most recent ones """
+    def __init__(self, name, history=1000):
+        self.name = name
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.recent = np.zeros(history)
+
+    def add(self, seconds):
+        self.recent[self.count % len(self.recent)] = seconds
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p):
+        """ Return the given percentile of the recent latencies """
+        if not self.count:
+            return 0
+        return np.percentile(self.recent[:min(self.count, len(self.recent))], p)
+
+    def __str__(self):
+        return "{:>12}: mean {:.2f} ms, p50 {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms over {} frames".format(
+            self.name, self.mean() * 1000, self.percentile(50) * 1000, self.percentile(95) * 1000, self.max * 1000,
+            self.count)
+
+
+class FramePipeline:
+    """
+    Runs the capture, preprocessing and prediction of a DemoHelper as a pipeline, so on a multicore machine the
+    frame rate approaches the throughput of the slowest stage instead of the sum of all the stages.  Frames are
+    captured on one thread and preprocessed on another into a small pool of preallocated float32 input buffers,
+    connected by bounded queues, and iterating over the pipeline runs the predictions on the calling thread (so
+    the GUI can stay on the main thread) and yields each (frame, predictions) pair.
+
+    The input must be a live camera.  When drop_frames is True and the capture queue is full the oldest captured
+    frame is dropped, which keeps the latency low.  Otherwise the capture thread waits, so every frame is processed.
+    """
+    def __init__(self, helper, queue_size=1, drop_frames=True):
+        self.helper = helper
+        self.drop_frames = drop_frames
+        self.captured = queue.Queue(queue_size)
+        self.ready = queue.Queue()
+        self.free = queue.Queue()
+        shape = helper.model.input_shape
+        for i in range(3):  # one being prepared, one waiting and one being predicted
+            self.free.put(np.zeros(shape.rows * shape.columns * shape.channels, dtype=np.float32))
+        self.stats = {name: StageStats(name) for name in ["capture", "preprocess", "predict", "latency"]}
+        self.dropped = 0
+        self.error = None
+        self.stopped = threading.Event()
+        self.threads = []
+        self.start_time = None
+
+    def start(self):
+        """ Start the capture and preprocessing threads """
+        self.stopped.clear()
+        self.start_time = time.time()
+        self.threads = [threading.Thread(target=self._run, args=(self._capture,), daemon=True),
+                        threading.Thread(target=self._run, args=(self._preprocess,), daemon=True)]
+        for t in self.threads:
+            t.start()
+        return self
+
+    def stop(self):
+        """ Stop the pipeline threads """
+        self.stopped.set()
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def _run(self, stage):
+        try:
+            while not self.stopped.is_set():
+                stage()
+        except Exception as e:
+            self.error = e
+            self.stopped.set()
+
+    def _put(self, q, item):
+        """ Put the item in the given queue, waiting while it is full unless the pipeline is stopped """
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        """ Get the next item from the given queue, or None if the pipeline is stopped """
+        while not self.stopped.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _capture(self):
+        start = time.time()
+        frame = self.helper.get_next_frame()
+        self.stats["capture"].add(time.time() - start)
+        item = (frame, start)
+        if not self.drop_frames:
+            self._put(self.captured, item)
+            return
+        while True:
+            try:
+                self.captured.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.captured.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _preprocess(self):
+        item = self._get(self.captured)
+        if item is None:
+            return
+        buffer = self._get(self.free)
+        if buffer is None:
+            return
+        frame, captured = item
+        start = time.time()
+        self.helper.prepare_image_for_predictor(frame, buffer)
+        self.stats["preprocess"].add(time.time() - start)
+        self._put(self.ready, (frame, buffer, captured))
+
+    def __iter__(self):
+        """ Yield the (frame, predictions) for each frame that makes it through the pipeline until stopped """
+        while True:
+            item = self._get(self.ready)
+            if item is None:
+                if self.error:
+                    raise self.error
+                return
+            frame, buffer, captured = item
+            start = time.time()
+            predictions = self.helper.predict(buffer)
+            now = time.time()
+            self.free.put(buffer)
+            self.stats["predict"].add(now - start)
+            self.stats["latency"].add(now - captured)
+            yield frame, predictions
+
+    def report(self):
+        """ Print the per stage latency statistics """
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        frames = self.stats["predict"].count
+        print("==== Pipeline ====")
+        for stats in self.stats.values():
+            print(stats)
+        print("{} frames in {:.2f} seconds ({:.1f} fps), {} frames dropped".format(
+            frames, elapsed, frames / elapsed if elapsed else 0, self.dropped))
+
+
 # Helper class that interfaces with ELL models to get predictions and provides handy conversion from opencv to ELL
 # buffers and rendering utilities
 class DemoHelper:
@@ -289,7 +483,7 @@ class DemoHelper:
 
         # load the labels
         self.labels_file = labels_file
-        self.labels = self.load_labels(self.labels_file)
+        self.labels = self.load_labels(self.labels_file) if self.labels_file else []
 
         # process model options and load the model
         if model_file:
@@ -301,6 +495,8 @@ class DemoHelper:
         self.model.load()
 
         self.input_size = (self.model.input_shape.rows, self.model.input_shape.columns)
+        self.preprocessor = modelHelpers.ImagePreprocessor(self.model.input_shape.columns,
+                                                           self.model.input_shape.rows, not self.bgr)
 
     def show_image(self, frameToShow, save):
         try:
@@ -341,6 +537,15 @@ class DemoHelper:
         self.time_count = self.time_count + 1
         return self.results
 
+    def predict_batch(self, data, output=None):
+        """Predict a batch of images prepared by prepare_batch, returning one row of predictions per image.
+        The average prediction time reported by get_times is per image."""
+        start = time.time()
+        results = self.model.predict_batch(data, output)
+        self.total_time += time.time() - start
+        self.time_count += len(results)
+        return results
+
     def get_times(self):
         """Returns the average prediction time, if available."""
         average_time = None
@@ -397,28 +602,30 @@ class DemoHelper:
 
     def resize_image(self, image, newSize):
         """Crops, resizes image to outputshape. Returns image as numpy array in in RGB order."""
-        if image.shape[0] > image.shape[1]:  # Tall (more rows than cols)
-            rowStart = int((image.shape[0] - image.shape[1]) / 2)
-            rowEnd = rowStart + image.shape[1]
-            colStart = 0
-            colEnd = image.shape[1]
-        else:  # Wide (more cols than rows)
-            rowStart = 0
-            rowEnd = image.shape[0]
-            colStart = int((image.shape[1] - image.shape[0]) / 2)
-            colEnd = colStart + image.shape[0]
-
-        cropped = image[rowStart:rowEnd, colStart:colEnd]
-        resized = cv2.resize(cropped, newSize)
+        width, height = newSize
+        resized, _, _ = modelHelpers.ImagePreprocessor(width, height).resize(image)
         return resized
 
-    def prepare_image_for_predictor(self, image):
-        """Crops, resizes image to outputshape. Returns image as numpy array in in RGB order."""
-        resized = self.resize_image(image, self.input_size)
-        if not self.bgr:
-            resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
-        resized = resized.astype(np.float).ravel()
-        return resized
+    def prepare_image_for_predictor(self, image, out=None):
+        """Crops, resizes image to outputshape. Returns image as a flat float32 numpy array in RGB order (unless
+        bgr is set). If the optional out array is given the result is written into it (converting to its dtype)
+        and it is returned instead of allocating a new array."""
+        self.preprocessor.reorder_to_rgb = not self.bgr
+        return self.preprocessor.prepare(image, out)
+
+    def prepare_batch(self, images, out=None):
+        """Prepares a list of images for predict_batch, writing them into the rows of the optional out array,
+        or a new 2D float32 array."""
+        self.preprocessor.reorder_to_rgb = not self.bgr
+        return self.preprocessor.prepare_batch(images, out)
+
+    def start_pipeline(self, queue_size=1, drop_frames=True):
+        """Start a FramePipeline over the current input and model.  The input must be a live camera, since image
+        files are advanced by done() on the main thread, which the capture thread would run ahead of, so the
+        image_filename would not match the frame being predicted"""
+        if not isinstance(self.source, VideoStream):
+            raise Exception("the frame pipeline needs a live camera, not an image file, folder or list")
+        return FramePipeline(self, queue_size, drop_frames).start()
 
     def draw_label(self, image, label):
         """Helper to draw text label onto an image"""